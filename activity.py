@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from typing import Dict
+from models import User
+from settings import LAST_SEEN_FLUSH_INTERVAL
+from utils import current_timestamp
+
+
+class LastSeenRecorder:
+    """
+    Coalesced last seen timestamps of users.
+
+    Every authorized request only updates in-memory map, which is saved by
+    background task in one bulk statement per interval. So database load
+    depends on number of active users, not on request rate.
+    """
+    def __init__(self, flush_interval: float = LAST_SEEN_FLUSH_INTERVAL) -> None:
+        self.flush_interval = flush_interval
+        # login -> last seen timestamp
+        self.pending = {}
+        self.session_factory = None
+        self._task = None
+        self._flushing = None
+        # statistics
+        self.touches = 0
+        self.written = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+
+    def start(self, session_factory) -> None:
+        self.session_factory = session_factory
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        await self.flush()
+
+    def touch(self, login: str) -> None:
+        self.pending[login] = current_timestamp()
+        self.touches += 1
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_shielded()
+
+    async def _flush_shielded(self) -> bool:
+        # cancelling the background task doesn't interrupt a write, close() waits for it instead
+        self._flushing = asyncio.ensure_future(self.flush())
+        return await asyncio.shield(self._flushing)
+
+    async def flush(self) -> bool:
+        """
+        Save all pending timestamps, returns False on failure.
+
+        On failure timestamps are kept, unless newer ones were recorded meanwhile.
+        """
+        if not self.pending or self.session_factory is None:
+            return True
+        batch = self.pending
+        self.pending = {}
+        started = time.monotonic()
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    await User.save_last_seen(session, list(batch.items()))
+        except Exception as e:
+            logging.info('failed to save last seen of {} users: {}'.format(len(batch), e))
+            batch.update(self.pending)
+            self.pending = batch
+            self.failed_flushes += 1
+            return False
+        self.last_flush_latency = time.monotonic() - started
+        self.written += len(batch)
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            'pending': len(self.pending),
+            'touches': self.touches,
+            'written': self.written,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_latency': self.last_flush_latency
+        }
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List
+from models import Game, User, UserStats
+from settings import ARCHIVE_BATCH_SIZE, ARCHIVE_FLUSH_INTERVAL, ARCHIVE_MAX_PENDING
+
+
+class GameArchive:
+    """
+    Write-behind storage of finished games.
+
+    Records are queued in memory and written in bulk by a background task
+    when either batch size or flush interval is reached, so finishing a game
+    never waits for database. Ratings and statistics of players are saved in the same transaction.
+    """
+    def __init__(self, batch_size: int = ARCHIVE_BATCH_SIZE, flush_interval: float = ARCHIVE_FLUSH_INTERVAL,
+                 max_pending: int = ARCHIVE_MAX_PENDING) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.session_factory = None
+        self._wakeup = None
+        self._task = None
+        self._flushing = None
+        # statistics
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def start(self, session_factory) -> None:
+        self.session_factory = session_factory
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        """
+        Stop background task and write all pending records.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        while self.pending and await self.flush():
+            pass
+
+    def add(self, record: Dict) -> None:
+        """
+        Queue record of finished game.
+
+        Record contains columns of 'games' table and 'ratings' - list of (login, rating) pairs.
+        """
+        self.pending.append(record)
+        self._trim()
+        if len(self.pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        # the oldest records are dropped above the limit, e.g. while database is unavailable
+        while len(self.pending) > self.max_pending:
+            record = self.pending.pop(0)
+            self.dropped += 1
+            logging.warning('archive queue is full, dropped {} game of users {} and {} finished at {}'.format(
+                record.get('game_type'), record.get('first_user_id'), record.get('second_user_id'), record.get('finished_at')))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self.pending:
+                if not await self._flush_shielded() or len(self.pending) < self.batch_size:
+                    break
+
+    async def _flush_shielded(self) -> bool:
+        # cancelling the background task doesn't interrupt a write, close() waits for it instead
+        self._flushing = asyncio.ensure_future(self.flush())
+        return await asyncio.shield(self._flushing)
+
+    async def flush(self) -> bool:
+        """
+        Write one batch of pending records, returns False on failure.
+
+        Failed batch is returned to the queue and retried on the next flush.
+        """
+        batch = self.pending[:self.batch_size]
+        del self.pending[:self.batch_size]
+        if not batch:
+            return True
+        started = time.monotonic()
+        try:
+            await self.write(batch)
+        except Exception as e:
+            logging.info('failed to write {} games to archive: {}'.format(len(batch), e))
+            self.pending[:0] = batch
+            self.failed_flushes += 1
+            self._trim()
+            return False
+        latency = time.monotonic() - started
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.written += len(batch)
+        return True
+
+    async def write(self, batch: List[Dict]) -> None:
+        games = []
+        ratings = {}
+        for record in batch:
+            record = dict(record)
+            # only the latest rating of each user is saved
+            ratings.update(record.pop('ratings'))
+            games.append(record)
+        async with self.session_factory() as session:
+            async with session.begin():
+                await Game.insert_many(session, games)
+                increments = UserStats.increments(games)
+                if increments:
+                    await UserStats.add_many(session, increments)
+                if ratings:
+                    await User.save_ratings(session, list(ratings.items()))
+
+    def stats(self) -> Dict:
+        return {
+            'pending': len(self.pending),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency
+        }
@@ -1,9 +1,70 @@
 import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from aiohttp_security.abc import AbstractAuthorizationPolicy
 from models import User
+from db import last_seen, presence, unit_of_work
+from settings import IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL
 from sqlalchemy import select
 
 
+class IdentityCache:
+    """
+    Bounded cache of authorized logins by identity.
+
+    Entries expire after ttl seconds, the least recently used one is evicted
+    when cache is full. Unknown identities are cached too, as None.
+    """
+    def __init__(self, size: int = IDENTITY_CACHE_SIZE, ttl: float = IDENTITY_CACHE_TTL) -> None:
+        self.size = size
+        self.ttl = ttl
+        # identity -> (expiration time, login)
+        self.entries = OrderedDict()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, identity: str) -> Tuple[bool, Optional[str]]:
+        """
+        Return whether identity is cached and its login.
+        """
+        entry = self.entries.get(identity)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[identity]
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(identity)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, identity: str, login: Optional[str]) -> None:
+        self.entries[identity] = (time.monotonic() + self.ttl, login)
+        self.entries.move_to_end(identity)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, identity: str) -> None:
+        self.entries.pop(identity, None)
+
+    def invalidate_login(self, login: str) -> None:
+        # used on logout, registration and deletion of user
+        self.invalidate(login_identity(login))
+
+    def stats(self) -> Dict:
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+identity_cache = IdentityCache()
+
+
 class MyAuthorizationPolicy(AbstractAuthorizationPolicy):
 
     def __init__(self, app):
@@ -14,22 +75,29 @@ class MyAuthorizationPolicy(AbstractAuthorizationPolicy):
         if not identity.startswith('auth'):
             return None
         else:
-            # go to db for authorization
-            login = identity[5:]
-            session = self._app['session']
-            stmt = select(User).where(User.login == login)
-            async with session.begin():
-                result = await session.execute(stmt)
-                users = result.scalars().all()
-                if users:
-                    users[0].ping()
-                else:
+            found, login = identity_cache.get(identity)
+            if not found:
+                # go to db for authorization
+                login = identity[5:]
+                stmt = select(User).where(User.login == login)
+                async with unit_of_work() as session:
+                    result = await session.execute(stmt)
+                    users = result.scalars().all()
+                if not users:
                     login = None
+                identity_cache.put(identity, login)
+            if login is not None:
+                last_seen.touch(login)
+                presence.heartbeat(login)
             return login
 
     async def permits(self, identity, permission, context=None):
         return True
 
 
+def login_identity(login: str) -> str:
+    return 'auth_' + login
+
+
 def get_new_anonymous_user_id():
     return time.time()
@@ -0,0 +1,181 @@
+import struct
+from typing import Dict, List, Optional
+# compact binary protocol, alternative to json protocol 'v1'
+# every frame starts with one byte command tag, board cell is encoded as index 16 * square + 4 * vertical + horizontal
+# incoming frames are decoded into the same dicts as json messages, so they go through the same handlers
+
+# websocket subprotocols used for negotiation
+JSON_SUBPROTOCOL = 'xo.v1'
+BINARY_SUBPROTOCOL = 'xo.bin1'
+
+# incoming commands
+READY = 0x01
+RESIGN = 0x02
+MOVE = 0x03
+OFFER = 0x04
+ACCEPT = 0x05
+OPTIONS = 0x06
+SYNC = 0x07
+WATCH = 0x08
+UNWATCH = 0x09
+SUBSCRIBE_PRESENCE = 0x0a
+UNSUBSCRIBE_PRESENCE = 0x0b
+
+# outgoing commands
+WAITING = 0x81
+ERROR = 0x82
+STARTED = 0x83
+UPDATE_STATE = 0x84
+OFFERED = 0x85
+GAME_OVER = 0x86
+MOVE_APPLIED = 0x87
+WATCHING = 0x88
+PRESENCE = 0x89
+PRESENCE_DIFF = 0x8a
+
+NO_CELL = 0xff
+
+GAME_TYPES = ['xo_3d']
+SIDES = ['first', 'second']
+RESULTS = ['none', 'first_win', 'second_win', 'draw']
+CAUSES = ['win_rule', 'resignation', 'agreement', 'interruption']
+
+_update_state = struct.Struct('>BIQQBB')
+_move_applied = struct.Struct('>BIBB')
+_game_over = struct.Struct('>BBB')
+_started = struct.Struct('>BB')
+
+# board snapshot symbols to bits, see bitboard_engine
+_X_BITS = str.maketrans({chr(0): '1', chr(1): '0', chr(2): '0'})
+_O_BITS = str.maketrans({chr(0): '0', chr(1): '1', chr(2): '0'})
+
+
+class BinaryProtocolException(Exception):
+    pass
+
+
+def cell_index(square: int, vertical: int, horizontal: int) -> int:
+    return 16 * square + 4 * vertical + horizontal
+
+
+def move_cell(move: Optional[Dict]) -> int:
+    if move is None:
+        return NO_CELL
+    return cell_index(move['square'], move['vertical'], move['horizontal'])
+
+
+def board_bitboards(board: str) -> tuple:
+    """
+    Convert board snapshot to a pair of 64-bit integers for the first and the second player.
+    """
+    return int(board.translate(_X_BITS)[::-1], 2), int(board.translate(_O_BITS)[::-1], 2)
+
+
+def win_cells(win_pos: Optional[str]) -> List[int]:
+    """
+    Convert winning coordinates from engine notation (triples of digits) to cell indexes.
+    """
+    if not win_pos:
+        return []
+    digits = [int(c) for c in win_pos if c.isdigit()]
+    return [cell_index(*digits[i:i + 3]) for i in range(0, len(digits) - 2, 3)]
+
+
+def _logins(logins: List[str]) -> bytes:
+    # every login is terminated with zero byte
+    return b''.join(str(login).encode('utf-8') + b'\x00' for login in logins)
+
+
+def _text(data: bytes) -> str:
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise BinaryProtocolException("Wrong text in frame!")
+
+
+def _message(command: str, parameters: Dict) -> Dict:
+    return {
+        'version': 'v1',
+        'command': command,
+        'parameters': parameters
+    }
+
+
+def decode(payload: bytes) -> Dict:
+    """
+    Decode incoming binary frame into the command data.
+    """
+    if not payload:
+        raise BinaryProtocolException("Empty frame!")
+    tag = payload[0]
+    if tag == MOVE:
+        if len(payload) != 2 or payload[1] > 63:
+            raise BinaryProtocolException("Wrong move frame!")
+        cell = payload[1]
+        return _message('move', {'square': cell >> 4, 'vertical': (cell >> 2) & 3, 'horizontal': cell & 3})
+    elif tag == READY:
+        # low 6 bits of the second byte are game type, high 2 bits are requested side (0 - any)
+        if len(payload) < 2 or payload[1] & 0x3f >= len(GAME_TYPES) or payload[1] >> 6 > len(SIDES):
+            raise BinaryProtocolException("Wrong ready frame!")
+        opponent = _text(payload[2:]) if len(payload) > 2 else 'random'
+        side = payload[1] >> 6
+        return _message('ready', {'type': GAME_TYPES[payload[1] & 0x3f], 'opponent': opponent,
+                                  'side': SIDES[side - 1] if side else None})
+    elif tag == OPTIONS:
+        if len(payload) != 2:
+            raise BinaryProtocolException("Wrong options frame!")
+        return _message('options', {'delta': bool(payload[1] & 1)})
+    elif tag == SYNC:
+        return _message('sync', {})
+    elif tag == WATCH:
+        return _message('watch', {'player': _text(payload[1:])})
+    elif tag == UNWATCH:
+        return _message('unwatch', {})
+    elif tag == SUBSCRIBE_PRESENCE:
+        return _message('subscribe_presence', {})
+    elif tag == UNSUBSCRIBE_PRESENCE:
+        return _message('unsubscribe_presence', {})
+    elif tag == RESIGN:
+        return _message('resign', {})
+    elif tag == OFFER:
+        return _message('offer', {})
+    elif tag == ACCEPT:
+        return _message('accept', {})
+    raise BinaryProtocolException(f"Unknown command tag {tag} found!")
+
+
+def encode(data: Dict) -> bytes:
+    """
+    Encode outgoing command data into binary frame.
+    """
+    command = data['command']
+    params = data['parameters']
+    if command == 'update_state':
+        x, o = board_bitboards(params['board'])
+        return _update_state.pack(UPDATE_STATE, params['seq'], x, o, SIDES.index(params['player_to_move']),
+                                  move_cell(params['last_move']))
+    elif command == 'move_applied':
+        return _move_applied.pack(MOVE_APPLIED, params['seq'], move_cell(params['move']),
+                                  SIDES.index(params['player_to_move']))
+    elif command == 'game_over':
+        head = _game_over.pack(GAME_OVER, RESULTS.index(params['result']), CAUSES.index(params['cause']))
+        return head + bytes(win_cells(params['win_pos']))
+    elif command == 'started':
+        opponent = params['opp_id']
+        return _started.pack(STARTED, SIDES.index(params['ptype'])) + \
+            (str(opponent).encode('utf-8') if opponent is not None else b'')
+    elif command == 'watching':
+        return bytes([WATCHING]) + str(params['first']).encode('utf-8') + b'\x00' + \
+            str(params['second']).encode('utf-8')
+    elif command == 'presence':
+        return bytes([PRESENCE]) + _logins(params['users'])
+    elif command == 'presence_diff':
+        # joined and left logins are separated by empty login
+        return bytes([PRESENCE_DIFF]) + _logins(params['joined']) + b'\x00' + _logins(params['left'])
+    elif command == 'waiting':
+        return bytes([WAITING])
+    elif command == 'offered':
+        return bytes([OFFERED])
+    elif command == 'error':
+        return bytes([ERROR]) + params['msg'].encode('utf-8')
+    raise BinaryProtocolException(f"Command {command} has no binary encoding!")
@@ -0,0 +1,284 @@
+from typing import Sequence, List
+from settings import ENGINE_WIN_DETECTION
+# pure python engine backend, provides the same interface as xo_app_stub
+# cell index is 16 * square + 4 * vertical + horizontal, each side is stored as 64-bit integer
+
+BOARD_SIZE = 4
+CELLS_COUNT = BOARD_SIZE ** 3
+FULL_BOARD = (1 << CELLS_COUNT) - 1
+
+# symbols of the board snapshot, the same as used by xo_app
+X_SYMBOL = chr(0)
+O_SYMBOL = chr(1)
+EMPTY_SYMBOL = chr(2)
+
+
+class InvalidCoordsException(Exception):
+    def __init__(self):
+        super().__init__()
+
+
+class InvalidPlayerException(Exception):
+    def __init__(self):
+        super().__init__()
+
+
+class NoGameException(Exception):
+    def __init__(self):
+        super().__init__()
+
+
+class UnknownWinDetectionException(Exception):
+    def __init__(self, name, valid):
+        super().__init__(f"Unknown win detection {name}, expected one of: {', '.join(valid)}!")
+
+
+def cell_index(square: int, vertical: int, horizontal: int) -> int:
+    return 16 * square + 4 * vertical + horizontal
+
+
+def cell_coords(index: int) -> tuple:
+    return index >> 4, (index >> 2) & 3, index & 3
+
+
+def _build_lines() -> List[int]:
+    """
+    Build masks of all 76 winning lines of the 4x4x4 cube.
+    """
+    directions = [(ds, dv, dh)
+                  for ds in (-1, 0, 1) for dv in (-1, 0, 1) for dh in (-1, 0, 1)
+                  if (ds, dv, dh) > (0, 0, 0)]
+    masks = []
+    for s in range(BOARD_SIZE):
+        for v in range(BOARD_SIZE):
+            for h in range(BOARD_SIZE):
+                for ds, dv, dh in directions:
+                    cells = [(s + i * ds, v + i * dv, h + i * dh) for i in range(BOARD_SIZE)]
+                    if all(0 <= c < BOARD_SIZE for cell in cells for c in cell):
+                        mask = 0
+                        for cell in cells:
+                            mask |= 1 << cell_index(*cell)
+                        masks.append(mask)
+    return masks
+
+
+LINES = _build_lines()
+# indexes of lines passing through each cell, from 4 to 7 per cell
+CELL_LINES = [[n for n, line in enumerate(LINES) if line >> i & 1] for i in range(CELLS_COUNT)]
+
+
+def _format_cells(cells: Sequence[int]) -> str:
+    return ' '.join('{}{}{}'.format(*cell_coords(c)) for c in cells)
+
+
+class BitboardGame:
+    """
+    State of a single game.
+    """
+    __slots__ = ('x', 'o', 'cells', 'moves', 'outcome', 'line')
+
+    def __init__(self) -> None:
+        self.x = 0
+        self.o = 0
+        # board snapshot is kept up to date along with bitboards
+        self.cells = bytearray(EMPTY_SYMBOL * CELLS_COUNT, 'latin-1')
+        self.moves = []
+        # result and winning line mask are evaluated once per move
+        self.outcome = 'none'
+        self.line = 0
+
+    def to_move(self) -> str:
+        return 'first' if len(self.moves) % 2 == 0 else 'second'
+
+    def play(self, player: str, index: int) -> None:
+        bit = 1 << index
+        if (self.x | self.o) & bit or self.outcome != 'none':
+            raise InvalidCoordsException()
+        if player == 'first':
+            self.x |= bit
+            self.cells[index] = ord(X_SYMBOL)
+            self.evaluate(self.x, 'first_win')
+        else:
+            self.o |= bit
+            self.cells[index] = ord(O_SYMBOL)
+            self.evaluate(self.o, 'second_win')
+        self.moves.append(index)
+
+    def evaluate(self, board: int, win: str) -> None:
+        """
+        Check all winning lines against the board of the side which has just moved.
+        """
+        for line in LINES:
+            if board & line == line:
+                self.outcome = win
+                self.line = line
+                return
+        if self.x | self.o == FULL_BOARD:
+            self.outcome = 'draw'
+
+
+class CountersGame(BitboardGame):
+    """
+    State of a single game with incremental win detection.
+
+    Keeps count of each side's stones on every winning line,
+    so a move updates only lines passing through the played cell.
+    """
+    __slots__ = ('x_counts', 'o_counts')
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.x_counts = [0] * len(LINES)
+        self.o_counts = [0] * len(LINES)
+
+    def play(self, player: str, index: int) -> None:
+        bit = 1 << index
+        if (self.x | self.o) & bit or self.outcome != 'none':
+            raise InvalidCoordsException()
+        if player == 'first':
+            self.x |= bit
+            self.cells[index] = ord(X_SYMBOL)
+            counts = self.x_counts
+            win = 'first_win'
+        else:
+            self.o |= bit
+            self.cells[index] = ord(O_SYMBOL)
+            counts = self.o_counts
+            win = 'second_win'
+        self.moves.append(index)
+        for n in CELL_LINES[index]:
+            counts[n] += 1
+            if counts[n] == BOARD_SIZE:
+                self.outcome = win
+                self.line = LINES[n]
+                return
+        if len(self.moves) == CELLS_COUNT:
+            self.outcome = 'draw'
+
+
+_game_classes = {
+    'masks': BitboardGame,
+    'counters': CountersGame,
+}
+
+
+def load_game_class(name: str):
+    """
+    Return game class implementing win detection mode by its configuration name.
+    """
+    if name not in _game_classes:
+        raise UnknownWinDetectionException(name, list(_game_classes))
+    return _game_classes[name]
+
+
+_game_class = load_game_class(ENGINE_WIN_DETECTION)
+
+
+_games = {}
+_last_used_id = 0
+
+
+def _game(game_index: int) -> BitboardGame:
+    try:
+        return _games[game_index]
+    except KeyError:
+        raise NoGameException()
+
+
+def create_new_game() -> int:
+    """
+    Allocate memory for a new game.
+
+    Returns unique game id.
+    """
+    global _last_used_id
+    _last_used_id += 1
+    _games[_last_used_id] = _game_class()
+    return _last_used_id
+
+
+def set_new_move(game_index: int, player: str, coords: Sequence) -> None:
+    """
+    Make a new move in game.
+
+    coords must be sequence of 3 valid numbers.
+    player must be one of options: 'first' or 'second'.
+    Moving to occupied cell or after the end of game raises InvalidCoordsException().
+    """
+    if len(coords) != 3:
+        raise InvalidCoordsException()
+    try:
+        for item in coords:
+            if item < 0 or item > 3:
+                raise InvalidCoordsException()
+    except TypeError:
+        raise InvalidCoordsException()
+    if player != 'first' and player != 'second':
+        raise InvalidPlayerException()
+    game = _game(game_index)
+    if player != game.to_move():
+        raise InvalidPlayerException()
+    game.play(player, cell_index(*coords))
+
+
+def release_game(game_index) -> None:
+    """
+    Delete game data.
+    """
+    _games.pop(game_index, None)
+
+
+def finalize() -> None:
+    """
+    Free all resources used by application.
+    """
+    _games.clear()
+
+
+def finished(game_index) -> bool:
+    """
+    Check if the game is in its final state.
+    """
+    return _game(game_index).outcome != 'none'
+
+
+def result(game_index) -> str:
+    """
+    Return result of the game.
+    """
+    return _game(game_index).outcome
+
+
+def get_moves(game_index) -> str:
+    """
+    Return all moves from the game.
+
+    Moves are space separated, each move is a triple of digits: square, vertical, horizontal.
+    """
+    return _format_cells(_game(game_index).moves)
+
+
+def get_win_coords(game_index) -> str:
+    """
+    Return squares of win combination.
+
+    Format is the same as for moves, empty string if there is no win.
+    """
+    line = _game(game_index).line
+    return _format_cells([i for i in range(CELLS_COUNT) if line >> i & 1])
+
+
+def get_board(game_index) -> str:
+    """
+    Return full board shapshot.
+    """
+    return _game(game_index).cells.decode('latin-1')
+
+
+def get_player_to_move(game_index) -> str:
+    """
+    Return player to move now.
+
+    Return values are 'first' or 'second'.
+    """
+    return _game(game_index).to_move()
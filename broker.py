@@ -0,0 +1,646 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from binary_protocol import GAME_TYPES, SIDES
+from db import connect
+from players import Entry, Matcher, Playground, PlaygroundException
+from presence import PresenceTracker
+from settings import BROKER_SOCKET, BROKER_FLUSH_MS, BROKER_CLAIM_TIMEOUT, MATCHER_TYPE, MATCHMAKING_MODE, \
+    MATCHMAKING_TICK_MS
+# standalone matchmaking broker, workers submit and cancel entries of their users and receive matches
+# broker also owns state shared by workers: users with open sockets, their presence, and it passes
+# updates of ratings and new users to all workers
+# protocol over unix socket: every frame is 4 bytes length and payload starting with one byte tag
+# profile of user: worker, rating, account id (-1 for anonymous), format, delta flag and user id
+# user ids and opponents are strings with one byte length, anonymous user id is empty string
+
+# from worker
+HELLO = 0x01
+SUBMIT = 0x02
+CANCEL = 0x03
+CLAIM = 0x04
+RELEASE = 0x05
+PRESENCE_EVENT = 0x06
+RATINGS = 0x07
+INVALIDATE = 0x08
+
+# from broker
+MATCHES = 0x81
+CANCELLED = 0x82
+CLAIMED = 0x83
+PRESENCE = 0x84
+RATINGS_UPDATE = 0x85
+INVALIDATED = 0x86
+
+PRESENCE_EVENTS = ['connect', 'disconnect', 'heartbeat']
+
+FORMATS = ['json', 'binary']
+
+_length = struct.Struct('>I')
+_profile = struct.Struct('>BdqBB')
+_hello = struct.Struct('>BB')
+# tag, game type and requested side (0 - any, 1 - first, 2 - second)
+_submit = struct.Struct('>BBB')
+_matches = struct.Struct('>BH')
+# tag, snapshot flag and number of changes
+_presence = struct.Struct('>BBH')
+_rating = struct.Struct('>d')
+# frames with a count are split into chunks of this size
+_MAX_COUNT = 0xffff
+
+
+class BrokerProtocolException(Exception):
+    pass
+
+
+def _pack_string(value: Optional[str]) -> bytes:
+    data = b'' if value is None else str(value).encode('utf-8')
+    if len(data) > 255:
+        raise BrokerProtocolException("Too long string!")
+    return bytes([len(data)]) + data
+
+
+def _unpack_string(data: bytes, offset: int) -> Tuple[Optional[str], int]:
+    length = data[offset]
+    value = data[offset + 1:offset + 1 + length].decode('utf-8')
+    return value or None, offset + 1 + length
+
+
+def pack_profile(profile: Dict) -> bytes:
+    account_id = profile['account_id']
+    return _profile.pack(profile['worker'], profile['rating'], -1 if account_id is None else account_id,
+                         FORMATS.index(profile['fmt']), int(profile['delta'])) + _pack_string(profile['user_id'])
+
+
+def unpack_profile(data: bytes, offset: int) -> Tuple[Dict, int]:
+    worker, rating, account_id, fmt, delta = _profile.unpack_from(data, offset)
+    user_id, offset = _unpack_string(data, offset + _profile.size)
+    return {'user_id': user_id, 'worker': worker, 'rating': rating,
+            'account_id': None if account_id < 0 else account_id,
+            'fmt': FORMATS[fmt], 'delta': bool(delta)}, offset
+
+
+def frame(payload: bytes) -> bytes:
+    return _length.pack(len(payload)) + payload
+
+
+def hello_frame(worker: int) -> bytes:
+    return frame(_hello.pack(HELLO, worker))
+
+
+def submit_frame(profile: Dict, parameters: Dict) -> bytes:
+    side = parameters.get('side')
+    side = SIDES.index(side) + 1 if side in SIDES else 0
+    return frame(_submit.pack(SUBMIT, GAME_TYPES.index(parameters['type']), side) + pack_profile(profile) +
+                 _pack_string(parameters['opponent']))
+
+
+def user_frame(tag: int, user_id) -> bytes:
+    return frame(bytes([tag]) + _pack_string(user_id))
+
+
+def cancel_frame(user_id) -> bytes:
+    return user_frame(CANCEL, user_id)
+
+
+def cancelled_frame(user_id) -> bytes:
+    return user_frame(CANCELLED, user_id)
+
+
+def claimed_frame(user_id, granted: bool) -> bytes:
+    return frame(bytes([CLAIMED]) + _pack_string(user_id) + bytes([granted]))
+
+
+def presence_event_frame(kind: str, login: str) -> bytes:
+    return frame(bytes([PRESENCE_EVENT, PRESENCE_EVENTS.index(kind)]) + _pack_string(login))
+
+
+def presence_frames(changes: Dict[str, bool], snapshot: bool = False) -> List[bytes]:
+    items = list(changes.items())
+    frames = []
+    for start in range(0, max(len(items), 1), _MAX_COUNT):
+        chunk = items[start:start + _MAX_COUNT]
+        # only the first chunk of snapshot replaces online users
+        payload = bytearray(_presence.pack(PRESENCE, int(snapshot and not start), len(chunk)))
+        for login, online in chunk:
+            payload.append(int(online))
+            payload += _pack_string(login)
+        frames.append(frame(bytes(payload)))
+    return frames
+
+
+def ratings_frames(tag: int, ratings: List[Tuple[str, float]]) -> List[bytes]:
+    frames = []
+    for start in range(0, len(ratings), _MAX_COUNT):
+        chunk = ratings[start:start + _MAX_COUNT]
+        payload = bytearray(_matches.pack(tag, len(chunk)))
+        for login, rating in chunk:
+            payload += _rating.pack(rating)
+            payload += _pack_string(login)
+        frames.append(frame(bytes(payload)))
+    return frames
+
+
+def decode_presence(payload: bytes) -> Tuple[Dict[str, bool], bool]:
+    _, snapshot, count = _presence.unpack_from(payload)
+    offset = _presence.size
+    changes = {}
+    for _ in range(count):
+        online = bool(payload[offset])
+        login, offset = _unpack_string(payload, offset + 1)
+        changes[login] = online
+    return changes, bool(snapshot)
+
+
+def decode_ratings(payload: bytes) -> List[Tuple[str, float]]:
+    _, count = _matches.unpack_from(payload)
+    offset = _matches.size
+    ratings = []
+    for _ in range(count):
+        rating, = _rating.unpack_from(payload, offset)
+        login, offset = _unpack_string(payload, offset + _rating.size)
+        ratings.append((login, rating))
+    return ratings
+
+
+def matches_frame(matches: List[Tuple[str, Dict, Dict]]) -> bytes:
+    payload = bytearray(_matches.pack(MATCHES, len(matches)))
+    for game_type, first, second in matches:
+        payload.append(GAME_TYPES.index(game_type))
+        payload += pack_profile(first)
+        payload += pack_profile(second)
+    return frame(bytes(payload))
+
+
+def decode_submit(payload: bytes) -> Tuple[Dict, Dict]:
+    _, game_type, side = _submit.unpack_from(payload)
+    profile, offset = unpack_profile(payload, _submit.size)
+    opponent, _ = _unpack_string(payload, offset)
+    parameters = {'type': GAME_TYPES[game_type], 'side': SIDES[side - 1] if side else None,
+                  'opponent': opponent}
+    return profile, parameters
+
+
+def decode_matches(payload: bytes) -> List[Dict]:
+    """
+    Decode matches into headers of games: game type and profiles of the first and the second player.
+    """
+    _, count = _matches.unpack_from(payload)
+    offset = _matches.size
+    games = []
+    for _ in range(count):
+        game_type = GAME_TYPES[payload[offset]]
+        first, offset = unpack_profile(payload, offset + 1)
+        second, offset = unpack_profile(payload, offset)
+        games.append({'game_type': game_type, 'first': first, 'second': second})
+    return games
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    length, = _length.unpack(await reader.readexactly(_length.size))
+    return await reader.readexactly(length)
+
+
+class MatchmakingBroker:
+    """
+    Global matchmaking of entries submitted by all workers.
+
+    Entries are kept in the usual playground queues, indexed by game type.
+    Matches are collected per worker which will own the game (worker of the first
+    player) and sent in one frame per flush interval.
+
+    Broker also claims users for workers holding their sockets, so user is registered
+    on one worker only, tracks presence of users of all workers, and passes updates
+    of ratings and new users to all workers. Entries, claims and sockets of a worker
+    are dropped when its connection is lost, the worker sends them again on reconnection.
+    """
+    def __init__(self, flush_interval: float = BROKER_FLUSH_MS / 1000) -> None:
+        self.flush_interval = flush_interval
+        self.pool = Playground(Matcher(MATCHER_TYPE))
+        # user id -> profile of waiting user
+        self.profiles = {}
+        # worker -> writer of its connection
+        self.writers = {}
+        # worker -> matches not sent yet
+        self.pending = {}
+        # user id -> worker holding its socket
+        self.owners = {}
+        # worker -> login -> number of its sockets
+        self.sockets = {}
+        self.presence = PresenceTracker()
+        self.presence.subscribe(self._publish_presence)
+        # login -> the latest rating passed by workers, sent to workers connecting later
+        self.ratings = {}
+        # statistics
+        self.submitted = 0
+        self.matched = 0
+        self.batches = 0
+
+    async def serve(self, path: str, session_factory=None) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        self.presence.start(session_factory)
+        server = await asyncio.start_unix_server(self._serve, path=path)
+        logging.info('matchmaking broker listening on {}'.format(path))
+        try:
+            async with server:
+                await self._run()
+        finally:
+            await self.presence.close()
+
+    async def _run(self) -> None:
+        matched_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - matched_at >= MATCHMAKING_TICK_MS / 1000:
+                matched_at = time.monotonic()
+                for match in self.pool.find_matches(MATCHMAKING_MODE == 'batch'):
+                    self.assign(match.game_type, match.first_player.player_id, match.second_player.player_id)
+            await self.flush()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker = None
+        try:
+            while True:
+                payload = await read_frame(reader)
+                tag = payload[0]
+                if tag == HELLO:
+                    _, worker = _hello.unpack(payload)
+                    self.hello(worker, writer)
+                elif tag == SUBMIT:
+                    self.submit(*decode_submit(payload))
+                elif tag == CANCEL:
+                    self.remove(_unpack_string(payload, 1)[0])
+                elif tag == CLAIM:
+                    user_id = _unpack_string(payload, 1)[0]
+                    writer.write(claimed_frame(user_id, self.claim(worker, user_id)))
+                elif tag == RELEASE:
+                    self.release(worker, _unpack_string(payload, 1)[0])
+                elif tag == PRESENCE_EVENT:
+                    self.presence_event(worker, PRESENCE_EVENTS[payload[1]], _unpack_string(payload, 2)[0])
+                elif tag == RATINGS:
+                    self.update_ratings(worker, decode_ratings(payload))
+                elif tag == INVALIDATE:
+                    for other in self.writers:
+                        if other != worker:
+                            self._send(other, user_frame(INVALIDATED, _unpack_string(payload, 1)[0]))
+                else:
+                    logging.info('unknown broker command {}'.format(tag))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            if worker is not None and self.writers.get(worker) is writer:
+                self.drop(worker)
+
+    def hello(self, worker: int, writer: asyncio.StreamWriter) -> None:
+        if worker in self.writers:
+            # previous connection of restarted worker is not closed yet
+            self.drop(worker)
+        self.writers[worker] = writer
+        for data in presence_frames({login: True for login in self.presence.online}, snapshot=True):
+            writer.write(data)
+        for data in ratings_frames(RATINGS_UPDATE, list(self.ratings.items())):
+            writer.write(data)
+
+    def drop(self, worker: int) -> None:
+        """
+        Forget entries, claims and sockets of worker whose connection is lost.
+        """
+        del self.writers[worker]
+        for user_id in [u for u, p in self.profiles.items() if p['worker'] == worker]:
+            self.remove(user_id)
+        for user_id in [u for u, w in self.owners.items() if w == worker]:
+            del self.owners[user_id]
+        for login, count in self.sockets.pop(worker, {}).items():
+            for _ in range(count):
+                self.presence.disconnect(login)
+
+    def claim(self, worker: int, user_id) -> bool:
+        """
+        Claim user for worker, returns False if its socket is held by other worker.
+        """
+        return self.owners.setdefault(user_id, worker) == worker
+
+    def release(self, worker: int, user_id) -> None:
+        if self.owners.get(user_id) == worker:
+            del self.owners[user_id]
+
+    def presence_event(self, worker: int, kind: str, login: str) -> None:
+        sockets = self.sockets.setdefault(worker, {})
+        if kind == 'connect':
+            sockets[login] = sockets.get(login, 0) + 1
+            self.presence.connect(login)
+        elif kind == 'disconnect':
+            if login not in sockets:
+                return
+            sockets[login] -= 1
+            if not sockets[login]:
+                del sockets[login]
+            self.presence.disconnect(login)
+        else:
+            self.presence.heartbeat(login)
+
+    def update_ratings(self, worker: int, ratings: List[Tuple[str, float]]) -> None:
+        self.ratings.update(ratings)
+        for data in ratings_frames(RATINGS_UPDATE, ratings):
+            for other in self.writers:
+                if other != worker:
+                    self._send(other, data)
+
+    def _publish_presence(self, changes: Dict[str, bool]) -> None:
+        for data in presence_frames(changes):
+            for worker in self.writers:
+                self._send(worker, data)
+
+    def submit(self, profile: Dict, parameters: Dict) -> None:
+        user_id = profile['user_id']
+        try:
+            if not self.pool.is_registered(user_id):
+                self.pool.register(user_id, profile['rating'], profile['account_id'])
+            entry = Entry.from_parameters(self.pool.player(user_id), parameters)
+            self.pool.add_entry(entry)
+        except PlaygroundException as e:
+            logging.info('entry of {} rejected: {}'.format(user_id, e))
+            return
+        self.profiles[user_id] = profile
+        self.submitted += 1
+        if MATCHMAKING_MODE == 'inline':
+            match = self.pool.find_match(entry)
+            if match is not None:
+                self.assign(match.game_type, match.first_player.player_id, match.second_player.player_id)
+
+    def remove(self, user_id) -> Optional[Dict]:
+        if not self.pool.is_registered(user_id):
+            return None
+        if self.pool.player(user_id).is_waiting():
+            self.pool.remove_entry(user_id)
+        self.pool.unregister(user_id)
+        return self.profiles.pop(user_id, None)
+
+    def assign(self, game_type: str, first_id, second_id) -> None:
+        first = self.remove(first_id)
+        second = self.remove(second_id)
+        self.pending.setdefault(first['worker'], []).append((game_type, first, second))
+        self.matched += 1
+
+    async def flush(self) -> None:
+        """
+        Send collected matches, one frame per worker.
+        """
+        pending = self.pending
+        self.pending = {}
+        for worker, matches in pending.items():
+            writer = self.writers.get(worker)
+            if writer is None:
+                # owner of the game is gone, the other players are told to wait no more
+                for _, first, second in matches:
+                    for profile in (first, second):
+                        self._send(profile['worker'], cancelled_frame(profile['user_id']))
+                continue
+            self._send(worker, matches_frame(matches))
+            self.batches += 1
+        for writer in list(self.writers.values()):
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    def _send(self, worker: int, data: bytes) -> None:
+        writer = self.writers.get(worker)
+        if writer is not None:
+            writer.write(data)
+
+    def stats(self) -> Dict:
+        return {
+            'workers': len(self.writers),
+            'waiting': len(self.profiles),
+            'submitted': self.submitted,
+            'matched': self.matched,
+            'batches': self.batches,
+            'claimed': len(self.owners),
+            'ratings': len(self.ratings),
+            'presence': self.presence.stats()
+        }
+
+
+class BrokerClient:
+    """
+    Connection of worker to matchmaking broker.
+
+    Frames are queued and written by a background task, which reconnects if
+    broker is not available. Broker drops state of disconnected workers, so after
+    reconnection waiting entries, claimed users and open sockets are sent again.
+    Frames of that state still queued are dropped then, updates of ratings and users are kept.
+    """
+    # delay of reconnection to broker
+    RETRY_DELAY = 0.5
+    # frames not included in state sent on reconnection
+    KEPT_TAGS = (RATINGS, INVALIDATE)
+
+    def __init__(self, worker: int, path: str = BROKER_SOCKET, claim_timeout: float = BROKER_CLAIM_TIMEOUT) -> None:
+        self.worker = worker
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.queue = None
+        # user id -> submit frame of entry waiting at broker
+        self.submitted = {}
+        # users claimed for this worker and futures of claims waiting for reply
+        self.claims = set()
+        self.claiming = {}
+        # login -> number of open sockets
+        self.sockets = {}
+        # handlers of received game headers, cancelled user ids, presence changes with snapshot flag,
+        # lists of (login, rating) and logins of new users
+        self.on_match = None
+        self.on_cancelled = None
+        self.on_presence = None
+        self.on_ratings = None
+        self.on_invalidated = None
+        self.connected = False
+        # statistics
+        self.connections = 0
+        self.matches = 0
+        self.refused = 0
+        self._task = None
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    def submit(self, profile: Dict, parameters: Dict) -> None:
+        data = submit_frame(profile, parameters)
+        self.submitted[profile['user_id']] = data
+        self.queue.put_nowait(data)
+
+    def cancel(self, user_id) -> None:
+        if self.submitted.pop(user_id, None) is not None:
+            self.queue.put_nowait(cancel_frame(user_id))
+
+    def forget(self, user_id) -> None:
+        # entry was matched
+        self.submitted.pop(user_id, None)
+
+    async def claim(self, user_id) -> bool:
+        """
+        Claim user for this worker, returns False if user is connected to other worker or broker doesn't answer.
+        """
+        if user_id in self.claims:
+            return True
+        future = self.claiming.get(user_id)
+        if future is None:
+            # frame is built first, user id which can't be sent leaves no claim waiting for reply
+            data = user_frame(CLAIM, user_id)
+            future = self.claiming[user_id] = asyncio.get_event_loop().create_future()
+            self.queue.put_nowait(data)
+        try:
+            granted = await asyncio.wait_for(asyncio.shield(future), self.claim_timeout)
+        except asyncio.TimeoutError:
+            granted = False
+        if not granted:
+            self.refused += 1
+        return granted
+
+    def release(self, user_id) -> None:
+        if user_id in self.claims:
+            self.claims.discard(user_id)
+            self.queue.put_nowait(user_frame(RELEASE, user_id))
+
+    def presence_event(self, kind: str, login: str) -> None:
+        if kind == 'connect':
+            self.sockets[login] = self.sockets.get(login, 0) + 1
+        elif kind == 'disconnect':
+            if login not in self.sockets:
+                return
+            self.sockets[login] -= 1
+            if not self.sockets[login]:
+                del self.sockets[login]
+        self.queue.put_nowait(presence_event_frame(kind, login))
+
+    def rating(self, login: str, rating: float) -> None:
+        for data in ratings_frames(RATINGS, [(login, rating)]):
+            self.queue.put_nowait(data)
+
+    def invalidate(self, login: str) -> None:
+        self.queue.put_nowait(user_frame(INVALIDATE, login))
+
+    def _state_frames(self) -> List[bytes]:
+        frames = [hello_frame(self.worker)]
+        frames.extend(self.submitted.values())
+        frames.extend(user_frame(CLAIM, user_id) for user_id in self.claims | set(self.claiming))
+        for login, count in self.sockets.items():
+            frames.extend([presence_event_frame('connect', login)] * count)
+        return frames
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(self.RETRY_DELAY)
+                continue
+            kept = []
+            while not self.queue.empty():
+                data = self.queue.get_nowait()
+                if data[_length.size] in self.KEPT_TAGS:
+                    kept.append(data)
+            self.connected = True
+            self.connections += 1
+            for data in self._state_frames() + kept:
+                writer.write(data)
+            reading = asyncio.ensure_future(self._read(reader))
+            try:
+                while not reading.done():
+                    getting = asyncio.ensure_future(self.queue.get())
+                    await asyncio.wait([getting, reading], return_when=asyncio.FIRST_COMPLETED)
+                    if not getting.done():
+                        getting.cancel()
+                        break
+                    writer.write(getting.result())
+                    await writer.drain()
+            except ConnectionError as e:
+                logging.info('connection to matchmaking broker lost: {}'.format(e))
+            finally:
+                self.connected = False
+                reading.cancel()
+                writer.close()
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                payload = await read_frame(reader)
+                tag = payload[0]
+                if tag == MATCHES:
+                    for header in decode_matches(payload):
+                        for profile in (header['first'], header['second']):
+                            self.forget(profile['user_id'])
+                        self.matches += 1
+                        self._call(self.on_match, header)
+                elif tag == CANCELLED:
+                    user_id = _unpack_string(payload, 1)[0]
+                    self.forget(user_id)
+                    self._call(self.on_cancelled, user_id)
+                elif tag == CLAIMED:
+                    user_id, offset = _unpack_string(payload, 1)
+                    self._claimed(user_id, bool(payload[offset]))
+                elif tag == PRESENCE:
+                    self._call(self.on_presence, *decode_presence(payload))
+                elif tag == RATINGS_UPDATE:
+                    self._call(self.on_ratings, decode_ratings(payload))
+                elif tag == INVALIDATED:
+                    self._call(self.on_invalidated, _unpack_string(payload, 1)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.info('matchmaking broker closed connection')
+
+    def _claimed(self, user_id, granted: bool) -> None:
+        future = self.claiming.pop(user_id, None)
+        if granted and (future is not None or user_id in self.claims):
+            self.claims.add(user_id)
+        elif user_id in self.claims:
+            # claim sent again after reconnection was taken by other worker meanwhile
+            logging.info('user {} was claimed by other worker'.format(user_id))
+            self.claims.discard(user_id)
+        if future is not None and not future.done():
+            future.set_result(granted)
+
+    @staticmethod
+    def _call(handler: Optional[Callable], *args) -> None:
+        if handler is None:
+            return
+        result = handler(*args)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def stats(self) -> Dict:
+        return {
+            'connected': self.connected,
+            'connections': self.connections,
+            'waiting': len(self.submitted),
+            'matches': self.matches,
+            'claimed': len(self.claims),
+            'refused': self.refused,
+            'queued': self.queue.qsize() if self.queue is not None else 0
+        }
+
+
+async def main() -> None:
+    # broker saves presence of users, one connection is enough for it
+    engine = connect(pool_size=1)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    try:
+        await MatchmakingBroker().serve(BROKER_SOCKET, session_factory)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    asyncio.run(main())
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+import subprocess
+import sys
+from typing import Callable, Dict, List, Union
+from broker import BrokerClient
+from global_defs import global_playground, registry
+from leaderboard import leaderboard
+from players import Game, PlaygroundException
+from settings import WORKERS, WORKER_INDEX, IPC_DIR
+# several worker processes share the port (SO_REUSEPORT), each of them owns games started on it
+# workers exchange messages over unix sockets: 4 bytes length, 2 bytes length of json header, header and body
+# entries of all workers are matched by broker process, game is started on worker of the first player
+# broker also owns state shared by workers: it claims users for one worker, tracks their presence
+# and passes updates of leaderboard and new users to all workers
+# player whose socket is held by other (home) worker is served through remote connection:
+# home worker forwards its game commands to owner worker, owner forwards encoded frames back
+
+_prefix = struct.Struct('>IH')
+
+
+class ClusterChannel:
+    """
+    Messages between worker processes over unix sockets.
+
+    Every worker listens on its own socket, messages to each peer are queued and
+    written by a dedicated task over one connection, so their order is kept.
+    Handlers are called in order of arrival, coroutine handlers are scheduled as tasks.
+    """
+    # delay of reconnection to a peer which is not started yet
+    RETRY_DELAY = 0.5
+
+    def __init__(self, index: int, ipc_dir: str) -> None:
+        self.index = index
+        self.ipc_dir = ipc_dir
+        self.handlers = {}
+        self.queues = {}
+        self.server = None
+        # statistics
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+
+    def socket_path(self, worker: int) -> str:
+        return os.path.join(self.ipc_dir, 'worker-{}.sock'.format(worker))
+
+    def on(self, kind: str, handler: Callable[[Dict, bytes], None]) -> None:
+        self.handlers[kind] = handler
+
+    async def start(self) -> None:
+        os.makedirs(self.ipc_dir, exist_ok=True)
+        path = self.socket_path(self.index)
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = await asyncio.start_unix_server(self._serve, path=path)
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def send(self, worker: int, kind: str, header: Dict, body: bytes = b'') -> None:
+        header = dict(header, kind=kind)
+        if worker == self.index:
+            asyncio.get_event_loop().call_soon(self._dispatch, header, body)
+            return
+        queue = self.queues.get(worker)
+        if queue is None:
+            queue = self.queues[worker] = asyncio.Queue()
+            asyncio.ensure_future(self._write(worker, queue))
+        data = json.dumps(header).encode('utf-8')
+        queue.put_nowait(_prefix.pack(len(data) + len(body), len(data)) + data + body)
+        self.sent += 1
+
+    async def _write(self, worker: int, queue: asyncio.Queue) -> None:
+        writer = None
+        while True:
+            message = await queue.get()
+            while writer is None:
+                try:
+                    _, writer = await asyncio.open_unix_connection(self.socket_path(worker))
+                except OSError:
+                    await asyncio.sleep(self.RETRY_DELAY)
+            try:
+                writer.write(message)
+                # messages queued meanwhile are written at once
+                while not queue.empty():
+                    writer.write(queue.get_nowait())
+                await writer.drain()
+            except (ConnectionError, RuntimeError) as e:
+                logging.info('connection to worker {} lost: {}'.format(worker, e))
+                self.lost += 1
+                writer = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                length, header_length = _prefix.unpack(await reader.readexactly(_prefix.size))
+                data = await reader.readexactly(length)
+                self.received += 1
+                self._dispatch(json.loads(data[:header_length].decode('utf-8')), data[header_length:])
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, header: Dict, body: bytes) -> None:
+        handler = self.handlers.get(header['kind'])
+        if handler is None:
+            logging.info('unknown message {} from other worker'.format(header['kind']))
+            return
+        result = handler(header, body)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def stats(self) -> Dict:
+        return {
+            'sent': self.sent,
+            'received': self.received,
+            'lost': self.lost,
+            'queued': sum(q.qsize() for q in self.queues.values())
+        }
+
+
+class Cluster:
+    """
+    State of this worker process in multi-process mode.
+    """
+    def __init__(self, index: int = WORKER_INDEX, workers: int = WORKERS) -> None:
+        self.enabled = workers > 1
+        self.index = max(index, 0)
+        self.workers = workers
+        self.channel = ClusterChannel(self.index, IPC_DIR)
+        self.broker = BrokerClient(self.index)
+        # home side: users with local sockets playing on other worker -> owner worker,
+        # and users whose entries wait at broker
+        self.remote_games = {}
+        self.waiting = set()
+        # owner side: players of local games with sockets on other workers -> their home worker
+        self.remote_players = {}
+
+    async def start(self) -> None:
+        self.channel.on('joined', self._on_joined)
+        self.channel.on('released', self._on_released)
+        self.channel.on('frames', self._on_frames)
+        await self.channel.start()
+        # ratings changed on any worker are passed to all of them through broker
+        leaderboard.subscribe(self.broker.rating)
+        self.broker.on_ratings = self._on_ratings
+        self.broker.start()
+
+    # home side
+
+    def request_match(self, user_id, fmt: str, delta: bool, parameters: Dict) -> None:
+        """
+        Pass entry of local user to broker.
+        """
+        player = global_playground.player(user_id)
+        self.broker.submit({
+            'user_id': user_id, 'worker': self.index, 'rating': player.rating, 'account_id': player.account_id,
+            'fmt': fmt, 'delta': delta
+        }, parameters)
+        self.waiting.add(user_id)
+
+    def cancel_match(self, user_id) -> None:
+        if user_id in self.waiting:
+            self.waiting.discard(user_id)
+            self.broker.cancel(user_id)
+
+    def forward_command(self, user_id, data: Dict) -> None:
+        self.channel.send(self.remote_games[user_id], 'command', {'user_id': user_id, 'data': data})
+
+    def leave(self, user_id) -> None:
+        """
+        Local user disconnected, its entry or remote game is abandoned.
+        """
+        self.cancel_match(user_id)
+        owner = self.remote_games.pop(user_id, None)
+        if owner is not None:
+            self.channel.send(owner, 'disconnect', {'user_id': user_id})
+
+    def _on_joined(self, header: Dict, body: bytes) -> None:
+        user_id = header['user_id']
+        if not global_playground.is_registered(user_id):
+            # user left before its game was started
+            self.channel.send(header['owner'], 'disconnect', {'user_id': user_id})
+            return
+        self.waiting.discard(user_id)
+        self.broker.forget(user_id)
+        self.remote_games[user_id] = header['owner']
+
+    def _on_released(self, header: Dict, body: bytes) -> None:
+        user_id = header['user_id']
+        self.waiting.discard(user_id)
+        self.broker.forget(user_id)
+        self.remote_games.pop(user_id, None)
+        rating = header.get('rating')
+        if rating is not None and global_playground.is_registered(user_id):
+            player = global_playground.player(user_id)
+            player.rating = rating
+            if player.account_id is not None:
+                # owner worker passes it to other workers
+                leaderboard.update(user_id, rating, notify=False)
+
+    def _on_ratings(self, ratings: List) -> None:
+        for login, rating in ratings:
+            leaderboard.update(login, rating, notify=False)
+
+    def _on_frames(self, header: Dict, body: bytes) -> None:
+        connection = registry.sockets.get(header['user_id'])
+        if connection is not None:
+            connection.send(body.decode('utf-8') if header['text'] else body)
+
+    # owner side
+
+    def forward_frame(self, worker: int, user_id, frame: Union[str, bytes]) -> None:
+        text = isinstance(frame, str)
+        self.channel.send(worker, 'frames', {'user_id': user_id, 'text': text},
+                          frame.encode('utf-8') if text else frame)
+
+    def remote_ids(self, game: Game) -> List:
+        return [p.player_id for p in (game.first(), game.second()) if p.player_id in self.remote_players]
+
+    def release(self, user_ids: List) -> None:
+        """
+        Forget remote players of finished game and return them to their home workers.
+        """
+        for user_id in user_ids:
+            home = self.remote_players.pop(user_id)
+            rating = global_playground.player(user_id).rating
+            registry.remove_remote(user_id)
+            try:
+                global_playground.unregister(user_id)
+            except PlaygroundException:
+                pass
+            self.channel.send(home, 'released', {'user_id': user_id, 'rating': rating})
+
+    def stats(self) -> Dict:
+        return {
+            'worker': self.index,
+            'workers': self.workers,
+            'remote_games': len(self.remote_games),
+            'remote_players': len(self.remote_players),
+            'waiting': len(self.waiting),
+            'channel': self.channel.stats(),
+            'broker': self.broker.stats()
+        }
+
+
+cluster = Cluster()
+
+
+def run_supervisor(script: str, workers: int = WORKERS) -> int:
+    """
+    Start matchmaking broker and worker processes on the same port and wait for them.
+
+    Processes are stopped together: when one of them exits or supervisor gets SIGINT or SIGTERM.
+    Returns exit code of the process which exited first, 128 + signal number if it was killed.
+    """
+    broker = os.path.join(os.path.dirname(os.path.abspath(script)), 'broker.py')
+    processes = [subprocess.Popen([sys.executable, broker])]
+    processes += [subprocess.Popen([sys.executable, script], env=dict(os.environ, XO_WORKER_INDEX=str(i)))
+                  for i in range(workers)]
+
+    def stop(*args) -> None:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    pid, status = os.wait()
+    code = os.waitstatus_to_exitcode(status)
+    logging.info('worker process {} exited with code {}'.format(pid, code))
+    stop()
+    for process in processes:
+        process.wait()
+    # raw wait status of exit code 1 is 256, which sys.exit truncates to success
+    return code if code >= 0 else 128 - code
@@ -1,6 +1,21 @@
-from typing import Dict
+import json
+from typing import Dict, Iterable, Optional, Union
 from abc import ABC, abstractmethod
 from players import Game
+import binary_protocol
+
+# frame encoders of protocol formats negotiated per connection
+_encoders = {
+    'json': json.dumps,
+    'binary': binary_protocol.encode,
+}
+
+
+def encode_frame(data: Dict, fmt: str) -> Union[str, bytes]:
+    """
+    Encode command data into frame of the given format: 'json' or 'binary'.
+    """
+    return _encoders[fmt](data)
 
 
 class CommandException(Exception):
@@ -48,6 +63,45 @@ class OutCommand(Command):
         pass
 
 
+class BroadcastCommand(OutCommand):
+    """
+    Output command with the same payload for several users.
+
+    Payload is built and encoded once per format, then the same frame is sent to every recipient.
+    Commands with per-recipient fields (like 'started') must be sent separately.
+    Optional delta command is sent instead of the full one to connections in delta mode.
+    """
+
+    @staticmethod
+    def to_game(game: Game, command: OutCommand, delta: Optional[OutCommand] = None) -> 'BroadcastCommand':
+        """
+        Address command to both players and all spectators of the game.
+        """
+        return BroadcastCommand([game.first().player_id, game.second().player_id], command, delta,
+                                game.watcher_ids())
+
+    def __init__(self, user_ids: Iterable, command: OutCommand, delta: Optional[OutCommand] = None,
+                 watcher_ids: Iterable = ()):
+        super().__init__(None)
+        self.user_ids = list(user_ids)
+        # spectators are served after players
+        self.watcher_ids = list(watcher_ids)
+        self.command = command
+        self.delta = delta
+        self._encoded = {}
+
+    def data(self):
+        return self.command.data()
+
+    def encoded(self, fmt: str = 'json', delta: bool = False) -> Union[str, bytes]:
+        delta = delta and self.delta is not None
+        key = (fmt, delta)
+        if key not in self._encoded:
+            cmd = self.delta if delta else self.command
+            self._encoded[key] = encode_frame(cmd.data(), fmt)
+        return self._encoded[key]
+
+
 class WaitingCommand(OutCommand):
     def __init__(self, user_id, **parameters):
         super().__init__(user_id)
@@ -100,12 +154,14 @@ class UpdateStateCommand(OutCommand):
         self.board = parameters["board"]
         self.p_t_m = parameters["player_to_move"]
         self.last_move = parameters["last_move"]
+        self.seq = parameters["seq"]
 
     def data(self):
         params = {
             'board': self.board,
             'player_to_move': self.p_t_m,
-            'last_move': self.last_move
+            'last_move': self.last_move,
+            'seq': self.seq
         }
         return {
             'version': 'v1',
@@ -115,8 +171,39 @@ class UpdateStateCommand(OutCommand):
 
     @staticmethod
     def from_game(user_id, game: Game) -> 'UpdateStateCommand':
-        cmd = UpdateStateCommand(user_id, board=game.get_board(), player_to_move=game.player_to_move(),
-                                 last_move=game.get_last_move())
+        snapshot = game.snapshot()
+        cmd = UpdateStateCommand(user_id, board=snapshot.board, player_to_move=snapshot.player_to_move,
+                                 last_move=snapshot.last_move, seq=snapshot.seq)
+        return cmd
+
+
+class MoveAppliedCommand(OutCommand):
+    """
+    Delta state update: only the last applied move and its sequence number.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+        self.move = parameters["move"]
+        self.p_t_m = parameters["player_to_move"]
+        self.seq = parameters["seq"]
+
+    def data(self):
+        params = {
+            'move': self.move,
+            'player_to_move': self.p_t_m,
+            'seq': self.seq
+        }
+        return {
+            'version': 'v1',
+            'command': 'move_applied',
+            'parameters': params
+        }
+
+    @staticmethod
+    def from_game(user_id, game: Game) -> 'MoveAppliedCommand':
+        snapshot = game.snapshot()
+        cmd = MoveAppliedCommand(user_id, move=snapshot.last_move, player_to_move=snapshot.player_to_move,
+                                 seq=snapshot.seq)
         return cmd
 
 
@@ -153,20 +240,86 @@ class GameOverCommand(OutCommand):
 
     @staticmethod
     def from_game(user_id, game: Game, cause: str) -> 'GameOverCommand':
-        cmd = GameOverCommand(user_id, result=game.get_result(), win_pos=game.get_win_pos(), cause=cause)
+        snapshot = game.snapshot()
+        cmd = GameOverCommand(user_id, result=snapshot.result, win_pos=snapshot.win_pos, cause=cause)
         return cmd
 
 
+class WatchingCommand(OutCommand):
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+        self.first = parameters["first"]
+        self.second = parameters["second"]
+
+    def data(self):
+        params = {
+            'first': self.first,
+            'second': self.second
+        }
+        return {
+            'version': 'v1',
+            'command': 'watching',
+            'parameters': params
+        }
+
+
+class PresenceCommand(OutCommand):
+    """
+    Snapshot of online users sent on presence subscription.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+        self.users = parameters["users"]
+
+    def data(self):
+        params = {
+            'users': self.users
+        }
+        return {
+            'version': 'v1',
+            'command': 'presence',
+            'parameters': params
+        }
+
+
+class PresenceDiffCommand(OutCommand):
+    """
+    Changes of online status since the previous diff: users joined (online) and left.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+        self.joined = parameters["joined"]
+        self.left = parameters["left"]
+
+    def data(self):
+        params = {
+            'joined': self.joined,
+            'left': self.left
+        }
+        return {
+            'version': 'v1',
+            'command': 'presence_diff',
+            'parameters': params
+        }
+
+    @staticmethod
+    def from_changes(user_id, changes: Dict[str, bool]) -> 'PresenceDiffCommand':
+        return PresenceDiffCommand(user_id, joined=[login for login, online in changes.items() if online],
+                                   left=[login for login, online in changes.items() if not online])
+
+
 class ReadyCommand(InCommand):
     def __init__(self, user_id, **parameters):
         super().__init__(user_id)
         self.type = parameters["type"]
         self.opponent = parameters["opponent"]
+        self.side = parameters.get("side")
 
     def data(self):
         params = {
             'type': self.type,
             'opponent': self.opponent,
+            'side': self.side,
         }
         return {
             'version': 'v1',
@@ -231,12 +384,110 @@ class AcceptCommand(InCommand):
         }
 
 
+class OptionsCommand(InCommand):
+    """
+    Set connection options, 'delta' enables delta state updates.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+        self.delta = parameters.get("delta", False)
+
+    def data(self):
+        params = {
+            'delta': self.delta
+        }
+        return {
+            'version': 'v1',
+            'command': 'options',
+            'parameters': params
+        }
+
+
+class SyncCommand(InCommand):
+    """
+    Request full state snapshot, used by clients which missed delta updates.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+
+    def data(self):
+        return {
+            'version': 'v1',
+            'command': 'sync',
+            'parameters': {}
+        }
+
+
+class WatchCommand(InCommand):
+    """
+    Join game of the given player as a spectator.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+        if "player" not in parameters:
+            raise CommandException("Watch command without player!")
+        self.player = parameters["player"]
+
+    def data(self):
+        params = {
+            'player': self.player
+        }
+        return {
+            'version': 'v1',
+            'command': 'watch',
+            'parameters': params
+        }
+
+
+class UnwatchCommand(InCommand):
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+
+    def data(self):
+        return {
+            'version': 'v1',
+            'command': 'unwatch',
+            'parameters': {}
+        }
+
+
+class SubscribePresenceCommand(InCommand):
+    """
+    Receive snapshot of online users and then their changes.
+    """
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+
+    def data(self):
+        return {
+            'version': 'v1',
+            'command': 'subscribe_presence',
+            'parameters': {}
+        }
+
+
+class UnsubscribePresenceCommand(InCommand):
+    def __init__(self, user_id, **parameters):
+        super().__init__(user_id)
+
+    def data(self):
+        return {
+            'version': 'v1',
+            'command': 'unsubscribe_presence',
+            'parameters': {}
+        }
+
+
 class CommandFactory(ABC):
     _commands = {
             "waiting": WaitingCommand,
             "error": ErrorCommand,
             "started": StartedCommand,
             "update_state": UpdateStateCommand,
+            "move_applied": MoveAppliedCommand,
+            "watching": WatchingCommand,
+            "presence": PresenceCommand,
+            "presence_diff": PresenceDiffCommand,
             "offered": OfferCommand,
             "game_over": GameOverCommand,
             "ready": ReadyCommand,
@@ -244,6 +495,12 @@ class CommandFactory(ABC):
             "move": MoveCommand,
             "offer": OfferCommand,
             "accept": AcceptCommand,
+            "options": OptionsCommand,
+            "sync": SyncCommand,
+            "watch": WatchCommand,
+            "unwatch": UnwatchCommand,
+            "subscribe_presence": SubscribePresenceCommand,
+            "unsubscribe_presence": UnsubscribePresenceCommand,
     }
 
     @staticmethod
@@ -255,4 +512,7 @@ class CommandFactory(ABC):
             raise CommandException(f"Wrong protocol version {data['version']}!")
         if command_type not in CommandFactory._commands:
             raise CommandException(f"Unknown command {command_type} found!")
-        return CommandFactory._commands[command_type](user_id, **parameters)
+        try:
+            return CommandFactory._commands[command_type](user_id, **parameters)
+        except (KeyError, TypeError):
+            raise CommandException(f"Malformed {command_type} command!")
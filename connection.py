@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Union
+from settings import SEND_QUEUE_SIZE, SEND_OVERFLOW_POLICY
+
+Frame = Union[str, bytes]
+
+
+class Connection:
+    """
+    Outbound side of a user socket.
+
+    Frames are put into a bounded queue and written by a dedicated writer task,
+    so a slow socket never blocks command handling of other users.
+    When the queue overflows, depending on policy, queued frames are replaced
+    with a state resync ('resync') or the socket is closed ('disconnect').
+    """
+    # weight of the last sample in average send latency
+    LATENCY_WEIGHT = 0.1
+
+    def __init__(self, user_id, ws, resync: Optional[Callable[[str, str], List[Frame]]] = None,
+                 fmt: str = 'json', maxsize: int = SEND_QUEUE_SIZE, policy: str = SEND_OVERFLOW_POLICY) -> None:
+        self.user_id = user_id
+        self.ws = ws
+        # negotiated protocol format: 'json' or 'binary'
+        self.fmt = fmt
+        # send only applied moves instead of full state updates
+        self.delta = False
+        self.resync = resync
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize)
+        self.closed = False
+        # statistics
+        self.sent = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.avg_latency = 0.0
+        self.max_latency = 0.0
+        self._writer = asyncio.ensure_future(self._write())
+
+    def send(self, frame: Frame) -> None:
+        """
+        Put frame into outbound queue without waiting.
+        """
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((time.monotonic(), frame))
+        except asyncio.QueueFull:
+            self._overflow()
+
+    def _overflow(self) -> None:
+        self.overflows += 1
+        frames = self.resync(self.user_id, self.fmt) if self.policy == 'resync' and self.resync is not None else None
+        if frames is None:
+            logging.info('outbound queue overflow, closing connection with user_id {}'.format(self.user_id))
+            self.close()
+            return
+        # client is behind anyway, so send it current state instead of outdated frames
+        logging.info('outbound queue overflow, resync connection with user_id {}'.format(self.user_id))
+        self.dropped += self.queue.qsize() + 1
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        now = time.monotonic()
+        for frame in frames[:self.queue.maxsize]:
+            self.queue.put_nowait((now, frame))
+
+    async def _write(self) -> None:
+        while True:
+            enqueued, frame = await self.queue.get()
+            try:
+                if isinstance(frame, str):
+                    await self.ws.send_str(frame)
+                else:
+                    await self.ws.send_bytes(frame)
+            except (ConnectionError, RuntimeError) as e:
+                logging.info('failed to send to user_id {}: {}'.format(self.user_id, e))
+                self.closed = True
+                return
+            latency = time.monotonic() - enqueued
+            self.avg_latency += (latency - self.avg_latency) * self.LATENCY_WEIGHT
+            self.max_latency = max(self.max_latency, latency)
+            self.sent += 1
+
+    def close(self) -> None:
+        """
+        Stop writing and close the socket, read loop of the socket finishes afterwards.
+        """
+        self.stop()
+        asyncio.ensure_future(self.ws.close())
+
+    def stop(self) -> None:
+        """
+        Stop writing, all queued frames are discarded.
+        """
+        self.closed = True
+        self._writer.cancel()
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def stats(self) -> Dict:
+        return {
+            'depth': self.depth(),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'overflows': self.overflows,
+            'avg_latency': self.avg_latency,
+            'max_latency': self.max_latency
+        }
+
+
+class RemoteConnection:
+    """
+    Outbound side of a user socket held by another worker process.
+
+    Frames are passed to forward callback, which sends them to that worker.
+    """
+    def __init__(self, user_id, worker: int, forward: Callable[[int, object, Frame], None],
+                 fmt: str = 'json') -> None:
+        self.user_id = user_id
+        self.worker = worker
+        self.forward = forward
+        self.fmt = fmt
+        self.delta = False
+        self.sent = 0
+
+    def send(self, frame: Frame) -> None:
+        self.forward(self.worker, self.user_id, frame)
+        self.sent += 1
+
+    def stop(self) -> None:
+        pass
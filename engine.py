@@ -0,0 +1,25 @@
+import importlib
+from settings import ENGINE_BACKEND
+# selects game engine implementation, all backends provide the same interface as xo_app_stub
+
+_backends = {
+    'xo_app': 'xo_app_stub',
+    'bitboard': 'bitboard_engine',
+}
+
+
+class UnknownBackendException(Exception):
+    def __init__(self, name):
+        super().__init__(f"Unknown engine backend {name}!")
+
+
+def load_backend(name: str):
+    """
+    Import engine backend module by its configuration name.
+    """
+    if name not in _backends:
+        raise UnknownBackendException(name)
+    return importlib.import_module(_backends[name])
+
+
+backend = load_backend(ENGINE_BACKEND)
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class GameActorClosed(Exception):
+    def __init__(self):
+        super().__init__()
+
+
+class GameActor:
+    """
+    Mailbox and task of one running game.
+
+    Jobs posted to the actor are run one by one in order of posting, so commands
+    of the same game never interleave, even if they await in between.
+    Jobs of different games run concurrently. Jobs left in the mailbox after
+    the actor is stopped fail with GameActorClosed.
+    """
+    def __init__(self) -> None:
+        self.mailbox = asyncio.Queue()
+        self.closed = False
+        self._task = asyncio.ensure_future(self._run())
+
+    async def call(self, job: Callable[..., Awaitable], *args):
+        """
+        Post job to the mailbox and wait for its result.
+        """
+        if self.closed:
+            raise GameActorClosed()
+        future = asyncio.get_event_loop().create_future()
+        self.mailbox.put_nowait((job, args, future))
+        return await future
+
+    def stop(self) -> None:
+        """
+        Stop after the current job, may be called from a job of the actor.
+        """
+        if not self.closed:
+            self.closed = True
+            # wake up the task if it is waiting for jobs
+            self.mailbox.put_nowait(None)
+
+    async def _run(self) -> None:
+        while not self.closed:
+            item = await self.mailbox.get()
+            if item is None:
+                continue
+            job, args, future = item
+            if future.cancelled():
+                continue
+            try:
+                result = await job(*args)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+        while not self.mailbox.empty():
+            item = self.mailbox.get_nowait()
+            if item is not None and not item[2].cancelled():
+                item[2].set_exception(GameActorClosed())
@@ -72,7 +72,7 @@ class Game:
         return self.watchers
 
     def add_new_watcher(self, user_id):
-        pass
+        self.watchers.add(user_id)
 
     def remove_watcher(self, user_id):
-        pass
+        self.watchers.discard(user_id)
@@ -1,5 +1,8 @@
 from players import Playground, Matcher
-global_playground = Playground(Matcher())
+from settings import MATCHER_TYPE
+from connection import Connection, RemoteConnection
+from typing import Dict, Optional
+global_playground = Playground(Matcher(MATCHER_TYPE))
 
 
 class SocketRegistry:
@@ -7,15 +10,51 @@ class SocketRegistry:
     Registry for all user sockets
     """
     sockets = {}
+    # connections of users of local games, whose sockets are held by other workers
+    remote = {}
+    # users receiving changes of online status
+    presence_subscribers = set()
 
     def get_socket(self, user_id):
-        return self.sockets[user_id]
+        return self.sockets[user_id].ws
 
-    def add_socket(self, user_id, ws):
-        self.sockets[user_id] = ws
+    def find_connection(self, user_id) -> Optional[Connection]:
+        connection = self.sockets.get(user_id)
+        return connection if connection is not None else self.remote.get(user_id)
+
+    def add_remote(self, user_id, connection: RemoteConnection) -> None:
+        self.remote[user_id] = connection
+
+    def remove_remote(self, user_id) -> None:
+        self.remote.pop(user_id, None)
+
+    def add_socket(self, user_id, ws, resync=None, fmt='json'):
+        self.sockets[user_id] = Connection(user_id, ws, resync, fmt)
 
     def remove_socket(self, user_id):
-        self.sockets.pop(user_id, None)
+        self.presence_subscribers.discard(user_id)
+        connection = self.sockets.pop(user_id, None)
+        if connection is not None:
+            connection.stop()
+
+    def stats(self) -> Dict:
+        """
+        Aggregated statistics of outbound queues for monitoring.
+        """
+        connections = list(self.sockets.values())
+        depths = [c.depth() for c in connections]
+        return {
+            'connections': len(connections),
+            'presence_subscribers': len(self.presence_subscribers),
+            'remote': len(self.remote),
+            'queued': sum(depths),
+            'max_depth': max(depths, default=0),
+            'sent': sum(c.sent for c in connections),
+            'dropped': sum(c.dropped for c in connections),
+            'overflows': sum(c.overflows for c in connections),
+            'avg_latency': sum(c.avg_latency for c in connections) / len(connections) if connections else 0.0,
+            'max_latency': max((c.max_latency for c in connections), default=0.0)
+        }
 
 
 registry = SocketRegistry()
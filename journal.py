@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from settings import JOURNAL_SYNC_MS, JOURNAL_COMPACT_RECORDS
+# append-only journal of running games, used to restore them after crash
+# file starts with magic and epoch, followed by records: 2 bytes length, 1 byte tag and payload
+# snapshot file has the same format and contains only creation and move records of running games
+
+JOURNAL_MAGIC = b'XOJ1'
+SNAPSHOT_MAGIC = b'XOS1'
+
+CREATED = ord('C')
+MOVED = ord('M')
+FINISHED = ord('F')
+
+NO_STRING = 0xffff
+
+_header = struct.Struct('>4sI')
+_length = struct.Struct('>H')
+_key = struct.Struct('>BI')
+_move = struct.Struct('>BIB')
+_string_length = struct.Struct('>H')
+
+
+class JournalException(Exception):
+    pass
+
+
+class JournalGame:
+    """
+    Running game restored from journal.
+    """
+    def __init__(self, game_type: Optional[str], first_id: Optional[str], second_id: Optional[str]) -> None:
+        self.game_type = game_type
+        self.first_id = first_id
+        self.second_id = second_id
+        # list of (square, vertical, horizontal)
+        self.moves = []
+
+
+def _pack_string(value: Optional[str]) -> bytes:
+    if value is None:
+        return _string_length.pack(NO_STRING)
+    data = str(value).encode('utf-8')
+    return _string_length.pack(len(data)) + data
+
+
+def _unpack_string(data: bytes, offset: int) -> tuple:
+    length, = _string_length.unpack_from(data, offset)
+    offset += _string_length.size
+    if length == NO_STRING:
+        return None, offset
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def _frame(payload: bytes) -> bytes:
+    return _length.pack(len(payload)) + payload
+
+
+def created_record(key: int, game_type: Optional[str], first_id, second_id) -> bytes:
+    return _frame(_key.pack(CREATED, key) + _pack_string(game_type) + _pack_string(first_id) +
+                  _pack_string(second_id))
+
+
+def moved_record(key: int, square: int, vertical: int, horizontal: int) -> bytes:
+    return _frame(_move.pack(MOVED, key, 16 * square + 4 * vertical + horizontal))
+
+
+def finished_record(key: int) -> bytes:
+    return _frame(_key.pack(FINISHED, key))
+
+
+def read_file(path: str, magic: bytes) -> tuple:
+    """
+    Read epoch and records of journal or snapshot file.
+
+    Incomplete record at the end of file (interrupted write) is ignored.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _header.size:
+        raise JournalException(f"Truncated header of {path}!")
+    file_magic, epoch = _header.unpack_from(data)
+    if file_magic != magic:
+        raise JournalException(f"Wrong magic of {path}!")
+    records = []
+    offset = _header.size
+    while offset + _length.size <= len(data):
+        length, = _length.unpack_from(data, offset)
+        offset += _length.size
+        if offset + length > len(data):
+            break
+        records.append(data[offset:offset + length])
+        offset += length
+    return epoch, records
+
+
+def apply_records(games: Dict[int, JournalGame], records: Iterable[bytes]) -> None:
+    for record in records:
+        tag = record[0]
+        if tag == CREATED:
+            _, key = _key.unpack_from(record)
+            game_type, offset = _unpack_string(record, _key.size)
+            first_id, offset = _unpack_string(record, offset)
+            second_id, offset = _unpack_string(record, offset)
+            games[key] = JournalGame(game_type, first_id, second_id)
+        elif tag == MOVED:
+            _, key, cell = _move.unpack(record)
+            if key in games:
+                games[key].moves.append((cell >> 4, (cell >> 2) & 3, cell & 3))
+        elif tag == FINISHED:
+            _, key = _key.unpack(record)
+            games.pop(key, None)
+
+
+class Journal:
+    """
+    Optional append-only journal of running games.
+
+    Creation, every accepted move and end of games are appended to in-memory buffer,
+    which is written and fsynced in groups by background task. After given number
+    of records, snapshot of all running games is written and journal is truncated,
+    so replay time stays bounded. Epoch in headers detects journal already
+    included in snapshot, if crash happened between snapshot and truncation.
+    """
+    def __init__(self) -> None:
+        self.path = None
+        self.file = None
+        self.epoch = 0
+        self.buffer = bytearray()
+        self.records = 0
+        self.live_games = None
+        self.sync_interval = JOURNAL_SYNC_MS / 1000
+        self.compact_records = JOURNAL_COMPACT_RECORDS
+        self._last_key = 0
+        self._task = None
+        self._flushing = None
+        # statistics
+        self.syncs = 0
+        self.compactions = 0
+        self.last_sync_latency = 0.0
+
+    def enabled(self) -> bool:
+        return self.file is not None
+
+    def snapshot_path(self) -> str:
+        return self.path + '.snapshot'
+
+    def recover(self, path: str) -> List[JournalGame]:
+        """
+        Read snapshot and journal, return games which were running.
+        """
+        self.path = path
+        games = {}
+        snapshot_epoch = 0
+        if os.path.exists(self.snapshot_path()):
+            snapshot_epoch, records = read_file(self.snapshot_path(), SNAPSHOT_MAGIC)
+            apply_records(games, records)
+        if os.path.exists(path):
+            epoch, records = read_file(path, JOURNAL_MAGIC)
+            if epoch >= snapshot_epoch:
+                apply_records(games, records)
+            snapshot_epoch = max(epoch, snapshot_epoch)
+        self.epoch = snapshot_epoch
+        return list(games.values())
+
+    async def start(self, path: str, live_games: Callable[[], Iterable]) -> None:
+        """
+        Open journal and write snapshot of currently running games, usually restored ones.
+        """
+        self.path = path
+        self.live_games = live_games
+        # unbuffered, so a failed write leaves nothing behind to be written twice
+        self.file = open(path, 'ab', buffering=0)
+        await self.compact()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        """
+        Stop background task, wait for write in progress and write the rest of records.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            try:
+                await self._flushing
+            except OSError as e:
+                logging.info('journal write failed: {}'.format(e))
+            self._flushing = None
+        if self.file is not None:
+            try:
+                await self.flush()
+            except OSError as e:
+                logging.info('journal write failed: {}'.format(e))
+            self.file.close()
+            self.file = None
+
+    def _next_key(self) -> int:
+        self._last_key += 1
+        return self._last_key
+
+    def _append(self, record: bytes) -> None:
+        self.buffer += record
+        self.records += 1
+
+    def game_created(self, game) -> None:
+        if not self.enabled():
+            return
+        game.journal_id = self._next_key()
+        self._append(created_record(game.journal_id, game.game_type, game.first().player_id,
+                                    game.second().player_id))
+
+    def move_applied(self, game, move) -> None:
+        if not self.enabled() or game.journal_id is None:
+            return
+        self._append(moved_record(game.journal_id, move.square, move.vertical, move.horizontal))
+
+    def game_finished(self, game) -> None:
+        if not self.enabled() or game.journal_id is None:
+            return
+        self._append(finished_record(game.journal_id))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self._flush_shielded()
+            except OSError as e:
+                logging.info('journal write failed: {}'.format(e))
+
+    async def _flush_shielded(self) -> None:
+        # cancelling the background task doesn't interrupt a write, close() waits for it instead
+        self._flushing = asyncio.ensure_future(self.flush())
+        await asyncio.shield(self._flushing)
+
+    async def flush(self) -> None:
+        """
+        Compact journal if enough records were appended since the last snapshot, else sync it.
+        """
+        if self.records >= self.compact_records:
+            await self.compact()
+        else:
+            await self.sync()
+
+    async def sync(self) -> None:
+        """
+        Write buffered records and fsync them as one group.
+
+        On failure records are returned to the buffer and written by the next sync.
+        """
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        started = time.monotonic()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, data)
+        except OSError:
+            self.buffer[:0] = data
+            raise
+        self.last_sync_latency = time.monotonic() - started
+        self.syncs += 1
+
+    def _write(self, data: bytes) -> None:
+        position = self.file.tell()
+        try:
+            self.file.write(data)
+            os.fsync(self.file.fileno())
+        except OSError:
+            # partially written record would break replay of the following ones
+            self.file.truncate(position)
+            raise
+
+    async def compact(self) -> None:
+        """
+        Replace journal with snapshot of running games.
+
+        Snapshot is built synchronously, so buffered records are already included in it.
+        If writing fails, the next flush takes a new snapshot instead of syncing the journal.
+        """
+        snapshot = bytearray()
+        for game in self.live_games():
+            if game.journal_id is None:
+                game.journal_id = self._next_key()
+            snapshot += created_record(game.journal_id, game.game_type, game.first().player_id,
+                                       game.second().player_id)
+            for move in game.moves:
+                snapshot += moved_record(game.journal_id, move.square, move.vertical, move.horizontal)
+        self.buffer.clear()
+        records = self.records
+        self.records = 0
+        self.epoch += 1
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write_snapshot, bytes(snapshot), self.epoch)
+        except OSError:
+            self.records += max(records, self.compact_records)
+            raise
+        self.compactions += 1
+
+    def _write_snapshot(self, snapshot: bytes, epoch: int) -> None:
+        tmp_path = self.snapshot_path() + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_header.pack(SNAPSHOT_MAGIC, epoch))
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path())
+        self.file.truncate(0)
+        self.file.write(_header.pack(JOURNAL_MAGIC, epoch))
+        os.fsync(self.file.fileno())
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled(),
+            'buffered': len(self.buffer),
+            'records': self.records,
+            'syncs': self.syncs,
+            'compactions': self.compactions,
+            'last_sync_latency': self.last_sync_latency
+        }
+
+
+journal = Journal()
@@ -0,0 +1,61 @@
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class Leaderboard:
+    """
+    Registered users ordered by rating.
+
+    Users are kept in a list sorted by (-rating, login), so rank of user is found
+    by binary search and top of the list is its prefix. Ratings are loaded once
+    at startup and then updated with every rated game.
+    """
+    def __init__(self) -> None:
+        # login -> rating
+        self.ratings = {}
+        # sorted list of (-rating, login)
+        self.order = []
+        # callbacks receiving local updates, used to pass them to other worker processes
+        self.listeners = []
+
+    def subscribe(self, listener: Callable[[str, float], None]) -> None:
+        self.listeners.append(listener)
+
+    def load(self, ratings: Iterable[Tuple[str, float]]) -> None:
+        self.ratings = dict(ratings)
+        self.order = sorted((-rating, login) for login, rating in self.ratings.items())
+
+    def update(self, login: str, rating: float, notify: bool = True) -> None:
+        if notify:
+            for listener in self.listeners:
+                listener(login, rating)
+        old_rating = self.ratings.get(login)
+        if old_rating is not None:
+            del self.order[bisect_left(self.order, (-old_rating, login))]
+        self.ratings[login] = rating
+        insort(self.order, (-rating, login))
+
+    def remove(self, login: str) -> None:
+        rating = self.ratings.pop(login, None)
+        if rating is not None:
+            del self.order[bisect_left(self.order, (-rating, login))]
+
+    def rank(self, login: str) -> Optional[int]:
+        """
+        Return rank of user starting from 1, None for unknown user.
+        """
+        rating = self.ratings.get(login)
+        if rating is None:
+            return None
+        # users with equal rating are ranked by login
+        return bisect_left(self.order, (-rating, login)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> List[Dict]:
+        return [{'rank': offset + i + 1, 'login': login, 'rating': -rating}
+                for i, (rating, login) in enumerate(self.order[offset:offset + limit])]
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+
+leaderboard = Leaderboard()
@@ -1,13 +1,15 @@
 from global_defs import global_playground
 from players import Entry, Game, Move
 from db import add_game_to_db
-from typing import Optional, Dict
+from journal import journal
+from cluster import cluster
+import logging
+from typing import Optional, Dict, List
 
 
 async def add_new_entry(uid, data):
     player = global_playground.player(uid)
-    entry = Entry(player)
-    global_playground.add_entry(entry)
+    global_playground.add_entry(Entry.from_parameters(player, data['parameters']))
 
 
 async def try_create_new_game(uid):
@@ -18,9 +20,39 @@ async def try_create_new_game(uid):
     if match is not None:
         # create new game
         game = global_playground.add_game(match)
+        journal.game_created(game)
     return game
 
 
+async def create_games_batch(batch: bool = True) -> List[Game]:
+    # match the whole waiting pool at once
+    matches = global_playground.find_matches(batch)
+    games = [global_playground.add_game(match) for match in matches]
+    for game in games:
+        journal.game_created(game)
+    return games
+
+
+async def start_matched_game(game_type: str, first_id: str, second_id: str) -> Game:
+    # game of players matched by matchmaking broker of worker processes
+    game = global_playground.create_game(game_type, first_id, second_id)
+    journal.game_created(game)
+    return game
+
+
+async def recover_games(path: str) -> List[Game]:
+    # restore running games from journal and start journaling
+    games = []
+    for record in journal.recover(path):
+        try:
+            games.append(global_playground.restore_game(record.game_type, record.first_id, record.second_id,
+                                                        record.moves))
+        except Exception as e:
+            logging.info('failed to restore game of {} and {}: {}'.format(record.first_id, record.second_id, e))
+    await journal.start(path, global_playground.games)
+    return games
+
+
 async def resign_game(uid):
     game = None
     player = global_playground.player(uid)
@@ -28,12 +60,26 @@ async def resign_game(uid):
         game = player.game
         result = "first_win" if player.side == "second" else "second_win"
         game.set_result(result)
-        await add_game_to_db(game)
+        await add_game_to_db(game, 'resignation')
     return game
 
 
+async def watch_game(uid: str, target_id: str) -> Game:
+    return global_playground.watch(uid, target_id)
+
+
+async def unwatch_game(uid: str) -> Optional[Game]:
+    return global_playground.unwatch(uid)
+
+
 async def clear_game(game: Game):
+    journal.game_finished(game)
+    if game.actor is not None:
+        game.actor.stop()
+        game.actor = None
+    remote_ids = cluster.remote_ids(game)
     game.clear()
+    cluster.release(remote_ids)
 
 
 async def new_move(uid: str, data: Dict) -> Optional[Game]:
@@ -43,8 +89,9 @@ async def new_move(uid: str, data: Dict) -> Optional[Game]:
         game = player.game
         game.set_new_move(Move.create_move(player.side, data['parameters']['square'],
                                            data['parameters']['vertical'], data['parameters']['horizontal']))
+        journal.move_applied(game, game.last_move)
         game.update_result()
         if game.is_finished():
             # save game to db
-            await add_game_to_db(game)
+            await add_game_to_db(game, 'win_rule')
     return game
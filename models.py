@@ -1,8 +1,10 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Integer, String, Boolean, Column, ForeignKey, JSON, select
+from sqlalchemy import Integer, String, Boolean, Float, Column, ForeignKey, JSON, select, update, insert, bindparam, \
+    case, Index, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Dict, List, Optional, Tuple
 from utils import current_timestamp
-from passlib.hash import sha256_crypt
-import asyncio
+from ratings import DEFAULT_RATING
 
 Base = declarative_base()
 
@@ -21,39 +23,94 @@ class User(Base):
     password_hash = Column(String(256), nullable=False)
     online = Column(Boolean, default=True)
     deleted = Column(Boolean, default=False)
+    rating = Column(Float, default=DEFAULT_RATING, nullable=False)
 
+    # users list is filtered by online status and paginated by login
+    __table_args__ = (Index('ix_users_online_login', 'online', 'login'),)
     __mapper_args__ = {"eager_defaults": True}
 
     @staticmethod
-    def create_new(login: str, password: str):
+    def create_new(login: str, password_hash: str):
+        # password is hashed off the event loop, see passwords.py
         user = User()
         user.login = login
-        user.password_hash = sha256_crypt.hash(password)
+        user.password_hash = password_hash
         return user
 
-    def check_password(self, password: str):
-        return sha256_crypt.verify(password, self.password_hash)
+    @staticmethod
+    async def find_profile(session, login: str) -> Tuple[Optional[int], float]:
+        """
+        Return id and rating of user, for unknown user id is None, within current transaction.
+        """
+        stmt = select(User.id, User.rating).where(User.login == login)
+        result = await session.execute(stmt)
+        row = result.first()
+        if row is None:
+            return None, DEFAULT_RATING
+        return row.id, row.rating
 
-    def ping(self):
-        self.last_seen_at = current_timestamp()
-        self.online = True
+    @staticmethod
+    async def load_ratings(session) -> List[Tuple[str, float]]:
+        """
+        Return (login, rating) pairs of all not deleted users, within current transaction.
+        """
+        result = await session.execute(select(User.login, User.rating).where(User.deleted == False))
+        return [(row.login, row.rating) for row in result]
 
     @staticmethod
-    async def find_offline_users(session):
-        stmt = select(User).where(User.last_seen_at < current_timestamp() - 60, User.online == True)
-        async with session.begin():
-            result = await session.execute(stmt)
-            users = result.scalars().all()
-            for user in users:
-                user.online = False
-                session.add(user)
+    async def find_logins(session, ids) -> Dict[int, str]:
+        """
+        Return logins of users by their ids, within current transaction.
+        """
+        result = await session.execute(select(User.id, User.login).where(User.id.in_(list(ids))))
+        return {row.id: row.login for row in result}
 
+    @staticmethod
+    async def save_ratings(session, ratings) -> None:
+        """
+        Save ratings of several users in one statement, within current transaction.
 
-async def background(session):
-    while True:
-        await User.find_offline_users(session)
-        await asyncio.sleep(30)
+        ratings is a sequence of (login, rating) pairs.
+        """
+        table = User.__table__
+        stmt = update(table).where(table.c.login == bindparam('b_login')).\
+            values(rating=bindparam('b_rating'), last_seen_at=table.c.last_seen_at)
+        await session.execute(stmt, [{'b_login': login, 'b_rating': rating} for login, rating in ratings])
 
+    @staticmethod
+    async def save_last_seen(session, timestamps) -> None:
+        """
+        Save last seen time of several users in one statement, within current transaction.
+
+        timestamps is a sequence of (login, timestamp) pairs.
+        """
+        table = User.__table__
+        stmt = update(table).where(table.c.login == bindparam('b_login')).\
+            values(last_seen_at=bindparam('b_last_seen_at'))
+        await session.execute(stmt, [{'b_login': login, 'b_last_seen_at': timestamp}
+                                     for login, timestamp in timestamps])
+
+    @staticmethod
+    async def save_presence(session, changes: Dict[str, bool]) -> None:
+        """
+        Save online status of several users in one statement, within current transaction.
+
+        changes maps login to online flag.
+        """
+        table = User.__table__
+        online = [login for login, value in changes.items() if value]
+        stmt = update(table).where(table.c.login.in_(list(changes))).\
+            values(online=case((table.c.login.in_(online), True), else_=False), last_seen_at=table.c.last_seen_at)
+        await session.execute(stmt)
+
+    @staticmethod
+    async def reset_online(session) -> None:
+        """
+        Mark all users offline, within current transaction.
+        """
+        table = User.__table__
+        await session.execute(update(table).where(table.c.online == True).
+                              values(online=False, last_seen_at=table.c.last_seen_at))
 
 
 class EntryException(Exception):
@@ -70,3 +127,106 @@ class Entry(Base):
     criteria = Column(JSON)
 
     __mapper_args__ = {"eager_defaults": True}
+
+
+class Game(Base):
+    """The finished Game model."""
+    __tablename__ = 'games'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    first_user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    second_user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    game_type = Column(String(32))
+    result = Column(String(16), nullable=False)
+    cause = Column(String(16), nullable=False)
+    started_at = Column(Integer)
+    finished_at = Column(Integer, default=current_timestamp)
+    # list of [square, vertical, horizontal]
+    moves = Column(JSON)
+
+    # history of user is paginated by (finished_at, id) for each side
+    __table_args__ = (Index('ix_games_first_user_finished', 'first_user_id', 'finished_at', 'id'),
+                      Index('ix_games_second_user_finished', 'second_user_id', 'finished_at', 'id'))
+
+    @staticmethod
+    async def insert_many(session, records: List[Dict]) -> None:
+        """
+        Insert several games with one multi-row statement, within current transaction.
+        """
+        await session.execute(insert(Game.__table__).values(records))
+
+    @staticmethod
+    async def history(session, user_id: int, before: Optional[Tuple[int, int]], limit: int) -> List:
+        """
+        Return page of games of user, the latest first, within current transaction.
+
+        before is (finished_at, id) of the last game of the previous page.
+        """
+        def side(column):
+            stmt = select(Game.id, Game.first_user_id, Game.second_user_id, Game.game_type, Game.result,
+                          Game.cause, Game.started_at, Game.finished_at).where(column == user_id)
+            if before is not None:
+                stmt = stmt.where(tuple_(Game.finished_at, Game.id) < tuple_(*before))
+            return stmt.order_by(Game.finished_at.desc(), Game.id.desc()).limit(limit).subquery()
+
+        # each side is read from its own index, then both pages are merged
+        games = union_all(select(side(Game.first_user_id)), select(side(Game.second_user_id))).subquery()
+        stmt = select(games).order_by(games.c.finished_at.desc(), games.c.id.desc()).limit(limit)
+        result = await session.execute(stmt)
+        return result.all()
+
+
+class UserStats(Base):
+    """Results of archived games of user, updated together with archive."""
+    __tablename__ = 'user_stats'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+
+    @staticmethod
+    def increments(records: List[Dict]) -> List[Dict]:
+        """
+        Sum results of archived games per user.
+        """
+        totals = {}
+        for record in records:
+            result = record['result']
+            for user_id, win in ((record['first_user_id'], 'first_win'), (record['second_user_id'], 'second_win')):
+                if user_id is None:
+                    continue
+                row = totals.setdefault(user_id, {'user_id': user_id, 'games': 0, 'wins': 0, 'losses': 0,
+                                                  'draws': 0})
+                row['games'] += 1
+                if result == win:
+                    row['wins'] += 1
+                elif result == 'draw':
+                    row['draws'] += 1
+                elif result in ('first_win', 'second_win'):
+                    row['losses'] += 1
+        return list(totals.values())
+
+    @staticmethod
+    async def add_many(session, increments: List[Dict]) -> None:
+        """
+        Add increments to statistics of several users in one upsert, within current transaction.
+        """
+        table = UserStats.__table__
+        stmt = pg_insert(table).values(increments)
+        stmt = stmt.on_conflict_do_update(index_elements=[table.c.user_id], set_={
+            column: table.c[column] + stmt.excluded[column] for column in ('games', 'wins', 'losses', 'draws')
+        })
+        await session.execute(stmt)
+
+    @staticmethod
+    async def find(session, user_id: int) -> Dict:
+        """
+        Return statistics of user, within current transaction.
+        """
+        stmt = select(UserStats.games, UserStats.wins, UserStats.losses, UserStats.draws).\
+            where(UserStats.user_id == user_id)
+        result = await session.execute(stmt)
+        row = result.first()
+        if row is None:
+            return {'games': 0, 'wins': 0, 'losses': 0, 'draws': 0}
+        return dict(row._mapping)
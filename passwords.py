@@ -0,0 +1,108 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+from passlib.hash import sha256_crypt
+from settings import PASSWORD_ROUNDS, PASSWORD_EXECUTOR, PASSWORD_WORKERS, PASSWORD_MAX_WAITING
+
+
+class PasswordHasherBusy(Exception):
+    def __init__(self):
+        super().__init__()
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return sha256_crypt.using(rounds=rounds).hash(password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    return sha256_crypt.verify(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Hashing and verification of passwords off the event loop.
+
+    Work is done by a bounded pool of processes (or threads), at most 'workers'
+    jobs at once. Requests waiting above 'max_waiting' are rejected with
+    PasswordHasherBusy, so a burst of logins can't grow an unbounded backlog.
+    """
+    # weight of the last sample in average times
+    TIME_WEIGHT = 0.1
+
+    def __init__(self, rounds: int = PASSWORD_ROUNDS, executor_type: str = PASSWORD_EXECUTOR,
+                 workers: int = PASSWORD_WORKERS, max_waiting: int = PASSWORD_MAX_WAITING) -> None:
+        self.rounds = rounds
+        self.executor_type = executor_type
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.executor = None
+        self._slots = None
+        self.waiting = 0
+        self.running = 0
+        # statistics
+        self.completed = 0
+        self.rejected = 0
+        self.avg_queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.avg_run_time = 0.0
+
+    def _executor(self) -> Executor:
+        if self.executor is None:
+            if self.executor_type == 'thread':
+                self.executor = ThreadPoolExecutor(self.workers)
+            else:
+                self.executor = ProcessPoolExecutor(self.workers)
+            self._slots = asyncio.Semaphore(self.workers)
+        return self.executor
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def _run(self, func, *args):
+        executor = self._executor()
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        enqueued = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.monotonic()
+        queue_time = started - enqueued
+        self.avg_queue_time += (queue_time - self.avg_queue_time) * self.TIME_WEIGHT
+        self.max_queue_time = max(self.max_queue_time, queue_time)
+        self.running += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(executor, func, *args)
+        finally:
+            self.running -= 1
+            self._slots.release()
+            self.avg_run_time += (time.monotonic() - started - self.avg_run_time) * self.TIME_WEIGHT
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, password_hash: Optional[str]) -> bool:
+        if password_hash is None:
+            return False
+        return await self._run(verify_password, password, password_hash)
+
+    def stats(self) -> Dict:
+        return {
+            'waiting': self.waiting,
+            'running': self.running,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'avg_queue_time': self.avg_queue_time,
+            'max_queue_time': self.max_queue_time,
+            'avg_run_time': self.avg_run_time
+        }
+
+
+hasher = PasswordHasher()
@@ -1,5 +1,11 @@
-import xo_app_stub
-from typing import Optional, Iterable
+from engine import backend
+from ratings import DEFAULT_RATING
+from settings import RATING_WINDOW_BASE, RATING_WINDOW_RATE, RATING_WINDOW_MAX, MATCHMAKING_WAIT_COST
+from collections import OrderedDict, deque
+from bisect import bisect_left, insort
+from typing import Optional, Dict, List
+import time
+from utils import current_timestamp
 
 
 class Entry:
@@ -9,6 +15,29 @@ class Entry:
         self.side = None
         self.requested_user_id = None
         self.entry_type = None  # broadcast, bot, user
+        # rating of player and arrival order, set when entry is queued
+        self.rating = None
+        self.seq = None
+        self.created_at = None
+
+    @staticmethod
+    def from_parameters(player: 'Player', parameters: Dict) -> 'Entry':
+        """
+        Create entry from parameters of 'ready' command.
+        """
+        entry = Entry(player)
+        entry.game_type = parameters['type']
+        side = parameters.get('side')
+        entry.side = side if side in ('first', 'second') else None
+        opponent = parameters['opponent']
+        if opponent == 'random':
+            entry.entry_type = 'broadcast'
+        elif opponent == 'bot':
+            entry.entry_type = 'bot'
+        else:
+            entry.entry_type = 'user'
+            entry.requested_user_id = opponent
+        return entry
 
 
 class Player:
@@ -21,9 +50,15 @@ class Player:
     'add_entry' and exits by calling 'remove_entry()' or 'add_game()'.
     In playing state contains reference to game and caches info about side and opponent.
     Enters in this state by calling 'add_game()' and exits by calling 'remove_game()'.
+    Independently of state player may watch one game of other players.
     """
-    def __init__(self, player_id: str) -> None:
+    def __init__(self, player_id: str, rating: float = DEFAULT_RATING, account_id: Optional[int] = None) -> None:
         self.player_id = player_id
+        self.rating = rating
+        # id of user in database, None for anonymous players
+        self.account_id = account_id
+        # False for players of games restored after restart, until they reconnect
+        self.connected = True
         self.status = "idle"
         # for waiting state
         self.entry = None
@@ -31,6 +66,8 @@ class Player:
         self.game = None
         self.side = None
         self.opp = None
+        # game watched as a spectator
+        self.watching = None
 
     def add_entry(self, entry: Entry) -> None:
         """
@@ -101,6 +138,13 @@ class Move:
         m.player_to_move = ptm
         return m
 
+    def to_dict(self) -> Dict:
+        return {
+            'square': self.square,
+            'vertical': self.vertical,
+            'horizontal': self.horizontal
+        }
+
 
 class Match:
     def __init__(self, player1: Player, player2: Player, game_type: str) -> None:
@@ -109,6 +153,22 @@ class Match:
         self.game_type = game_type
 
 
+class GameSnapshot:
+    """
+    Serializable state of a game at a particular version.
+    """
+    def __init__(self, version: int, seq: int, board: str, player_to_move: str, last_move: Optional[Dict],
+                 result: str, win_pos: Optional[str]) -> None:
+        self.version = version
+        # number of applied moves, used by clients to detect missed updates
+        self.seq = seq
+        self.board = board
+        self.player_to_move = player_to_move
+        self.last_move = last_move
+        self.result = result
+        self.win_pos = win_pos
+
+
 class GameException(Exception):
     def __init__(self):
         super().__init__()
@@ -139,6 +199,11 @@ class WrongResultException(GameException):
         super().__init__()
 
 
+class WrongMoveException(GameException):
+    def __init__(self):
+        super().__init__()
+
+
 class Game:
     """
     Wraps game state and logic.
@@ -152,6 +217,17 @@ class Game:
         self.result = 'none'
         self.can_accept = None
         self.last_move = None
+        self.moves = []
+        self.started_at = None
+        # key of the game in journal
+        self.journal_id = None
+        # spectators by their ids
+        self.watchers = {}
+        # actor serializing commands of the running game, see game_actor.py
+        self.actor = None
+        # incremented on every state change, snapshot is rebuilt at most once per version
+        self.version = 0
+        self._snapshot = None
 
     def setup(self, match: Match) -> None:
         """
@@ -178,8 +254,10 @@ class Game:
         """
         if self.status != 'ready':
             raise GameNotReadyException()
-        self.game_id = xo_app_stub.create_new_game()
+        self.game_id = backend.create_new_game()
+        self.started_at = current_timestamp()
         self.status = "running"
+        self.version += 1
         return self.game_id
 
     def clear(self) -> None:
@@ -189,16 +267,24 @@ class Game:
         Game transits to 'idle' state.
         """
         if self.status == "running":
-            xo_app_stub.release_game(self.game_id)
+            backend.release_game(self.game_id)
         self.game_id = None
         self.first_player.remove_game()
         self.second_player.remove_game()
+        for watcher in self.watchers.values():
+            watcher.watching = None
+        self.watchers = {}
         self.first_player = None
         self.second_player = None
         self.status = "idle"
         self.game_type = None
         self.can_accept = None
         self.last_move = None
+        self.moves = []
+        self.started_at = None
+        self.journal_id = None
+        self.version += 1
+        self._snapshot = None
 
     def first(self) -> Player:
         """
@@ -234,19 +320,27 @@ class Game:
         if res not in results:
             raise WrongResultException()
         self.result = res
+        self.version += 1
 
     def set_new_move(self, move: Move) -> None:
         """
         Set new move in this game.
 
         If player tries to move out of his order, WrongPlayerException() is raised.
+        Move to occupied cell or after the end of game raises WrongMoveException().
         """
         if self.status != 'running':
             raise GameNotRunningException()
         if move.player_to_move == self.player_to_move():
-            xo_app_stub.set_new_move(self.game_id, move.player_to_move, [move.square, move.vertical, move.horizontal])
+            try:
+                backend.set_new_move(self.game_id, move.player_to_move,
+                                     [move.square, move.vertical, move.horizontal])
+            except (backend.InvalidCoordsException, backend.InvalidPlayerException):
+                raise WrongMoveException()
             self.can_accept = None
             self.last_move = move
+            self.moves.append(move)
+            self.version += 1
         else:
             raise WrongPlayerException()
 
@@ -258,7 +352,7 @@ class Game:
         """
         if self.status != 'running':
             raise GameNotRunningException()
-        return xo_app_stub.get_board(self.game_id)
+        return backend.get_board(self.game_id)
 
     def player_to_move(self) -> str:
         """
@@ -268,7 +362,7 @@ class Game:
         """
         if self.status != 'running':
             raise GameNotRunningException()
-        return xo_app_stub.get_player_to_move(self.game_id)
+        return backend.get_player_to_move(self.game_id)
 
     def is_finished(self) -> bool:
         """
@@ -276,7 +370,7 @@ class Game:
         """
         if self.status != 'running':
             raise GameNotRunningException()
-        return xo_app_stub.finished(self.game_id)
+        return backend.finished(self.game_id)
 
     def update_result(self) -> None:
         """
@@ -286,7 +380,10 @@ class Game:
         """
         if self.status != 'running':
             raise GameNotRunningException()
-        self.result = xo_app_stub.result(self.game_id)
+        res = backend.result(self.game_id)
+        if res != self.result:
+            self.result = res
+            self.version += 1
 
     def get_result(self) -> str:
         """
@@ -306,7 +403,7 @@ class Game:
         """
         if self.status != 'running':
             raise GameNotRunningException()
-        return xo_app_stub.get_win_coords(self.game_id)
+        return backend.get_win_coords(self.game_id)
 
     def get_moves(self) -> str:
         """
@@ -316,7 +413,26 @@ class Game:
         """
         if self.status != 'running':
             raise GameNotRunningException()
-        return xo_app_stub.get_moves(self.game_id)
+        return backend.get_moves(self.game_id)
+
+    def add_watcher(self, player: Player) -> None:
+        """
+        Add spectator to the running game.
+        """
+        if self.status != 'running':
+            raise GameNotRunningException()
+        self.watchers[player.player_id] = player
+        player.watching = self
+
+    def remove_watcher(self, player: Player) -> None:
+        """
+        Remove spectator from the game.
+        """
+        if self.watchers.pop(player.player_id, None) is not None:
+            player.watching = None
+
+    def watcher_ids(self) -> List:
+        return list(self.watchers)
 
     def set_draw_offer(self, player) -> None:
         self.can_accept = player
@@ -330,6 +446,22 @@ class Game:
             raise GameNotRunningException()
         return self.last_move
 
+    def snapshot(self) -> GameSnapshot:
+        """
+        Get serializable state of the game for the current version.
+
+        Engine is queried only when the game state has changed since the last call.
+        """
+        if self.status != 'running':
+            raise GameNotRunningException()
+        if self._snapshot is None or self._snapshot.version != self.version:
+            last_move = self.last_move.to_dict() if self.last_move is not None else None
+            win_pos = backend.get_win_coords(self.game_id) if self.result != 'none' else None
+            self._snapshot = GameSnapshot(self.version, len(self.moves), backend.get_board(self.game_id),
+                                          backend.get_player_to_move(self.game_id), last_move,
+                                          self.result, win_pos)
+        return self._snapshot
+
 
 class PlaygroundException(Exception):
     def __init__(self):
@@ -376,17 +508,332 @@ class NotPlayingException(PlaygroundException):
         super().__init__()
 
 
-class Matcher:
+class OwnGameException(PlaygroundException):
     def __init__(self):
-        self.type = 1
+        super().__init__()
+
+
+class MatchQueues:
+    """
+    Index of waiting entries.
+
+    Entries are kept in FIFO queues by game type, entry type and requested side.
+    Direct challenges are additionally indexed by requested user id.
+    Adding, removing and finding the oldest entry are O(1).
+    Broadcast entries are also kept sorted by rating for each game type.
+    """
+    # sides of opponents compatible with the requested side, in order of preference
+    compatible_sides = {
+        None: (None, 'first', 'second'),
+        'first': ('second', None),
+        'second': ('first', None),
+    }
+
+    def __init__(self) -> None:
+        self.queues = {}
+        self.challenges = {}
+        self.by_user = {}
+        # game type -> sorted list of (rating, seq, entry)
+        self.ratings = {}
+        self._last_seq = 0
+
+    def add(self, entry: Entry) -> None:
+        self._last_seq += 1
+        entry.seq = self._last_seq
+        entry.rating = entry.player.rating
+        entry.created_at = time.monotonic()
+        key = (entry.game_type, entry.entry_type, entry.side)
+        self.queues.setdefault(key, OrderedDict())[entry] = None
+        if entry.entry_type == 'user':
+            self.challenges.setdefault(entry.requested_user_id, {})[entry.player.player_id] = entry
+        elif entry.entry_type == 'broadcast':
+            insort(self.ratings.setdefault(entry.game_type, []), (entry.rating, entry.seq, entry))
+        self.by_user[entry.player.player_id] = entry
+
+    def remove(self, entry: Entry) -> None:
+        key = (entry.game_type, entry.entry_type, entry.side)
+        queue = self.queues[key]
+        del queue[entry]
+        if not queue:
+            del self.queues[key]
+        if entry.entry_type == 'user':
+            requests = self.challenges[entry.requested_user_id]
+            del requests[entry.player.player_id]
+            if not requests:
+                del self.challenges[entry.requested_user_id]
+        elif entry.entry_type == 'broadcast':
+            ratings = self.ratings[entry.game_type]
+            del ratings[bisect_left(ratings, (entry.rating, entry.seq))]
+            if not ratings:
+                del self.ratings[entry.game_type]
+        del self.by_user[entry.player.player_id]
+
+    def entry_of(self, user_id: str) -> Optional[Entry]:
+        return self.by_user.get(user_id)
+
+    def challengers(self, requested_id: str) -> List[Entry]:
+        """
+        Return entries challenging requested user.
+        """
+        return list(self.challenges.get(requested_id, {}).values())
+
+    def oldest(self, game_type: str, entry_type: str, side: Optional[str], exclude: Entry) -> Optional[Entry]:
+        """
+        Return the oldest entry compatible with a requested side, excluding given entry.
+        """
+        found = None
+        for opp_side in self.compatible_sides[side]:
+            queue = self.queues.get((game_type, entry_type, opp_side))
+            if not queue:
+                continue
+            for candidate in queue:
+                if candidate is not exclude:
+                    if found is None or candidate.seq < found.seq:
+                        found = candidate
+                    break
+        return found
+
+    def nearest(self, entry: Entry, max_distance: float, accept) -> Optional[Entry]:
+        """
+        Return broadcast entry of the same game type with the closest rating, accepted by predicate.
+
+        Entries are visited in order of rating distance, up to max_distance.
+        """
+        ratings = self.ratings.get(entry.game_type, [])
+        index = bisect_left(ratings, (entry.rating, entry.seq))
+        low = index - 1
+        high = index
+        while True:
+            low_distance = entry.rating - ratings[low][0] if low >= 0 else None
+            high_distance = ratings[high][0] - entry.rating if high < len(ratings) else None
+            if high_distance is not None and (low_distance is None or high_distance <= low_distance):
+                distance, candidate = high_distance, ratings[high][2]
+                high += 1
+            elif low_distance is not None:
+                distance, candidate = low_distance, ratings[low][2]
+                low -= 1
+            else:
+                return None
+            if distance > max_distance:
+                return None
+            if candidate is not entry and accept(candidate):
+                return candidate
+
+    def __len__(self) -> int:
+        return len(self.by_user)
+
+    def __contains__(self, entry: Entry) -> bool:
+        return self.by_user.get(entry.player.player_id) is entry
+
+    def __iter__(self):
+        return iter(list(self.by_user.values()))
+
+
+class WaitStats:
+    """
+    Recent times from queueing to match, used to tune matchmaking.
+    """
+    def __init__(self, size: int = 1000) -> None:
+        self.samples = deque(maxlen=size)
+        self.matched = 0
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.matched += 1
+
+    def percentiles(self) -> Dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {'matched': self.matched, 'p50': None, 'p90': None, 'p99': None}
 
-    def match(self, entry: Entry, es: Iterable[Entry]) -> Optional[Match]:
-        if self.type == 1:
-            for e in es:
-                if e is not entry:
-                    return Match(e.player, entry.player, e.game_type)
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {'matched': self.matched, 'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)}
+
+
+class Matcher:
+    """
+    Finds opponents for new entries.
+
+    'fifo' type matches the oldest compatible entry.
+    'rating' type matches compatible entry with the closest rating, if the rating gap fits into
+    the window of at least one of entries. The window widens while entry is waiting.
+    """
+    def __init__(self, match_type: str = 'fifo'):
+        self.type = match_type
+
+    def match(self, entry: Entry, queues: MatchQueues) -> Optional[Match]:
+        if self.type == 'rating' and entry.entry_type == 'broadcast':
+            opp_entry = self.find_rated_opponent(entry, queues)
+        else:
+            opp_entry = self.find_opponent(entry, queues)
+        if opp_entry is not None:
+            return self.create_match(opp_entry, entry)
+        return None
+
+    @staticmethod
+    def window(entry: Entry, now: float) -> float:
+        """
+        Allowed rating gap for an entry, depending on waiting time.
+        """
+        return min(RATING_WINDOW_BASE + RATING_WINDOW_RATE * (now - entry.created_at), RATING_WINDOW_MAX)
+
+    def find_rated_opponent(self, entry: Entry, queues: MatchQueues, used=()) -> Optional[Entry]:
+        """
+        Find opponent for a broadcast entry by rating, skipping entries in used.
+
+        Direct challenges to the entry user are preferred.
+        """
+        for other in queues.challengers(entry.player.player_id):
+            if other not in used and self.compatible(entry, other):
+                return other
+        now = time.monotonic()
+        own_window = self.window(entry, now)
+
+        def accept(other):
+            gap = abs(entry.rating - other.rating)
+            return other not in used and self.compatible(entry, other) and \
+                (gap <= own_window or gap <= self.window(other, now))
+
+        return queues.nearest(entry, RATING_WINDOW_MAX, accept)
+
+    @staticmethod
+    def compatible(entry: Entry, other: Entry) -> bool:
+        return entry.game_type == other.game_type and \
+            other.side in MatchQueues.compatible_sides[entry.side]
+
+    @staticmethod
+    def create_match(waiting: Entry, entry: Entry) -> Match:
+        """
+        Create match of two entries, by default waiting entry moves first.
+        """
+        if entry.side == 'first' or waiting.side == 'second':
+            return Match(entry.player, waiting.player, entry.game_type)
+        return Match(waiting.player, entry.player, entry.game_type)
+
+    def find_opponent(self, entry: Entry, queues: MatchQueues) -> Optional[Entry]:
+        """
+        Find opponent entry for a new entry.
+
+        Direct challenge matches mutual challenge or a broadcast entry of the requested user.
+        Broadcast entry matches challenge to its user or the oldest compatible broadcast entry.
+        Bot entries are never matched here.
+        """
+        user_id = entry.player.player_id
+        if entry.entry_type == 'user':
+            other = queues.entry_of(entry.requested_user_id)
+            if other is not None and other is not entry and \
+                    (other.entry_type == 'broadcast' or other.requested_user_id == user_id) and \
+                    self.compatible(entry, other):
+                return other
+        elif entry.entry_type == 'broadcast':
+            for other in queues.challengers(user_id):
+                if self.compatible(entry, other):
+                    return other
+            return queues.oldest(entry.game_type, 'broadcast', entry.side, entry)
         return None
 
+    def acceptable(self, entry: Entry, other: Entry, now: float) -> bool:
+        if not self.compatible(entry, other):
+            return False
+        if self.type != 'rating':
+            return True
+        gap = abs(entry.rating - other.rating)
+        return gap <= self.window(entry, now) or gap <= self.window(other, now)
+
+    def match_waiting(self, queues: MatchQueues) -> List[Match]:
+        """
+        Retry matching of waiting broadcast entries, oldest first.
+
+        With inline matching entries are matched on arrival only, while rating windows
+        of waiting entries widen with time, so rating matcher retries them periodically.
+        """
+        if self.type != 'rating':
+            return []
+        matches = []
+        used = set()
+        waiting = sorted((e for ratings in queues.ratings.values() for _, _, e in ratings), key=lambda e: e.seq)
+        for entry in waiting:
+            if entry in used:
+                continue
+            other = self.find_rated_opponent(entry, queues, used)
+            if other is not None:
+                used.add(entry)
+                used.add(other)
+                matches.append(self.create_match(*sorted((entry, other), key=lambda e: e.seq)))
+        return matches
+
+    def match_batch(self, queues: MatchQueues) -> List[Match]:
+        """
+        Pair all waiting entries at once.
+
+        Direct challenges are matched first. Then for each game type broadcast entries,
+        sorted by rating, are paired by dynamic programming, minimizing sum of rating gaps
+        of pairs plus costs of entries left unmatched, see pair_sorted for its limits.
+        Leaving an entry unmatched costs more the longer it waits, so long waiting entries
+        are paired first.
+        """
+        now = time.monotonic()
+        matches = []
+        used = set()
+        challenges = [entry for requests in queues.challenges.values() for entry in requests.values()]
+        for entry in challenges:
+            if entry in used:
+                continue
+            other = self.find_opponent(entry, queues)
+            if other is not None and other not in used:
+                used.add(entry)
+                used.add(other)
+                matches.append(self.create_match(*sorted((entry, other), key=lambda e: e.seq)))
+        for ratings in queues.ratings.values():
+            entries = [e for _, _, e in ratings if e not in used]
+            matches.extend(self.pair_sorted(entries, now))
+        return matches
+
+    def pair_sorted(self, entries: List[Entry], now: float) -> List[Match]:
+        """
+        Pairing of minimal cost of entries sorted by rating.
+
+        Exchanging partners of crossing or nested pairs never increases the sum of gaps,
+        so only pairs with unmatched entries between them are considered. Partners are
+        looked for within the maximal rating window, which bounds the work per entry.
+        The result is optimal unless rating windows forbid such exchange.
+        """
+        def unmatched_cost(e):
+            return RATING_WINDOW_MAX + MATCHMAKING_WAIT_COST * (now - e.created_at)
+
+        count = len(entries)
+        # skipped[i] - sum of unmatched costs of first i entries
+        skipped = [0.0] * (count + 1)
+        for i, entry in enumerate(entries):
+            skipped[i + 1] = skipped[i] + unmatched_cost(entry)
+        # cost[j] - minimal cost for first j entries, partner[j] - index of partner of entry j-1 or None
+        cost = [0.0] * (count + 1)
+        partner = [None] * (count + 1)
+        for j in range(1, count + 1):
+            second = entries[j - 1]
+            cost[j] = cost[j - 1] + skipped[j] - skipped[j - 1]
+            i = j - 1
+            while i >= 1 and second.rating - entries[i - 1].rating <= RATING_WINDOW_MAX:
+                first = entries[i - 1]
+                # entries between the pair are left unmatched
+                pair_cost = cost[i - 1] + second.rating - first.rating + skipped[j - 1] - skipped[i]
+                if pair_cost < cost[j] and self.acceptable(first, second, now):
+                    cost[j] = pair_cost
+                    partner[j] = i - 1
+                i -= 1
+        matches = []
+        j = count
+        while j > 0:
+            if partner[j] is not None:
+                older, newer = sorted((entries[partner[j]], entries[j - 1]), key=lambda e: e.seq)
+                matches.append(self.create_match(older, newer))
+                j = partner[j]
+            else:
+                j -= 1
+        return matches
+
 
 class Playground:
     """
@@ -394,18 +841,26 @@ class Playground:
     """
     def __init__(self, matcher: Matcher) -> None:
         self.users = {}
-        self.ready_list = set()
+        self.queues = MatchQueues()
         self.matcher = matcher
+        self.wait_stats = WaitStats()
 
-    def register(self, user_id: str) -> None:
+    def register(self, user_id: str, rating: float = DEFAULT_RATING, account_id: Optional[int] = None) -> None:
         """
-        Create new player with a given user id.
+        Create new player with a given user id, rating and database id.
 
         user_id must be unique. If not, AlreadyRegistered() exception is raised.
+        Player of restored game, which is not connected yet, is reattached instead.
         """
         if self.is_registered(user_id):
-            raise AlreadyRegistered()
-        new_player = Player(user_id)
+            player = self.users[user_id]
+            if player.connected:
+                raise AlreadyRegistered()
+            player.connected = True
+            player.rating = rating
+            player.account_id = account_id
+            return
+        new_player = Player(user_id, rating, account_id)
         self.users[user_id] = new_player
 
     def unregister(self, user_id: str) -> None:
@@ -440,7 +895,7 @@ class Playground:
         if player.is_waiting() or player.is_playing():
             raise NotIdleException()
         player.add_entry(entry)
-        self.ready_list.add(entry)
+        self.queues.add(entry)
 
     def remove_entry(self, user_id: str) -> None:
         """
@@ -451,7 +906,7 @@ class Playground:
         """
         player = self.users[user_id]
         if player.is_waiting():
-            self.ready_list.remove(player.entry)
+            self.queues.remove(player.entry)
             player.remove_entry()
         else:
             raise NotWaitingException()
@@ -464,7 +919,17 @@ class Playground:
         Returns user id of the opponent or None if no match was found.
         If user is not in 'waiting' state, NotWaitingException() is raised.
         """
-        return self.matcher.match(entry, self.ready_list)
+        return self.matcher.match(entry, self.queues)
+
+    def find_matches(self, batch: bool = True) -> List[Match]:
+        """
+        Find matches for all waiting entries at once.
+
+        Batch mode pairs the whole pool, otherwise waiting entries are retried one by one.
+        """
+        if batch:
+            return self.matcher.match_batch(self.queues)
+        return self.matcher.match_waiting(self.queues)
 
     def add_game(self, match: Match) -> Game:
         """
@@ -476,8 +941,10 @@ class Playground:
         player1 = match.first_player
         player2 = match.second_player
         if player1.is_waiting() and player2.is_waiting():
-            self.ready_list.remove(player1.entry)
-            self.ready_list.remove(player2.entry)
+            now = time.monotonic()
+            for entry in (player1.entry, player2.entry):
+                self.queues.remove(entry)
+                self.wait_stats.add(now - entry.created_at)
             new_game = Game()
             new_game.setup(match)
             new_game.start()
@@ -485,6 +952,44 @@ class Playground:
         else:
             raise NotWaitingException()
 
+    def restore_game(self, game_type: str, first_id: str, second_id: str, moves) -> Game:
+        """
+        Recreate running game with its moves, e.g. after restart.
+        """
+        game = self.create_game(game_type, first_id, second_id)
+        for square, vertical, horizontal in moves:
+            game.set_new_move(Move.create_move(game.player_to_move(), square, vertical, horizontal))
+            game.update_result()
+        return game
+
+    def create_game(self, game_type: str, first_id: str, second_id: str) -> Game:
+        """
+        Create running game of given players without matching their entries.
+
+        Missing players are created in not connected state, existing ones must be idle,
+        else NotIdleException() is raised.
+        """
+        players = []
+        for user_id in (first_id, second_id):
+            player = self.users.get(user_id)
+            if player is None:
+                player = Player(user_id)
+                player.connected = False
+                self.users[user_id] = player
+            elif not player.is_idle():
+                raise NotIdleException()
+            players.append(player)
+        game = Game()
+        game.setup(Match(players[0], players[1], game_type))
+        game.start()
+        return game
+
+    def games(self) -> List[Game]:
+        """
+        Return all running games.
+        """
+        return list(dict.fromkeys(p.game for p in self.users.values() if p.is_playing()))
+
     def player(self, user_id: str) -> Player:
         """
         Return player instance by user id.
@@ -495,6 +1000,45 @@ class Playground:
             raise NotRegistered()
         return self.users[user_id]
 
+    def watch(self, user_id: str, target_id: str) -> Game:
+        """
+        Start watching the game played by target user, previously watched game is left.
+
+        If target user is not playing, NotPlayingException() is raised,
+        if it is the user itself or its opponent, OwnGameException() is raised.
+        """
+        if target_id == user_id:
+            raise OwnGameException()
+        player = self.player(user_id)
+        target = self.player(target_id)
+        if not target.is_playing():
+            raise NotPlayingException()
+        if player.game is target.game:
+            raise OwnGameException()
+        self.unwatch(user_id)
+        target.game.add_watcher(player)
+        return target.game
+
+    def unwatch(self, user_id: str) -> Optional[Game]:
+        """
+        Stop watching the game, returns the game or None if user watched nothing.
+        """
+        player = self.player(user_id)
+        game = player.watching
+        if game is not None:
+            game.remove_watcher(player)
+        return game
+
     def get_entry(self, user_id: str) -> Entry:
         player = self.users[user_id]
         return player.entry
+
+    def stats(self) -> Dict:
+        """
+        Matchmaking statistics for monitoring.
+        """
+        return {
+            'players': len(self.users),
+            'waiting': len(self.queues),
+            'time_to_match': self.wait_stats.percentiles()
+        }
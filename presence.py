@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, Dict, Optional
+from models import User
+from settings import PRESENCE_TIMEOUT, PRESENCE_DISCONNECT_GRACE, PRESENCE_TICK, PRESENCE_FLUSH_INTERVAL
+
+
+class PresenceTracker:
+    """
+    Online status of users.
+
+    User is online while it has an open socket, or within timeout after its last
+    authorized request (heartbeat), or within short grace period after its last
+    socket is closed. Deadlines are kept in a timing wheel with slots of one tick,
+    so scheduling and expiry are O(1). Only changes of status are saved,
+    in one statement per flush interval. Changes are also published to listeners
+    once per tick, as one diff for all subscribers.
+    """
+    def __init__(self, timeout: float = PRESENCE_TIMEOUT, grace: float = PRESENCE_DISCONNECT_GRACE,
+                 tick: float = PRESENCE_TICK, flush_interval: float = PRESENCE_FLUSH_INTERVAL) -> None:
+        self.timeout = timeout
+        self.grace = grace
+        self.tick = tick
+        self.flush_interval = flush_interval
+        # login -> number of open sockets
+        self.sockets = {}
+        self.online = set()
+        # login -> slot of its deadline, slot -> logins expiring in it
+        self.deadlines = {}
+        self.wheel = {}
+        self._last_slot = self._slot(time.monotonic())
+        # login -> online flag not saved yet
+        self.changes = {}
+        # login -> online flag not published yet, and callbacks receiving published diffs
+        self.diff = {}
+        self.listeners = []
+        self.session_factory = None
+        self._task = None
+        self._flushing = None
+        # statistics
+        self.transitions = 0
+        self.published = 0
+        self.written = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+
+    def start(self, session_factory) -> None:
+        self.session_factory = session_factory
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        await self.flush()
+
+    def _slot(self, moment: float) -> int:
+        return math.ceil(moment / self.tick)
+
+    def _schedule(self, login: str, delay: float) -> None:
+        self._unschedule(login)
+        # slots already passed by expiry are never visited again
+        slot = max(self._slot(time.monotonic() + delay), self._last_slot + 1)
+        self.deadlines[login] = slot
+        self.wheel.setdefault(slot, set()).add(login)
+
+    def _unschedule(self, login: str) -> None:
+        slot = self.deadlines.pop(login, None)
+        if slot is not None:
+            logins = self.wheel[slot]
+            logins.discard(login)
+            if not logins:
+                del self.wheel[slot]
+
+    def _set_online(self, login: str, online: bool) -> None:
+        if (login in self.online) == online:
+            return
+        if online:
+            self.online.add(login)
+        else:
+            self.online.discard(login)
+        self.changes[login] = online
+        self.diff[login] = online
+        self.transitions += 1
+
+    def subscribe(self, listener: Callable[[Dict[str, bool]], None]) -> None:
+        self.listeners.append(listener)
+
+    def publish(self) -> None:
+        """
+        Pass changes since the last call to listeners.
+        """
+        if not self.diff:
+            return
+        diff = self.diff
+        self.diff = {}
+        for listener in self.listeners:
+            listener(diff)
+        self.published += 1
+
+    def heartbeat(self, login: Optional[str]) -> None:
+        if login is None:
+            return
+        if login not in self.sockets:
+            self._schedule(login, self.timeout)
+        self._set_online(login, True)
+
+    def connect(self, login: Optional[str]) -> None:
+        if login is None:
+            return
+        self.sockets[login] = self.sockets.get(login, 0) + 1
+        self._unschedule(login)
+        self._set_online(login, True)
+
+    def disconnect(self, login: Optional[str]) -> None:
+        if login is None or login not in self.sockets:
+            return
+        self.sockets[login] -= 1
+        if not self.sockets[login]:
+            del self.sockets[login]
+            self._schedule(login, self.grace)
+
+    def is_online(self, login: str) -> bool:
+        return login in self.online
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """
+        Mark offline users whose deadlines have passed.
+        """
+        current = self._slot(time.monotonic() if now is None else now)
+        for slot in range(self._last_slot + 1, current + 1):
+            for login in self.wheel.pop(slot, ()):
+                del self.deadlines[login]
+                self._set_online(login, False)
+        self._last_slot = max(self._last_slot, current)
+
+    async def _run(self) -> None:
+        # nobody is online before the first connection, whatever was saved by previous run
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    await User.reset_online(session)
+        except Exception as e:
+            logging.info('failed to reset online users: {}'.format(e))
+        flushed = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick)
+            self.expire()
+            self.publish()
+            if time.monotonic() - flushed >= self.flush_interval:
+                flushed = time.monotonic()
+                await self._flush_shielded()
+
+    async def _flush_shielded(self) -> bool:
+        # cancelling the background task doesn't interrupt a write, close() waits for it instead
+        self._flushing = asyncio.ensure_future(self.flush())
+        return await asyncio.shield(self._flushing)
+
+    async def flush(self) -> bool:
+        """
+        Save pending changes of status, returns False on failure.
+        """
+        if not self.changes or self.session_factory is None:
+            return True
+        batch = self.changes
+        self.changes = {}
+        started = time.monotonic()
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    await User.save_presence(session, batch)
+        except Exception as e:
+            logging.info('failed to save presence of {} users: {}'.format(len(batch), e))
+            batch.update(self.changes)
+            self.changes = batch
+            self.failed_flushes += 1
+            return False
+        self.last_flush_latency = time.monotonic() - started
+        self.written += len(batch)
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            'online': len(self.online),
+            'connected': len(self.sockets),
+            'scheduled': len(self.deadlines),
+            'pending': len(self.changes),
+            'transitions': self.transitions,
+            'published': self.published,
+            'written': self.written,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_latency': self.last_flush_latency
+        }
+
+
+class PresenceMirror:
+    """
+    Online status of users owned by matchmaking broker.
+
+    Used by worker processes in multi-process mode instead of PresenceTracker.
+    Sockets and heartbeats are passed to the broker, which tracks presence of
+    all workers and saves it. Diffs received from the broker are applied to the
+    local copy of online users and published to listeners.
+    """
+    def __init__(self, tick: float = PRESENCE_TICK) -> None:
+        self.tick = tick
+        self.online = set()
+        self.listeners = []
+        # callable passing (kind, login) to broker, kind is 'connect', 'disconnect' or 'heartbeat'
+        self.forward = None
+        # login -> time of its last forwarded heartbeat, at most one per tick is passed
+        self.beats = {}
+        # statistics
+        self.forwarded = 0
+        self.published = 0
+
+    def start(self, session_factory) -> None:
+        # status is saved by the broker
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def attach(self, forward: Callable[[str, str], None]) -> None:
+        self.forward = forward
+
+    def _forward(self, kind: str, login: Optional[str]) -> None:
+        if login is None or self.forward is None:
+            return
+        self.forward(kind, login)
+        self.forwarded += 1
+
+    def subscribe(self, listener: Callable[[Dict[str, bool]], None]) -> None:
+        self.listeners.append(listener)
+
+    def heartbeat(self, login: Optional[str]) -> None:
+        now = time.monotonic()
+        if login is not None and now - self.beats.get(login, -self.tick) >= self.tick:
+            self.beats[login] = now
+            self._forward('heartbeat', login)
+
+    def connect(self, login: Optional[str]) -> None:
+        self._forward('connect', login)
+
+    def disconnect(self, login: Optional[str]) -> None:
+        self._forward('disconnect', login)
+
+    def is_online(self, login: str) -> bool:
+        return login in self.online
+
+    def apply(self, changes: Dict[str, bool], snapshot: bool = False) -> None:
+        """
+        Apply changes received from broker, snapshot replaces all online users.
+        """
+        if snapshot:
+            online = {login for login, value in changes.items() if value}
+            changes = {login: login in online for login in self.online ^ online}
+            self.online = online
+        else:
+            for login, value in changes.items():
+                if value:
+                    self.online.add(login)
+                else:
+                    self.online.discard(login)
+                    self.beats.pop(login, None)
+        if not changes:
+            return
+        for listener in self.listeners:
+            listener(changes)
+        self.published += 1
+
+    def stats(self) -> Dict:
+        return {
+            'online': len(self.online),
+            'forwarded': self.forwarded,
+            'published': self.published
+        }
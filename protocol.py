@@ -1,15 +1,70 @@
-from db import add_game_to_db
+from db import add_game_to_db, presence
+import asyncio
 import logging
+from binary_protocol import decode, BinaryProtocolException, GAME_TYPES
 from global_defs import global_playground, registry
-from players import NotRegistered, NotIdleException, WrongPlayerException
+from players import NotRegistered, NotIdleException, NotPlayingException, WrongPlayerException, WrongMoveException, \
+    GameNotRunningException, Game, PlaygroundException, OwnGameException
+from connection import RemoteConnection
+from cluster import cluster
+from broker import BrokerProtocolException
 from commands import *
 from typing import Dict, List, Optional
-from logic import add_new_entry, try_create_new_game, resign_game, clear_game, new_move
+from logic import add_new_entry, try_create_new_game, resign_game, clear_game, new_move, watch_game, unwatch_game, \
+    create_games_batch, start_matched_game
+from settings import MATCHMAKING_MODE
+from game_actor import GameActor, GameActorClosed
+
+# commands changing or reading state of the current game of user, they are run by actor of the game
+GAME_COMMANDS = (MoveCommand, ResignCommand, OfferCommand, AcceptCommand, SyncCommand)
+
+
+class GameChanged(Exception):
+    def __init__(self):
+        super().__init__()
+
+
+def current_game(user_id) -> Optional[Game]:
+    try:
+        player = global_playground.player(user_id)
+    except NotRegistered:
+        return None
+    return player.game if player.is_playing() else None
+
+
+async def _run_in_game(user_id, game: Game, job, args):
+    # game of user may have finished or changed while the job was waiting in mailbox
+    if current_game(user_id) is not game:
+        raise GameChanged()
+    return await job(*args)
+
+
+async def in_game_of(user_id, job, *args):
+    """
+    Run job by actor of the current game of user, or directly if user doesn't play.
+    """
+    while True:
+        game = current_game(user_id)
+        if game is None:
+            return await job(*args)
+        if game.actor is None:
+            game.actor = GameActor()
+        try:
+            return await game.actor.call(_run_in_game, user_id, game, job, args)
+        except (GameChanged, GameActorClosed):
+            continue
 
 
 async def handle_error(user_id):
-    # player with user_id disconnected or error happened
+    # player with user_id disconnected or error happened, forfeit of game is serialized with its commands
+    if cluster.enabled:
+        cluster.leave(user_id)
+    await in_game_of(user_id, _handle_error, user_id)
+
+
+async def _handle_error(user_id):
     try:
+        await unwatch_game(user_id)
         global_playground.unregister(user_id)
     except NotRegistered:
         pass
@@ -24,21 +79,145 @@ async def handle_error(user_id):
             opp_id = player.opp.player_id
             game = player.game
             result = "first_win" if player.side == "second" else "second_win"
-            await send_command(GameOverCommand(opp_id, result=result, win_pos=None, cause="interruption"))
+            await send_command(BroadcastCommand([opp_id],
+                                                GameOverCommand(None, result=result, win_pos=None, cause="interruption"),
+                                                watcher_ids=game.watcher_ids()))
 
             game.set_result(result)
-            await add_game_to_db(game)
-            game.clear()
-            global_playground.unregister(user_id)
+            await add_game_to_db(game, 'interruption')
+            await clear_game(game)
+            # remote player is already unregistered with its game
+            if global_playground.is_registered(user_id):
+                global_playground.unregister(user_id)
     finally:
         registry.remove_socket(user_id)
 
 
+async def handle_binary_command(payload: bytes, user_id):
+    """
+    Decode command of binary protocol and handle it the same way as json one.
+    """
+    try:
+        cmd_data = decode(payload)
+    except BinaryProtocolException as exp:
+        logging.info(exp.args)
+    else:
+        await handle_command(cmd_data, user_id)
+
+
 async def handle_command(cmd_data: Dict, user_id):
     """
     """
     try:
-        result_commands = await execute_logic(CommandFactory.from_data(user_id, cmd_data))
+        cmd = CommandFactory.from_data(user_id, cmd_data)
+    except CommandException as exp:
+        logging.info(exp.args)
+    else:
+        if cluster.enabled and await route_in_cluster(cmd, cmd_data):
+            return
+        if isinstance(cmd, GAME_COMMANDS):
+            await in_game_of(user_id, execute_and_send, cmd)
+        else:
+            await execute_and_send(cmd)
+
+
+async def route_in_cluster(cmd: Command, cmd_data: Dict) -> bool:
+    """
+    Pass command to other worker if needed in multi-process mode, returns True if passed.
+
+    Game commands of user playing on other worker go to that worker, options are applied
+    on both workers. 'ready' command goes to matchmaking broker.
+    """
+    user_id = cmd.user_id
+    if user_id in cluster.remote_games and isinstance(cmd, GAME_COMMANDS + (OptionsCommand,)):
+        cluster.forward_command(user_id, cmd_data)
+        return not isinstance(cmd, OptionsCommand)
+    if isinstance(cmd, ReadyCommand):
+        for command in execute_cluster_ready(cmd):
+            await send_command(command)
+        return True
+    return False
+
+
+def execute_cluster_ready(cmd: ReadyCommand) -> List[Command]:
+    logging.info(f"Handling 'ready' command in cluster: {str(cmd)}")
+    user_id = cmd.user_id
+    player = global_playground.player(user_id)
+    if user_id in cluster.remote_games or user_id in cluster.waiting or not player.is_idle():
+        return [ErrorCommand(user_id, msg="New entry rejected, already waiting game or playing")]
+    if cmd.data()['parameters'].get('type') not in GAME_TYPES:
+        return [ErrorCommand(user_id, msg="New entry rejected, unknown game type")]
+    connection = registry.find_connection(user_id)
+    fmt = connection.fmt if connection is not None else 'json'
+    delta = connection.delta if connection is not None else False
+    try:
+        cluster.request_match(user_id, fmt, delta, cmd.data()['parameters'])
+    except BrokerProtocolException:
+        # e.g. opponent id too long for broker frame, entry is not queued
+        return [ErrorCommand(user_id, msg="New entry rejected, wrong parameters")]
+    return [WaitingCommand(user_id)]
+
+
+async def start_cluster_game(header: Dict) -> None:
+    """
+    Start game matched by broker on this worker, players of other workers are served remotely.
+    """
+    profiles = [header['first'], header['second']]
+    local = [p['user_id'] for p in profiles if p['worker'] == cluster.index]
+    remote = [p for p in profiles if p['worker'] != cluster.index]
+    for user_id in local:
+        cluster.waiting.discard(user_id)
+    if not all(global_playground.is_registered(user_id) and global_playground.player(user_id).is_idle()
+               for user_id in local) or any(global_playground.is_registered(p['user_id']) for p in remote):
+        # one of players has left or started other game meanwhile
+        for user_id in local:
+            if global_playground.is_registered(user_id):
+                await send_command(ErrorCommand(user_id, msg='Match cancelled, opponent left'))
+        for profile in remote:
+            frame = encode_frame(ErrorCommand(profile['user_id'], msg='Match cancelled, opponent left').data(),
+                                 profile['fmt'])
+            cluster.forward_frame(profile['worker'], profile['user_id'], frame)
+            cluster.channel.send(profile['worker'], 'released', {'user_id': profile['user_id']})
+        return
+    for profile in remote:
+        user_id = profile['user_id']
+        global_playground.register(user_id, profile['rating'], profile['account_id'])
+        cluster.remote_players[user_id] = profile['worker']
+        connection = RemoteConnection(user_id, profile['worker'], cluster.forward_frame, profile['fmt'])
+        connection.delta = profile['delta']
+        registry.add_remote(user_id, connection)
+    game = await start_matched_game(header['game_type'], profiles[0]['user_id'], profiles[1]['user_id'])
+    for profile in remote:
+        cluster.channel.send(profile['worker'], 'joined', {'user_id': profile['user_id'], 'owner': cluster.index})
+    for command in started_commands(game):
+        await send_command(command)
+
+
+async def handle_match_cancelled(user_id) -> None:
+    # game of matched entry could not be started on its worker
+    cluster.waiting.discard(user_id)
+    if global_playground.is_registered(user_id):
+        await send_command(ErrorCommand(user_id, msg='Match cancelled, opponent left'))
+
+
+async def handle_cluster_command(header: Dict, body: bytes) -> None:
+    await handle_command(header['data'], header['user_id'])
+
+
+async def handle_cluster_disconnect(header: Dict, body: bytes) -> None:
+    await handle_error(header['user_id'])
+
+
+def setup_cluster() -> None:
+    cluster.broker.on_match = start_cluster_game
+    cluster.broker.on_cancelled = handle_match_cancelled
+    cluster.channel.on('command', handle_cluster_command)
+    cluster.channel.on('disconnect', handle_cluster_disconnect)
+
+
+async def execute_and_send(cmd: Command) -> None:
+    try:
+        result_commands = await execute_logic(cmd)
     except CommandException as exp:
         logging.info(exp.args)
     else:
@@ -55,7 +234,13 @@ async def execute_logic(cmd: Command) -> List[Optional[Command]]:
         ResignCommand: execute_resign_handler,
         MoveCommand: execute_move_handler,
         OfferCommand: execute_offer_handler,
-        AcceptCommand: execute_accept_handler
+        AcceptCommand: execute_accept_handler,
+        OptionsCommand: execute_options_handler,
+        SyncCommand: execute_sync_handler,
+        WatchCommand: execute_watch_handler,
+        UnwatchCommand: execute_unwatch_handler,
+        SubscribePresenceCommand: execute_subscribe_presence_handler,
+        UnsubscribePresenceCommand: execute_unsubscribe_presence_handler
     }
     command_type = type(cmd)
     if command_type in command_handlers:
@@ -75,30 +260,58 @@ async def execute_ready_handler(cmd: ReadyCommand) -> List[Optional[Command]]:
         res_commands.append(ErrorCommand(user_id, msg="New entry rejected, already waiting game or playing"))
     else:
         res_commands.append(WaitingCommand(user_id))
-        game = await try_create_new_game(user_id)
-        if game is not None:
-            # send "started" responses to both players
-            first_id = game.first().player_id
-            second_id = game.second().player_id
-            res_commands.append(StartedCommand(first_id, opp_id=second_id, ptype="first"))
-            res_commands.append(StartedCommand(second_id, opp_id=first_id, ptype="second"))
-
-            # send "update_state" responses to both players
-            res_commands.append(UpdateStateCommand.from_game(first_id, game))
-            res_commands.append(UpdateStateCommand.from_game(second_id, game))
+        if MATCHMAKING_MODE == 'inline':
+            game = await try_create_new_game(user_id)
+            if game is not None:
+                res_commands.extend(started_commands(game))
     return res_commands
 
 
+def started_commands(game: Game) -> List[Command]:
+    res_commands = []
+    # send "started" responses to both players
+    first_id = game.first().player_id
+    second_id = game.second().player_id
+    res_commands.append(StartedCommand(first_id, opp_id=second_id, ptype="first"))
+    res_commands.append(StartedCommand(second_id, opp_id=first_id, ptype="second"))
+
+    # send "update_state" responses to both players
+    res_commands.append(BroadcastCommand.to_game(game, UpdateStateCommand.from_game(None, game)))
+    return res_commands
+
+
+async def execute_batch_matching(batch: bool = True) -> List[Command]:
+    """
+    Create games for all matched entries and return commands starting them.
+    """
+    res_commands = []
+    for game in await create_games_batch(batch):
+        res_commands.extend(started_commands(game))
+    return res_commands
+
+
+async def run_batch_matching(interval: float, batch: bool = True) -> None:
+    """
+    Periodically match the whole waiting pool.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            commands = await execute_batch_matching(batch)
+        except PlaygroundException as exp:
+            logging.info('batch matching failed: {}'.format(exp))
+        else:
+            for command in commands:
+                await send_command(command)
+
+
 async def execute_resign_handler(cmd: ResignCommand) -> List[Optional[Command]]:
     logging.info(f"Handling 'resign' command: {str(cmd)}")
     res_commands = []
     user_id = cmd.user_id
     game = await resign_game(user_id)
     if game is not None:
-        first_id = game.first().player_id
-        second_id = game.second().player_id
-        res_commands.append(GameOverCommand.from_game(first_id, game, "resignation"))
-        res_commands.append(GameOverCommand.from_game(second_id, game, "resignation"))
+        res_commands.append(BroadcastCommand.to_game(game, GameOverCommand.from_game(None, game, "resignation")))
         await clear_game(game)
     else:
         res_commands.append(ErrorCommand(user_id, msg='Resign rejected, no current game'))
@@ -112,18 +325,17 @@ async def execute_move_handler(cmd: MoveCommand) -> List[Optional[Command]]:
     try:
         game = await new_move(user_id, cmd.data())
         if game is not None:
-            first_id = game.first().player_id
-            second_id = game.second().player_id
-            res_commands.append(UpdateStateCommand.from_game(first_id, game))
-            res_commands.append(UpdateStateCommand.from_game(second_id, game))
+            res_commands.append(BroadcastCommand.to_game(game, UpdateStateCommand.from_game(None, game),
+                                                         delta=MoveAppliedCommand.from_game(None, game)))
             if game.is_finished():
-                res_commands.append(GameOverCommand.from_game(first_id, game, "win_rule"))
-                res_commands.append(GameOverCommand.from_game(second_id, game, "win_rule"))
+                res_commands.append(BroadcastCommand.to_game(game, GameOverCommand.from_game(None, game, "win_rule")))
                 await clear_game(game)
         else:
             res_commands.append(ErrorCommand(user_id, msg='New move rejected, no current game'))
     except WrongPlayerException:
         res_commands.append(ErrorCommand(user_id, msg='Move rejected, not your move'))
+    except (WrongMoveException, GameNotRunningException):
+        res_commands.append(ErrorCommand(user_id, msg='Move rejected, invalid move'))
     return res_commands
 
 
@@ -150,13 +362,12 @@ async def execute_accept_handler(cmd: AcceptCommand) -> List[Optional[Command]]:
         if game.can_accept is player:
             # fix the draw
             game.set_result('draw')
-            opp_id = player.opp.player_id
-            res_commands.append(GameOverCommand(cmd.user_id, result='draw', win_pos=None, cause='agreement'))
-            res_commands.append(GameOverCommand(opp_id, result='draw', win_pos=None, cause='agreement'))
+            res_commands.append(BroadcastCommand.to_game(game, GameOverCommand(None, result='draw', win_pos=None,
+                                                                               cause='agreement')))
 
             # save game to db
-            await add_game_to_db(game)
-            game.clear()
+            await add_game_to_db(game, 'agreement')
+            await clear_game(game)
         else:
             res_commands.append(ErrorCommand(cmd.user_id, msg='Cannot accept, no offer'))
     else:
@@ -164,8 +375,142 @@ async def execute_accept_handler(cmd: AcceptCommand) -> List[Optional[Command]]:
     return res_commands
 
 
+async def execute_options_handler(cmd: OptionsCommand) -> List[Optional[Command]]:
+    logging.info(f"Handling 'options' command: {str(cmd)}")
+    connection = registry.find_connection(cmd.user_id)
+    if connection is not None:
+        connection.delta = bool(cmd.delta)
+    return []
+
+
+async def execute_sync_handler(cmd: SyncCommand) -> List[Optional[Command]]:
+    logging.info(f"Handling 'sync' command: {str(cmd)}")
+    res_commands = []
+    player = global_playground.player(cmd.user_id)
+    if player.is_playing():
+        res_commands.append(UpdateStateCommand.from_game(cmd.user_id, player.game))
+    elif player.watching is not None:
+        # spectator recovering from a gap in delta updates
+        res_commands.append(UpdateStateCommand.from_game(cmd.user_id, player.watching))
+    else:
+        res_commands.append(ErrorCommand(cmd.user_id, msg='Sync rejected, no current game'))
+    return res_commands
+
+
+async def execute_watch_handler(cmd: WatchCommand) -> List[Optional[Command]]:
+    logging.info(f"Handling 'watch' command: {str(cmd)}")
+    res_commands = []
+    try:
+        game = await watch_game(cmd.user_id, cmd.player)
+    except (NotRegistered, NotPlayingException):
+        res_commands.append(ErrorCommand(cmd.user_id, msg='Watch rejected, no such game'))
+    except OwnGameException:
+        res_commands.append(ErrorCommand(cmd.user_id, msg='Watch rejected, own game'))
+    else:
+        res_commands.append(WatchingCommand(cmd.user_id, first=game.first().player_id,
+                                            second=game.second().player_id))
+        res_commands.append(UpdateStateCommand.from_game(cmd.user_id, game))
+    return res_commands
+
+
+async def execute_unwatch_handler(cmd: UnwatchCommand) -> List[Optional[Command]]:
+    logging.info(f"Handling 'unwatch' command: {str(cmd)}")
+    res_commands = []
+    game = await unwatch_game(cmd.user_id)
+    if game is None:
+        res_commands.append(ErrorCommand(cmd.user_id, msg='Unwatch rejected, no watched game'))
+    return res_commands
+
+
+async def execute_subscribe_presence_handler(cmd: SubscribePresenceCommand) -> List[Optional[Command]]:
+    logging.info(f"Handling 'subscribe_presence' command: {str(cmd)}")
+    if registry.find_connection(cmd.user_id) is None:
+        return []
+    registry.presence_subscribers.add(cmd.user_id)
+    return [PresenceCommand(cmd.user_id, users=sorted(presence.online))]
+
+
+async def execute_unsubscribe_presence_handler(cmd: UnsubscribePresenceCommand) -> List[Optional[Command]]:
+    logging.info(f"Handling 'unsubscribe_presence' command: {str(cmd)}")
+    registry.presence_subscribers.discard(cmd.user_id)
+    return []
+
+
+def publish_presence(changes: Dict[str, bool]) -> None:
+    """
+    Send diff of online status, encoded once per format, to all subscribers.
+    """
+    if registry.presence_subscribers:
+        cmd = BroadcastCommand(registry.presence_subscribers, PresenceDiffCommand.from_changes(None, changes))
+        fan_out(cmd, cmd.user_ids)
+
+
+def resume_commands(user_id) -> List[Command]:
+    """
+    Commands restoring game of reconnected player of recovered game.
+    """
+    player = global_playground.player(user_id)
+    if not player.is_playing():
+        return []
+    return [StartedCommand(user_id, opp_id=player.opp.player_id, ptype=player.side),
+            UpdateStateCommand.from_game(user_id, player.game)]
+
+
+async def expire_detached_players(timeout: float) -> None:
+    """
+    Finish recovered games of players which haven't reconnected in time, as interrupted.
+    """
+    await asyncio.sleep(timeout)
+    for user_id, player in list(global_playground.users.items()):
+        if not player.connected and global_playground.is_registered(user_id):
+            await handle_error(user_id)
+
+
+def fan_out(cmd: BroadcastCommand, user_ids: List) -> None:
+    """
+    Queue the same encoded frame of broadcast command for every connected user.
+    """
+    for user_id in user_ids:
+        connection = registry.find_connection(user_id)
+        if connection is not None:
+            connection.send(cmd.encoded(connection.fmt, connection.delta))
+
+
+def resync_frames(user_id, fmt: str) -> Optional[List]:
+    """
+    Build frames restoring current state of the user after outbound queue overflow.
+
+    Returns None if there is no state to restore.
+    """
+    frames = []
+    try:
+        player = global_playground.player(user_id)
+    except NotRegistered:
+        player = None
+    if player is not None and player.is_playing():
+        frames.append(encode_frame(UpdateStateCommand.from_game(user_id, player.game).data(), fmt))
+    elif player is not None and player.watching is not None:
+        frames.append(encode_frame(UpdateStateCommand.from_game(user_id, player.watching).data(), fmt))
+    if user_id in registry.presence_subscribers:
+        # missed presence diffs are replaced with a new snapshot
+        frames.append(encode_frame(PresenceCommand(user_id, users=sorted(presence.online)).data(), fmt))
+    return frames or None
+
+
 async def send_command(cmd: Command) -> None:
     """
+    Queue command for sending to its recipients.
+
+    Frames are encoded in the format negotiated by each connection.
+    Broadcast commands are encoded once per format and the same frame is queued for every socket.
+    Commands to not connected users are dropped.
     """
-    ws = registry.get_socket(cmd.user_id)
-    await ws.send_json(cmd.data())
+    if isinstance(cmd, BroadcastCommand):
+        fan_out(cmd, cmd.user_ids)
+        if cmd.watcher_ids:
+            # spectators may be numerous, so they are served after the current command is handled
+            asyncio.get_event_loop().call_soon(fan_out, cmd, cmd.watcher_ids)
+    else:
+        connection = registry.find_connection(cmd.user_id)
+        if connection is not None:
+            connection.send(encode_frame(cmd.data(), connection.fmt))
@@ -0,0 +1,31 @@
+from typing import Tuple
+# Elo rating system
+
+DEFAULT_RATING = 1500.0
+K_FACTOR = 32.0
+
+# score of the first player by game result
+_scores = {
+    'first_win': 1.0,
+    'second_win': 0.0,
+    'draw': 0.5,
+}
+
+
+def expected_score(rating: float, opp_rating: float) -> float:
+    """
+    Expected score of a player against an opponent.
+    """
+    return 1.0 / (1.0 + 10.0 ** ((opp_rating - rating) / 400.0))
+
+
+def rate_game(first_rating: float, second_rating: float, result: str) -> Tuple[float, float]:
+    """
+    Calculate new ratings of both players after the game.
+
+    Ratings are not changed for unfinished game (result 'none').
+    """
+    if result not in _scores:
+        return first_rating, second_rating
+    delta = K_FACTOR * (_scores[result] - expected_score(first_rating, second_rating))
+    return first_rating + delta, second_rating - delta
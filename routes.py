@@ -1,4 +1,5 @@
-from views import index, wait_game, add_new_user, login_user, logout_user, get_active_users
+from views import index, wait_game, add_new_user, login_user, logout_user, get_active_users, get_stats, \
+    get_user_games, get_user_stats, get_leaderboard, get_user_rank
 from web_socket import websocket_handler
 from settings import BASE_DIR
 
@@ -11,6 +12,11 @@ def setup_routes(app):
     app.router.add_post('/login', login_user)
     app.router.add_post('/logout', logout_user)
     app.router.add_get('/users', get_active_users)
+    app.router.add_get('/users/{login}/games', get_user_games)
+    app.router.add_get('/users/{login}/stats', get_user_stats)
+    app.router.add_get('/leaderboard', get_leaderboard)
+    app.router.add_get('/leaderboard/{login}', get_user_rank)
+    app.router.add_get('/stats', get_stats)
 
 
 def setup_static_routes(app):
@@ -1,3 +1,85 @@
+import os
 import pathlib
 
 BASE_DIR = pathlib.Path(__file__).parent
+
+# game engine backend: 'xo_app' (compiled extension) or 'bitboard' (pure python)
+ENGINE_BACKEND = os.environ.get('XO_ENGINE_BACKEND', 'xo_app')
+# win detection of 'bitboard' backend: 'masks' (check all lines) or 'counters' (per line counters)
+ENGINE_WIN_DETECTION = os.environ.get('XO_ENGINE_WIN_DETECTION', 'counters')
+# outbound queue size of each socket and policy on its overflow: 'resync' or 'disconnect'
+SEND_QUEUE_SIZE = int(os.environ.get('XO_SEND_QUEUE_SIZE', 256))
+SEND_OVERFLOW_POLICY = os.environ.get('XO_SEND_OVERFLOW_POLICY', 'resync')
+# matchmaking: 'fifo' (first compatible entry, default) or 'rating' (closest rating within widening window, opt-in)
+MATCHER_TYPE = os.environ.get('XO_MATCHER_TYPE', 'fifo')
+# allowed rating gap is base + rate * seconds of waiting, but not more than max
+RATING_WINDOW_BASE = float(os.environ.get('XO_RATING_WINDOW_BASE', 50))
+RATING_WINDOW_RATE = float(os.environ.get('XO_RATING_WINDOW_RATE', 10))
+RATING_WINDOW_MAX = float(os.environ.get('XO_RATING_WINDOW_MAX', 400))
+# 'inline' matches on every 'ready' command, 'batch' matches the whole waiting pool periodically
+# with 'rating' matcher inline mode also retries waiting entries on every tick
+MATCHMAKING_MODE = os.environ.get('XO_MATCHMAKING_MODE', 'inline')
+MATCHMAKING_TICK_MS = int(os.environ.get('XO_MATCHMAKING_TICK_MS', 500))
+# batch cost of leaving entry unmatched per second of its waiting
+MATCHMAKING_WAIT_COST = float(os.environ.get('XO_MATCHMAKING_WAIT_COST', 10))
+# finished games are inserted in batches of this size or after this interval in seconds
+ARCHIVE_BATCH_SIZE = int(os.environ.get('XO_ARCHIVE_BATCH_SIZE', 200))
+ARCHIVE_FLUSH_INTERVAL = float(os.environ.get('XO_ARCHIVE_FLUSH_INTERVAL', 2.0))
+# records kept in memory while database is unavailable, the oldest are dropped above this limit
+ARCHIVE_MAX_PENDING = int(os.environ.get('XO_ARCHIVE_MAX_PENDING', 100000))
+# journal of running games for crash recovery, disabled if path is empty
+JOURNAL_PATH = os.environ.get('XO_JOURNAL_PATH', '')
+# journal is written and fsynced in groups at this interval
+JOURNAL_SYNC_MS = int(os.environ.get('XO_JOURNAL_SYNC_MS', 50))
+# snapshot of running games is taken and journal truncated after this number of records
+JOURNAL_COMPACT_RECORDS = int(os.environ.get('XO_JOURNAL_COMPACT_RECORDS', 10000))
+# recovered games are finished if players don't reconnect within this time in seconds
+JOURNAL_RESUME_TIMEOUT = float(os.environ.get('XO_JOURNAL_RESUME_TIMEOUT', 60))
+# last seen time of active users is saved at this interval in seconds
+LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get('XO_LAST_SEEN_FLUSH_INTERVAL', 5.0))
+# user is online while connected, within timeout after its last request or within grace after disconnect
+PRESENCE_TIMEOUT = float(os.environ.get('XO_PRESENCE_TIMEOUT', 60))
+PRESENCE_DISCONNECT_GRACE = float(os.environ.get('XO_PRESENCE_DISCONNECT_GRACE', 2.0))
+# presence deadlines are checked every tick and changes of online status are saved at this interval in seconds
+PRESENCE_TICK = float(os.environ.get('XO_PRESENCE_TICK', 0.25))
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('XO_PRESENCE_FLUSH_INTERVAL', 0.5))
+# authorized identities are cached for this time in seconds, at most this number of them
+IDENTITY_CACHE_TTL = float(os.environ.get('XO_IDENTITY_CACHE_TTL', 60))
+IDENTITY_CACHE_SIZE = int(os.environ.get('XO_IDENTITY_CACHE_SIZE', 10000))
+# database connection pool: size, extra connections above it, seconds to wait for connection and to recycle it
+DB_POOL_SIZE = int(os.environ.get('XO_DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('XO_DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('XO_DB_POOL_TIMEOUT', 5.0))
+DB_POOL_RECYCLE = int(os.environ.get('XO_DB_POOL_RECYCLE', 1800))
+# timeouts of opening database connection and of single statement in seconds
+DB_CONNECT_TIMEOUT = float(os.environ.get('XO_DB_CONNECT_TIMEOUT', 5.0))
+DB_COMMAND_TIMEOUT = float(os.environ.get('XO_DB_COMMAND_TIMEOUT', 10.0))
+# passwords are hashed with this number of sha256_crypt rounds
+PASSWORD_ROUNDS = int(os.environ.get('XO_PASSWORD_ROUNDS', 535000))
+# hashing runs in 'process' or 'thread' pool of this size, requests waiting above the limit are rejected
+PASSWORD_EXECUTOR = os.environ.get('XO_PASSWORD_EXECUTOR', 'process')
+PASSWORD_WORKERS = int(os.environ.get('XO_PASSWORD_WORKERS', 2))
+PASSWORD_MAX_WAITING = int(os.environ.get('XO_PASSWORD_MAX_WAITING', 100))
+# default and maximum size of page of users list
+USERS_PAGE_LIMIT = int(os.environ.get('XO_USERS_PAGE_LIMIT', 50))
+USERS_PAGE_MAX_LIMIT = int(os.environ.get('XO_USERS_PAGE_MAX_LIMIT', 200))
+# pages of users list are rebuilt at most once per this interval in seconds, at most this number is kept
+USERS_SNAPSHOT_INTERVAL = float(os.environ.get('XO_USERS_SNAPSHOT_INTERVAL', 5.0))
+USERS_SNAPSHOT_MAX_PAGES = int(os.environ.get('XO_USERS_SNAPSHOT_MAX_PAGES', 1000))
+# default and maximum size of page of games history
+GAMES_PAGE_LIMIT = int(os.environ.get('XO_GAMES_PAGE_LIMIT', 20))
+GAMES_PAGE_MAX_LIMIT = int(os.environ.get('XO_GAMES_PAGE_MAX_LIMIT', 100))
+# default and maximum size of page of leaderboard
+LEADERBOARD_LIMIT = int(os.environ.get('XO_LEADERBOARD_LIMIT', 20))
+LEADERBOARD_MAX_LIMIT = int(os.environ.get('XO_LEADERBOARD_MAX_LIMIT', 100))
+# number of worker processes sharing the port, started by supervisor if more than one
+WORKERS = int(os.environ.get('XO_WORKERS', 1))
+# index of worker process, set by supervisor, -1 in supervisor itself
+WORKER_INDEX = int(os.environ.get('XO_WORKER_INDEX', -1))
+# directory of unix sockets connecting worker processes
+IPC_DIR = os.environ.get('XO_IPC_DIR', '/tmp/xo_server')
+# unix socket of matchmaking broker and interval of sending matches to workers
+BROKER_SOCKET = os.environ.get('XO_BROKER_SOCKET', os.path.join(IPC_DIR, 'broker.sock'))
+BROKER_FLUSH_MS = int(os.environ.get('XO_BROKER_FLUSH_MS', 10))
+# seconds to wait for broker claiming user for worker, connection is refused if it doesn't answer
+BROKER_CLAIM_TIMEOUT = float(os.environ.get('XO_BROKER_CLAIM_TIMEOUT', 5))
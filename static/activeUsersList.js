@@ -1,10 +1,22 @@
-async function fetch_users() {
-    // get from server
-    let response = await fetch('/users', {
-        method: 'GET',
-    });
-    let result = await response.json();
-    console.log(result);
+// online users, filled by 'presence' snapshot and updated by 'presence_diff' pushed over the socket
+let onlineUsers = new Set();
+
+function handle_presence(cm_data) {
+    onlineUsers = new Set(cm_data.users);
+    render_users();
+}
+
+function handle_presence_diff(cm_data) {
+    for (var i = 0; i < cm_data.joined.length; i++) {
+        onlineUsers.add(cm_data.joined[i]);
+    }
+    for (var i = 0; i < cm_data.left.length; i++) {
+        onlineUsers.delete(cm_data.left[i]);
+    }
+    render_users();
+}
+
+function render_users() {
     // update DOM
     list = document.getElementById("active-users-list");
     var listElement = document.getElementById("list-element");
@@ -16,12 +28,10 @@ async function fetch_users() {
         listElement.id = "list-element";
         list.appendChild(listElement);
     }
-    for (var i = 0; i < result.length; i++) {
+    let logins = Array.from(onlineUsers).sort();
+    for (var i = 0; i < logins.length; i++) {
         listItem = document.createElement('li');
-        listItem.innerHTML = result[i].login + "   |   " + result[i].online + "   |   " + result[i].last_seen_at;
+        listItem.textContent = logins[i];
         listElement.appendChild(listItem);
     }
 }
-
-let timerId = setInterval(fetch_users, 10000);
-fetch_users();
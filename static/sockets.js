@@ -91,6 +91,12 @@ function handle_game_over(cm_data)
 socket.onopen = function(e)
 {
     document.getElementById("debug").value += "[open] Connection established" ;
+    // online users are pushed by server instead of polling
+    socket.send(JSON.stringify({
+    version: "v1",
+    command: "subscribe_presence",
+    parameters: {}
+    }));
 };
 
 socket.onmessage = function(e)
@@ -112,6 +118,12 @@ socket.onmessage = function(e)
           case 'game_over':
             handle_game_over(cmd_data.parameters);
             break;
+          case 'presence':
+            handle_presence(cmd_data.parameters);
+            break;
+          case 'presence_diff':
+            handle_presence_diff(cmd_data.parameters);
+            break;
         }
     }
     else
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+
+# tests run against the pure python engine, xo_app extension is not required
+os.environ.setdefault('XO_ENGINE_BACKEND', 'bitboard')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeSession:
+    """
+    Session recording executed statements instead of sending them to database.
+    """
+    def __init__(self, executed, fail):
+        self.executed = executed
+        self.fail = fail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, stmt, params=None):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError('database is down')
+        self.executed.append((stmt, params))
+
+
+class FakeSessionFactory:
+    def __init__(self):
+        self.executed = []
+        self.fail = False
+
+    def __call__(self):
+        return FakeSession(self.executed, self.fail)
@@ -0,0 +1,57 @@
+import asyncio
+from activity import LastSeenRecorder
+from conftest import FakeSessionFactory
+
+
+def saved_logins(factory):
+    return [sorted(params['b_login'] for params in batch) for _, batch in factory.executed]
+
+
+def test_touches_are_coalesced_into_one_statement():
+    async def scenario():
+        factory = FakeSessionFactory()
+        recorder = LastSeenRecorder()
+        recorder.session_factory = factory
+        for login in ('a', 'b', 'a', 'a'):
+            recorder.touch(login)
+        assert await recorder.flush()
+        return recorder, factory
+
+    recorder, factory = asyncio.run(scenario())
+    assert saved_logins(factory) == [['a', 'b']]
+    assert recorder.stats()['touches'] == 4
+    assert recorder.stats()['written'] == 2
+
+
+def test_failed_flush_keeps_newer_timestamps():
+    async def scenario():
+        factory = FakeSessionFactory()
+        recorder = LastSeenRecorder()
+        recorder.session_factory = factory
+        recorder.pending['a'] = 1
+        factory.fail = True
+        flush = asyncio.ensure_future(recorder.flush())
+        await asyncio.sleep(0)
+        # touched again while the failing write is in progress
+        recorder.pending['a'] = 2
+        assert not await flush
+        assert recorder.pending == {'a': 2}
+        factory.fail = False
+        assert await recorder.flush()
+        return factory
+
+    factory = asyncio.run(scenario())
+    assert [batch for _, batch in factory.executed] == [[{'b_login': 'a', 'b_last_seen_at': 2}]]
+
+
+def test_close_saves_pending_timestamps():
+    async def scenario():
+        factory = FakeSessionFactory()
+        recorder = LastSeenRecorder(flush_interval=10)
+        recorder.start(factory)
+        recorder.touch('a')
+        await asyncio.sleep(0)
+        await recorder.close()
+        return factory
+
+    assert saved_logins(asyncio.run(scenario())) == [['a']]
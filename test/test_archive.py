@@ -0,0 +1,82 @@
+import asyncio
+from archive import GameArchive
+
+
+class FakeArchive(GameArchive):
+    """
+    Archive writing batches into a list, failing while database is down.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.down = False
+
+    async def write(self, batch):
+        await asyncio.sleep(0)
+        if self.down:
+            raise ConnectionError('database is down')
+        self.batches.append([record['id'] for record in batch])
+
+
+def test_records_are_written_in_batches():
+    async def scenario():
+        archive = FakeArchive(batch_size=2, flush_interval=10)
+        archive.start(None)
+        for n in range(5):
+            archive.add({'id': n})
+        await asyncio.sleep(0.01)
+        await archive.close()
+        return archive
+
+    archive = asyncio.run(scenario())
+    assert archive.batches == [[0, 1], [2, 3], [4]]
+    assert archive.stats()['written'] == 5
+
+
+def test_failed_batch_is_retried_in_order():
+    async def scenario():
+        archive = FakeArchive(batch_size=2)
+        for n in range(3):
+            archive.add({'id': n})
+        archive.down = True
+        assert not await archive.flush()
+        archive.down = False
+        await archive.close()
+        return archive
+
+    archive = asyncio.run(scenario())
+    assert archive.batches == [[0, 1], [2]]
+    assert archive.stats()['failed_flushes'] == 1
+
+
+def test_queue_is_capped_after_failed_flush():
+    async def scenario():
+        archive = FakeArchive(batch_size=2, max_pending=3)
+        for n in range(3):
+            archive.add({'id': n})
+        archive.down = True
+        flush = asyncio.ensure_future(archive.flush())
+        await asyncio.sleep(0)
+        # finished while the failing batch is being written
+        archive.add({'id': 3})
+        archive.add({'id': 4})
+        assert not await flush
+        return archive
+
+    archive = asyncio.run(scenario())
+    assert [record['id'] for record in archive.pending] == [2, 3, 4]
+    assert archive.stats()['dropped'] == 2
+
+
+def test_close_waits_for_write_in_progress():
+    async def scenario():
+        archive = FakeArchive(batch_size=1, flush_interval=10)
+        archive.start(None)
+        archive.add({'id': 0})
+        archive.add({'id': 1})
+        await asyncio.sleep(0)
+        await archive.close()
+        return archive
+
+    archive = asyncio.run(scenario())
+    assert archive.batches == [[0], [1]]
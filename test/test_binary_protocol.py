@@ -0,0 +1,19 @@
+import pytest
+from binary_protocol import decode, BinaryProtocolException, READY, WATCH
+
+
+def test_ready_frame_without_side():
+    data = decode(bytes([READY, 0]) + b'bob')
+    assert data['parameters'] == {'type': 'xo_3d', 'opponent': 'bob', 'side': None}
+
+
+def test_ready_frame_with_side():
+    data = decode(bytes([READY, 2 << 6]))
+    assert data['parameters'] == {'type': 'xo_3d', 'opponent': 'random', 'side': 'second'}
+
+
+@pytest.mark.parametrize('payload', [bytes([READY, 1]), bytes([READY, 3 << 6]), bytes([READY, 0, 0xff]),
+                                     bytes([WATCH, 0xc3, 0x28])])
+def test_malformed_frame_is_rejected(payload):
+    with pytest.raises(BinaryProtocolException):
+        decode(payload)
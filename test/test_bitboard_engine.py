@@ -0,0 +1,74 @@
+import pytest
+import bitboard_engine
+from bitboard_engine import BitboardGame, CountersGame, InvalidCoordsException, InvalidPlayerException, \
+    cell_coords
+
+# full board without a line of four for either side
+DRAW_BOARD = 'xoxxxoxoxoxooxoxxooxoxoxoxxoxxooxxooxoooxxoxooxoooxoxoxxxoxxoxoo'
+
+
+@pytest.fixture(params=['masks', 'counters'])
+def engine(request, monkeypatch):
+    classes = {'masks': BitboardGame, 'counters': CountersGame}
+    monkeypatch.setattr(bitboard_engine, '_game_class', classes[request.param])
+    game_id = bitboard_engine.create_new_game()
+    yield game_id
+    bitboard_engine.release_game(game_id)
+
+
+def play(game_id, cells):
+    for n, cell in enumerate(cells):
+        bitboard_engine.set_new_move(game_id, 'first' if n % 2 == 0 else 'second', cell_coords(cell))
+
+
+def test_first_player_wins_on_row(engine):
+    play(engine, [0, 16, 1, 17, 2, 18, 3])
+    assert bitboard_engine.finished(engine)
+    assert bitboard_engine.result(engine) == 'first_win'
+    assert bitboard_engine.get_win_coords(engine) == '000 001 002 003'
+
+
+def test_second_player_wins_on_space_diagonal(engine):
+    play(engine, [1, 0, 2, 21, 3, 42, 4, 63])
+    assert bitboard_engine.result(engine) == 'second_win'
+    assert bitboard_engine.get_win_coords(engine) == '000 111 222 333'
+
+
+def test_full_board_without_line_is_draw(engine):
+    first = [i for i, c in enumerate(DRAW_BOARD) if c == 'x']
+    second = [i for i, c in enumerate(DRAW_BOARD) if c == 'o']
+    cells = [cell for pair in zip(first, second) for cell in pair]
+    play(engine, cells[:-1])
+    assert not bitboard_engine.finished(engine)
+    bitboard_engine.set_new_move(engine, 'second', cell_coords(cells[-1]))
+    assert bitboard_engine.result(engine) == 'draw'
+    assert bitboard_engine.get_win_coords(engine) == ''
+
+
+def test_move_to_occupied_cell_is_rejected(engine):
+    play(engine, [5])
+    with pytest.raises(InvalidCoordsException):
+        bitboard_engine.set_new_move(engine, 'second', cell_coords(5))
+    assert bitboard_engine.get_player_to_move(engine) == 'second'
+
+
+def test_move_after_end_of_game_is_rejected(engine):
+    play(engine, [0, 16, 1, 17, 2, 18, 3])
+    with pytest.raises(InvalidCoordsException):
+        bitboard_engine.set_new_move(engine, 'second', cell_coords(19))
+
+
+@pytest.mark.parametrize('coords', [(0, 0), (0, 0, 4), (-1, 0, 0), (0, None, 0)])
+def test_move_out_of_board_is_rejected(engine, coords):
+    with pytest.raises(InvalidCoordsException):
+        bitboard_engine.set_new_move(engine, 'first', coords)
+
+
+def test_move_out_of_order_is_rejected(engine):
+    with pytest.raises(InvalidPlayerException):
+        bitboard_engine.set_new_move(engine, 'second', (0, 0, 0))
+
+
+def test_unknown_win_detection_lists_valid_modes():
+    with pytest.raises(bitboard_engine.UnknownWinDetectionException, match='masks, counters'):
+        bitboard_engine.load_game_class('mask')
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+import cluster as cluster_module
+import protocol
+from broker import BrokerClient, BrokerProtocolException, MatchmakingBroker, CLAIM, INVALIDATE, RATINGS, \
+    RATINGS_UPDATE, cancel_frame, decode_matches, decode_presence, decode_ratings, decode_submit, matches_frame, \
+    presence_frames, ratings_frames, submit_frame, user_frame, _unpack_string
+from commands import ErrorCommand, ReadyCommand, WaitingCommand
+from players import Matcher, Playground
+
+PROFILE = {'user_id': 'a', 'worker': 1, 'rating': 1512.5, 'account_id': 7, 'fmt': 'binary', 'delta': True}
+ANONYMOUS = {'user_id': '1700000000.25', 'worker': 0, 'rating': 1500.0, 'account_id': None, 'fmt': 'json',
+             'delta': False}
+
+
+def payload(data):
+    # frames start with 4 bytes length
+    assert int.from_bytes(data[:4], 'big') == len(data) - 4
+    return data[4:]
+
+
+@pytest.mark.parametrize('parameters', [
+    {'type': 'xo_3d', 'side': None, 'opponent': 'random'},
+    {'type': 'xo_3d', 'side': 'second', 'opponent': 'b'},
+])
+def test_submit_round_trip(parameters):
+    assert decode_submit(payload(submit_frame(PROFILE, parameters))) == (PROFILE, parameters)
+
+
+def test_matches_round_trip():
+    games = [('xo_3d', PROFILE, ANONYMOUS), ('xo_3d', ANONYMOUS, PROFILE)]
+    assert decode_matches(payload(matches_frame(games))) == \
+        [{'game_type': t, 'first': first, 'second': second} for t, first, second in games]
+
+
+def test_user_frame_carries_user_id():
+    data = payload(cancel_frame('player'))
+    assert _unpack_string(data, 1) == ('player', len(data))
+
+
+def test_presence_frames_are_split_into_chunks(monkeypatch):
+    monkeypatch.setattr('broker._MAX_COUNT', 2)
+    changes = {'a': True, 'b': False, 'c': True}
+    frames = presence_frames(changes, snapshot=True)
+    decoded = [decode_presence(payload(data)) for data in frames]
+    assert decoded == [({'a': True, 'b': False}, True), ({'c': True}, False)]
+
+
+def test_empty_presence_snapshot_is_sent():
+    assert [decode_presence(payload(data)) for data in presence_frames({}, snapshot=True)] == [({}, True)]
+
+
+def test_ratings_round_trip():
+    ratings = [('a', 1500.0), ('b', 1623.25)]
+    [data] = ratings_frames(RATINGS_UPDATE, ratings)
+    assert decode_ratings(payload(data)) == ratings
+
+
+def test_too_long_string_is_rejected():
+    with pytest.raises(BrokerProtocolException):
+        submit_frame(PROFILE, {'type': 'xo_3d', 'opponent': 'x' * 256})
+
+
+def test_claim_of_too_long_user_id_leaves_nothing_waiting():
+    async def scenario():
+        client = BrokerClient(0, claim_timeout=0.01)
+        client.queue = asyncio.Queue()
+        with pytest.raises(BrokerProtocolException):
+            await client.claim('x' * 256)
+        return client
+
+    client = asyncio.run(scenario())
+    assert client.claiming == {} and client.queue.empty()
+
+
+def test_broker_claims_user_for_one_worker():
+    broker = MatchmakingBroker()
+    assert broker.claim(0, 'a')
+    assert broker.claim(0, 'a')
+    assert not broker.claim(1, 'a')
+    broker.release(0, 'a')
+    assert broker.claim(1, 'a')
+
+
+def test_reconnecting_client_resends_state_and_keeps_updates():
+    client = BrokerClient(0)
+    client.queue = asyncio.Queue()
+    client.submit(PROFILE, {'type': 'xo_3d', 'opponent': 'random'})
+    client.claims.add('a')
+    client.rating('a', 1600)
+    client.invalidate('b')
+    tags = [data[4] for data in client._state_frames()]
+    assert CLAIM in tags and RATINGS not in tags and INVALIDATE not in tags
+    assert user_frame(CLAIM, 'a') in client._state_frames()
+
+
+@pytest.fixture
+def cluster_worker(monkeypatch):
+    playground = Playground(Matcher())
+    monkeypatch.setattr(protocol, 'global_playground', playground)
+    monkeypatch.setattr(cluster_module, 'global_playground', playground)
+    monkeypatch.setattr(cluster_module.cluster, 'enabled', True)
+    monkeypatch.setattr(cluster_module.cluster, 'waiting', set())
+    monkeypatch.setattr(cluster_module.cluster.broker, 'queue', asyncio.Queue())
+    monkeypatch.setattr(cluster_module.cluster.broker, 'submitted', {})
+    playground.register('a')
+    return cluster_module.cluster
+
+
+@pytest.mark.parametrize('parameters', [
+    {'type': 'xo_2d', 'opponent': 'random'},
+    {'type': 'xo_3d', 'opponent': 'x' * 256},
+])
+def test_cluster_ready_with_wrong_parameters_is_rejected(cluster_worker, parameters):
+    [reply] = protocol.execute_cluster_ready(ReadyCommand('a', **parameters))
+    assert isinstance(reply, ErrorCommand)
+    assert cluster_worker.waiting == set()
+    assert cluster_worker.broker.queue.empty()
+
+
+def test_cluster_ready_is_submitted_to_broker(cluster_worker):
+    [reply] = protocol.execute_cluster_ready(ReadyCommand('a', type='xo_3d', opponent='random'))
+    assert isinstance(reply, WaitingCommand)
+    assert cluster_worker.waiting == {'a'}
+    profile, parameters = decode_submit(payload(cluster_worker.broker.queue.get_nowait()))
+    assert (profile['user_id'], parameters['type']) == ('a', 'xo_3d')
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+import cluster
+from cluster import ClusterChannel
+
+
+def test_messages_keep_order_between_workers(tmp_path):
+    async def scenario():
+        first, second = ClusterChannel(0, str(tmp_path)), ClusterChannel(1, str(tmp_path))
+        received = []
+        second.on('command', lambda header, body: received.append((header['n'], body)))
+        await second.start()
+        for n in range(100):
+            first.send(1, 'command', {'n': n}, bytes([n]))
+        while len(received) < 100:
+            await asyncio.sleep(0.001)
+        await second.close()
+        return received
+
+    received = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert received == [(n, bytes([n])) for n in range(100)]
+
+
+def test_message_to_itself_is_dispatched_locally(tmp_path):
+    async def scenario():
+        channel = ClusterChannel(0, str(tmp_path))
+        received = []
+        channel.on('released', lambda header, body: received.append(header))
+        channel.send(0, 'released', {'user_id': 'a'})
+        await asyncio.sleep(0)
+        return received, channel.sent
+
+    assert asyncio.run(scenario()) == ([{'user_id': 'a', 'kind': 'released'}], 0)
+
+
+@pytest.mark.parametrize('code, expected', [(0, 0), (1, 1), (3, 3)])
+def test_supervisor_returns_exit_code_of_first_exited_process(tmp_path, monkeypatch, code, expected):
+    monkeypatch.setattr(cluster.signal, 'signal', lambda *args: None)
+    (tmp_path / 'broker.py').write_text('import time\ntime.sleep(10)\n')
+    script = tmp_path / 'worker.py'
+    script.write_text('import os, sys, time\n'
+                      'if os.environ["XO_WORKER_INDEX"] == "0":\n'
+                      '    sys.exit({})\n'
+                      'time.sleep(10)\n'.format(code))
+    assert cluster.run_supervisor(str(script), 2) == expected
+
+
+def test_supervisor_reports_killed_process_by_signal(tmp_path, monkeypatch):
+    monkeypatch.setattr(cluster.signal, 'signal', lambda *args: None)
+    (tmp_path / 'broker.py').write_text('import time\ntime.sleep(10)\n')
+    script = tmp_path / 'worker.py'
+    script.write_text('import os, signal, time\n'
+                      'if os.environ["XO_WORKER_INDEX"] == "0":\n'
+                      '    os.kill(os.getpid(), signal.SIGKILL)\n'
+                      'time.sleep(10)\n')
+    assert cluster.run_supervisor(str(script), 2) == 128 + 9
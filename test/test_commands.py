@@ -0,0 +1,18 @@
+import pytest
+from commands import CommandException, CommandFactory, WatchCommand
+
+
+def test_watch_without_player_is_rejected():
+    with pytest.raises(CommandException):
+        CommandFactory.from_data('user', {'version': 'v1', 'command': 'watch', 'parameters': {}})
+
+
+def test_command_with_missing_parameter_is_rejected():
+    with pytest.raises(CommandException):
+        CommandFactory.from_data('user', {'version': 'v1', 'command': 'ready', 'parameters': {'type': 'xo_3d'}})
+
+
+def test_watch_command_keeps_player():
+    cmd = CommandFactory.from_data('user', {'version': 'v1', 'command': 'watch', 'parameters': {'player': 'other'}})
+    assert isinstance(cmd, WatchCommand)
+    assert cmd.data()['parameters'] == {'player': 'other'}
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from game_actor import GameActor, GameActorClosed
+
+
+def test_jobs_of_one_actor_do_not_interleave():
+    async def scenario():
+        actor = GameActor()
+        log = []
+
+        async def job(name):
+            log.append(('start', name))
+            await asyncio.sleep(0.001)
+            log.append(('end', name))
+            return name
+
+        results = await asyncio.gather(*[actor.call(job, n) for n in range(3)])
+        actor.stop()
+        return results, log
+
+    results, log = asyncio.run(scenario())
+    assert results == [0, 1, 2]
+    assert log == [(event, n) for n in range(3) for event in ('start', 'end')]
+
+
+def test_jobs_of_different_actors_run_concurrently():
+    async def scenario():
+        first, second = GameActor(), GameActor()
+        release = asyncio.Event()
+
+        async def waiting():
+            await release.wait()
+
+        async def releasing():
+            release.set()
+
+        await asyncio.wait_for(asyncio.gather(first.call(waiting), second.call(releasing)), 1)
+        first.stop()
+        second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_job_exception_is_raised_to_caller_only():
+    async def scenario():
+        actor = GameActor()
+
+        async def failing():
+            raise ValueError()
+
+        async def working():
+            return 'ok'
+
+        with pytest.raises(ValueError):
+            await actor.call(failing)
+        assert await actor.call(working) == 'ok'
+        actor.stop()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_after_stop_fail():
+    async def scenario():
+        actor = GameActor()
+
+        async def stopping():
+            actor.stop()
+
+        async def never():
+            pytest.fail('job of stopped actor was run')
+
+        results = await asyncio.gather(actor.call(stopping), actor.call(never), return_exceptions=True)
+        assert results[0] is None
+        assert isinstance(results[1], GameActorClosed)
+        with pytest.raises(GameActorClosed):
+            await actor.call(never)
+
+    asyncio.run(scenario())
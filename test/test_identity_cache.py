@@ -0,0 +1,54 @@
+import pytest
+import auth
+from auth import IdentityCache, login_identity
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # auth module sees the clock in place of time module
+    monkeypatch.setattr(auth, 'time', clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = IdentityCache(size=10, ttl=60)
+    cache.put('auth_a', 'a')
+    clock.now += 59
+    assert cache.get('auth_a') == (True, 'a')
+    clock.now += 2
+    assert cache.get('auth_a') == (False, None)
+    assert cache.stats() == {'size': 0, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_unknown_identity_is_cached(clock):
+    cache = IdentityCache(size=10, ttl=60)
+    cache.put('auth_nobody', None)
+    assert cache.get('auth_nobody') == (True, None)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = IdentityCache(size=2, ttl=60)
+    cache.put('auth_a', 'a')
+    cache.put('auth_b', 'b')
+    cache.get('auth_a')
+    cache.put('auth_c', 'c')
+    assert cache.get('auth_b') == (False, None)
+    assert cache.get('auth_a') == (True, 'a')
+    assert cache.get('auth_c') == (True, 'c')
+    assert cache.evictions == 1
+
+
+def test_invalidate_login_drops_its_identity(clock):
+    cache = IdentityCache(size=10, ttl=60)
+    cache.put(login_identity('a'), None)
+    cache.invalidate_login('a')
+    assert cache.get(login_identity('a')) == (False, None)
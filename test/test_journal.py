@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+import pytest
+from journal import Journal
+from players import Matcher, Move, Playground
+
+
+@pytest.fixture
+def playground():
+    return Playground(Matcher())
+
+
+def play(game, cells):
+    for square, vertical, horizontal in cells:
+        game.set_new_move(Move.create_move(game.player_to_move(), square, vertical, horizontal))
+
+
+def restored(path):
+    return [(g.game_type, g.first_id, g.second_id, g.moves) for g in Journal().recover(path)]
+
+
+def test_write_recover_compact_recover(tmp_path, playground):
+    path = str(tmp_path / 'journal')
+
+    async def scenario():
+        journal = Journal()
+        journal.recover(path)
+        await journal.start(path, playground.games)
+        running = playground.create_game('xo_3d', 'a', 'b')
+        journal.game_created(running)
+        finished = playground.create_game('xo_3d', 'c', 'd')
+        journal.game_created(finished)
+        play(running, [(0, 0, 0), (1, 1, 1)])
+        for move in running.moves:
+            journal.move_applied(running, move)
+        journal.game_finished(finished)
+        finished.clear()
+        await journal.sync()
+        assert restored(path) == [('xo_3d', 'a', 'b', [(0, 0, 0), (1, 1, 1)])]
+        await journal.compact()
+        play(running, [(2, 2, 2)])
+        journal.move_applied(running, running.moves[-1])
+        await journal.close()
+
+    asyncio.run(scenario())
+    assert restored(path) == [('xo_3d', 'a', 'b', [(0, 0, 0), (1, 1, 1), (2, 2, 2)])]
+    with open(path, 'rb') as f:
+        # only the move after compaction is left in the journal itself
+        assert len(f.read()) == 8 + 2 + 6
+
+
+def test_journal_included_in_snapshot_is_not_replayed_twice(tmp_path, playground):
+    path = str(tmp_path / 'journal')
+
+    async def scenario():
+        journal = Journal()
+        await journal.start(path, playground.games)
+        game = playground.create_game('xo_3d', 'a', 'b')
+        journal.game_created(game)
+        play(game, [(0, 0, 0)])
+        journal.move_applied(game, game.moves[-1])
+        await journal.sync()
+        with open(path, 'rb') as f:
+            before_compaction = f.read()
+        await journal.compact()
+        await journal.close()
+        # crash between writing snapshot and truncating journal
+        with open(path, 'wb') as f:
+            f.write(before_compaction)
+
+    asyncio.run(scenario())
+    assert restored(path) == [('xo_3d', 'a', 'b', [(0, 0, 0)])]
+
+
+def test_failed_sync_keeps_records(tmp_path, playground, monkeypatch):
+    path = str(tmp_path / 'journal')
+
+    async def scenario():
+        journal = Journal()
+        await journal.start(path, playground.games)
+        game = playground.create_game('xo_3d', 'a', 'b')
+        journal.game_created(game)
+        write = journal._write
+
+        def failing_write(data):
+            raise OSError('disk full')
+
+        monkeypatch.setattr(journal, '_write', failing_write)
+        with pytest.raises(OSError):
+            await journal.sync()
+        assert journal.buffer
+        monkeypatch.setattr(journal, '_write', write)
+        await journal.close()
+
+    asyncio.run(scenario())
+    assert restored(path) == [('xo_3d', 'a', 'b', [])]
+
+
+def test_close_waits_for_write_in_progress(tmp_path, playground, monkeypatch):
+    path = str(tmp_path / 'journal')
+
+    async def scenario():
+        journal = Journal()
+        journal.sync_interval = 0
+        await journal.start(path, playground.games)
+        started = threading.Event()
+        write = journal._write
+
+        def slow_write(data):
+            # only the first write is slow
+            if not started.is_set():
+                started.set()
+                time.sleep(0.05)
+            write(data)
+
+        monkeypatch.setattr(journal, '_write', slow_write)
+        journal.game_created(playground.create_game('xo_3d', 'a', 'b'))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        journal.game_created(playground.create_game('xo_3d', 'c', 'd'))
+        await journal.close()
+
+    asyncio.run(scenario())
+    assert [(g.first_id, g.second_id) for g in Journal().recover(path)] == [('a', 'b'), ('c', 'd')]
@@ -0,0 +1,39 @@
+from leaderboard import Leaderboard
+
+
+def board():
+    leaderboard = Leaderboard()
+    leaderboard.load([('a', 1500), ('b', 1600), ('c', 1500), ('d', 1400)])
+    return leaderboard
+
+
+def test_rank_orders_by_rating_then_login():
+    leaderboard = board()
+    assert [leaderboard.rank(login) for login in 'abcd'] == [2, 1, 3, 4]
+    assert leaderboard.rank('nobody') is None
+
+
+def test_top_pages_follow_ranks():
+    leaderboard = board()
+    assert leaderboard.top(2) == [{'rank': 1, 'login': 'b', 'rating': 1600}, {'rank': 2, 'login': 'a', 'rating': 1500}]
+    assert leaderboard.top(5, offset=3) == [{'rank': 4, 'login': 'd', 'rating': 1400}]
+
+
+def test_update_moves_user_and_notifies_listeners():
+    leaderboard = board()
+    updates = []
+    leaderboard.subscribe(lambda login, rating: updates.append((login, rating)))
+    leaderboard.update('d', 1700)
+    leaderboard.update('e', 1450, notify=False)
+    assert [leaderboard.rank(login) for login in 'bdace'] == [2, 1, 3, 4, 5]
+    assert len(leaderboard) == 5
+    assert updates == [('d', 1700)]
+
+
+def test_remove_drops_user():
+    leaderboard = board()
+    leaderboard.remove('b')
+    leaderboard.remove('nobody')
+    assert leaderboard.rank('b') is None
+    assert leaderboard.rank('a') == 1
+    assert len(leaderboard) == 3
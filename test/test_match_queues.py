@@ -0,0 +1,97 @@
+from players import Entry, Matcher, MatchQueues, Player
+
+
+def entry(user_id, rating=1500, side=None, opponent='random', game_type='xo_3d'):
+    return Entry.from_parameters(Player(user_id, rating), {'type': game_type, 'opponent': opponent, 'side': side})
+
+
+def test_add_and_remove_keep_indexes_consistent():
+    queues = MatchQueues()
+    a, b, c = entry('a'), entry('b', opponent='a'), entry('c', opponent='bot')
+    for e in (a, b, c):
+        queues.add(e)
+    assert len(queues) == 3
+    assert queues.entry_of('b') is b
+    assert queues.challengers('a') == [b]
+    assert [e for _, _, e in queues.ratings['xo_3d']] == [a]
+    for e in (a, b, c):
+        queues.remove(e)
+    assert len(queues) == 0
+    assert queues.queues == {} and queues.challenges == {} and queues.ratings == {} and queues.by_user == {}
+    assert a not in queues
+
+
+def test_oldest_respects_sides_and_arrival_order():
+    queues = MatchQueues()
+    first = entry('first', side='first')
+    anyone = entry('anyone')
+    second = entry('second', side='second')
+    for e in (first, anyone, second):
+        queues.add(e)
+    assert queues.oldest('xo_3d', 'broadcast', None, exclude=None) is first
+    assert queues.oldest('xo_3d', 'broadcast', 'first', exclude=None) is anyone
+    assert queues.oldest('xo_3d', 'broadcast', 'second', exclude=None) is first
+    assert queues.oldest('xo_3d', 'broadcast', None, exclude=first) is anyone
+    assert queues.oldest('other', 'broadcast', None, exclude=None) is None
+
+
+def test_nearest_visits_entries_by_rating_distance():
+    queues = MatchQueues()
+    entries = {user_id: entry(user_id, rating) for user_id, rating in
+               [('low', 1400), ('near', 1520), ('self', 1500), ('far', 1900)]}
+    for e in entries.values():
+        queues.add(e)
+    me = entries['self']
+    assert queues.nearest(me, 400, lambda e: True) is entries['near']
+    assert queues.nearest(me, 400, lambda e: e is not entries['near']) is entries['low']
+    assert queues.nearest(me, 50, lambda e: e is not entries['near']) is None
+    assert queues.nearest(me, 400, lambda e: e is entries['far']) is entries['far']
+    assert queues.nearest(me, 399, lambda e: e is entries['far']) is None
+
+
+def test_fifo_matcher_pairs_oldest_compatible_entry():
+    queues = MatchQueues()
+    matcher = Matcher('fifo')
+    older, newer = entry('older', side='first'), entry('newer', side='first')
+    queues.add(older)
+    queues.add(newer)
+    assert matcher.match(newer, queues) is None
+    late = entry('late')
+    queues.add(late)
+    match = matcher.match(late, queues)
+    assert (match.first_player.player_id, match.second_player.player_id) == ('older', 'late')
+
+
+def test_fifo_matcher_prefers_challenge_to_entry_user():
+    queues = MatchQueues()
+    matcher = Matcher('fifo')
+    queues.add(entry('waiting'))
+    challenger = entry('challenger', opponent='target')
+    queues.add(challenger)
+    target = entry('target')
+    queues.add(target)
+    match = matcher.match(target, queues)
+    assert {match.first_player.player_id, match.second_player.player_id} == {'challenger', 'target'}
+
+
+def test_challenge_matches_only_requested_user():
+    queues = MatchQueues()
+    matcher = Matcher('fifo')
+    queues.add(entry('other'))
+    queues.add(entry('target', opponent='someone'))
+    challenger = entry('challenger', opponent='target')
+    queues.add(challenger)
+    assert matcher.match(challenger, queues) is None
+    unrelated = entry('someone', opponent='challenger')
+    queues.add(unrelated)
+    assert matcher.match(unrelated, queues) is None
+
+
+def test_mutual_challenges_are_matched():
+    queues = MatchQueues()
+    matcher = Matcher('fifo')
+    queues.add(entry('a', opponent='b'))
+    b = entry('b', opponent='a')
+    queues.add(b)
+    match = matcher.match(b, queues)
+    assert (match.first_player.player_id, match.second_player.player_id) == ('a', 'b')
@@ -0,0 +1,131 @@
+import random
+import time
+import pytest
+from players import Entry, Matcher, Move, Player, Playground, WrongMoveException, WrongPlayerException, OwnGameException, \
+    NotPlayingException
+from settings import RATING_WINDOW_MAX, MATCHMAKING_WAIT_COST
+
+
+@pytest.fixture
+def playground():
+    playground = Playground(Matcher())
+    playground.register('first')
+    playground.register('second')
+    return playground
+
+
+@pytest.fixture
+def game(playground):
+    return playground.create_game('xo_3d', 'first', 'second')
+
+
+def test_move_to_occupied_cell_is_rejected(game):
+    game.set_new_move(Move.create_move('first', 0, 0, 0))
+    with pytest.raises(WrongMoveException):
+        game.set_new_move(Move.create_move('second', 0, 0, 0))
+    assert game.player_to_move() == 'second'
+    assert len(game.moves) == 1
+
+
+def test_move_out_of_order_is_rejected(game):
+    with pytest.raises(WrongPlayerException):
+        game.set_new_move(Move.create_move('second', 0, 0, 0))
+
+
+def test_spectator_is_added_to_game(playground, game):
+    playground.register('spectator')
+    assert playground.watch('spectator', 'first') is game
+    assert game.watcher_ids() == ['spectator']
+    assert playground.unwatch('spectator') is game
+    assert game.watcher_ids() == []
+
+
+def test_player_cannot_watch_own_game(playground, game):
+    with pytest.raises(OwnGameException):
+        playground.watch('first', 'second')
+    with pytest.raises(OwnGameException):
+        playground.watch('first', 'first')
+    assert game.watcher_ids() == []
+
+
+def test_watching_idle_player_is_rejected(playground):
+    playground.register('spectator')
+    with pytest.raises(NotPlayingException):
+        playground.watch('spectator', 'first')
+
+
+def wait_entry(playground, user_id, rating):
+    playground.register(user_id, rating)
+    entry = Entry.from_parameters(playground.player(user_id), {'type': 'xo_3d', 'opponent': 'random'})
+    playground.add_entry(entry)
+    return entry
+
+
+def test_waiting_entries_are_matched_when_windows_widen():
+    playground = Playground(Matcher('rating'))
+    wait_entry(playground, 'a', 1500)
+    entry = wait_entry(playground, 'b', 1600)
+    assert playground.find_match(entry) is None
+    assert playground.find_matches(batch=False) == []
+    for waiting in playground.queues:
+        waiting.created_at -= 60
+    [match] = playground.find_matches(batch=False)
+    assert (match.first_player.player_id, match.second_player.player_id) == ('a', 'b')
+
+
+def test_batch_pairs_long_waiting_entries_over_new_one():
+    playground = Playground(Matcher('rating'))
+    wait_entry(playground, 'a', 1500).created_at -= 60
+    wait_entry(playground, 'b', 1501)
+    wait_entry(playground, 'c', 1502).created_at -= 60
+    [match] = playground.find_matches()
+    assert {match.first_player.player_id, match.second_player.player_id} == {'a', 'c'}
+
+
+def test_batch_pairs_neighbours():
+    playground = Playground(Matcher('rating'))
+    for user_id, rating in [('a', 1500), ('b', 1510), ('c', 1700), ('d', 1705), ('e', 2500)]:
+        wait_entry(playground, user_id, rating)
+    matches = playground.find_matches()
+    assert sorted(sorted((m.first_player.player_id, m.second_player.player_id)) for m in matches) == \
+        [['a', 'b'], ['c', 'd']]
+
+
+def pairing_cost(matcher, entries, pairs, now):
+    paired = {e for pair in pairs for e in pair}
+    gaps = sum(abs(a.rating - b.rating) for a, b in pairs)
+    return gaps + sum(RATING_WINDOW_MAX + MATCHMAKING_WAIT_COST * (now - e.created_at)
+                      for e in entries if e not in paired)
+
+
+def best_cost(matcher, entries, now):
+    if len(entries) < 2:
+        return pairing_cost(matcher, entries, [], now)
+    first, rest = entries[0], entries[1:]
+    best = pairing_cost(matcher, [first], [], now) + best_cost(matcher, rest, now)
+    for n, other in enumerate(rest):
+        if matcher.acceptable(first, other, now):
+            best = min(best, abs(first.rating - other.rating) + best_cost(matcher, rest[:n] + rest[n + 1:], now))
+    return best
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_pair_sorted_is_optimal_with_saturated_windows(seed):
+    # all windows are at maximum, so nothing forbids exchanging partners and the pairing must be optimal
+    generator = random.Random(seed)
+    matcher = Matcher('rating')
+    now = time.monotonic()
+    entries = []
+    for n in range(generator.randint(2, 8)):
+        entry = Entry.from_parameters(Player(str(n), generator.randint(1000, 2200)),
+                                      {'type': 'xo_3d', 'opponent': 'random'})
+        entry.seq = n
+        entry.rating = entry.player.rating
+        entry.created_at = now - 1000 - generator.random() * 100
+        entries.append(entry)
+    entries.sort(key=lambda e: e.rating)
+    matches = matcher.pair_sorted(entries, now)
+    by_player = {e.player: e for e in entries}
+    pairs = [(by_player[m.first_player], by_player[m.second_player]) for m in matches]
+    assert all(matcher.acceptable(a, b, now) for a, b in pairs)
+    assert pairing_cost(matcher, entries, pairs, now) == pytest.approx(best_cost(matcher, entries, now))
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+import presence as presence_module
+from conftest import FakeSessionFactory
+from presence import PresenceTracker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # presence module sees the clock in place of time module
+    monkeypatch.setattr(presence_module, 'time', clock)
+    return clock
+
+
+def tracker():
+    return PresenceTracker(timeout=10, grace=2, tick=0.25)
+
+
+def advance(presence, clock, seconds):
+    clock.now += seconds
+    presence.expire()
+
+
+def test_heartbeat_expires_after_timeout(clock):
+    presence = tracker()
+    presence.heartbeat('a')
+    assert presence.is_online('a')
+    advance(presence, clock, 9)
+    assert presence.is_online('a')
+    advance(presence, clock, 1.5)
+    assert not presence.is_online('a')
+    assert presence.wheel == {} and presence.deadlines == {}
+
+
+def test_heartbeat_moves_deadline(clock):
+    presence = tracker()
+    presence.heartbeat('a')
+    advance(presence, clock, 5)
+    presence.heartbeat('a')
+    advance(presence, clock, 9)
+    assert presence.is_online('a')
+    assert len(presence.deadlines) == 1
+
+
+def test_connected_user_stays_online_until_grace_after_last_socket(clock):
+    presence = tracker()
+    presence.connect('a')
+    presence.connect('a')
+    presence.heartbeat('a')
+    advance(presence, clock, 100)
+    assert presence.is_online('a')
+    presence.disconnect('a')
+    advance(presence, clock, 100)
+    assert presence.is_online('a')
+    presence.disconnect('a')
+    advance(presence, clock, 1)
+    assert presence.is_online('a')
+    advance(presence, clock, 1.5)
+    assert not presence.is_online('a')
+
+
+def test_reconnect_within_grace_is_not_published(clock):
+    presence = tracker()
+    diffs = []
+    presence.subscribe(diffs.append)
+    presence.connect('a')
+    presence.publish()
+    presence.disconnect('a')
+    presence.connect('a')
+    advance(presence, clock, 5)
+    presence.publish()
+    assert diffs == [{'a': True}]
+    assert presence.transitions == 1
+
+
+def test_changes_are_saved_without_touching_last_seen(clock):
+    async def scenario():
+        factory = FakeSessionFactory()
+        presence = tracker()
+        presence.session_factory = factory
+        presence.connect('a')
+        presence.heartbeat('b')
+        advance(presence, clock, 11)
+        assert await presence.flush()
+        return presence, factory
+
+    presence, factory = asyncio.run(scenario())
+    [(stmt, _)] = factory.executed
+    assert 'last_seen_at=users.last_seen_at' in str(stmt)
+    assert presence.changes == {}
+    assert presence.stats()['written'] == 2
+
+
+def test_failed_flush_keeps_newer_changes():
+    async def scenario():
+        factory = FakeSessionFactory()
+        presence = tracker()
+        presence.session_factory = factory
+        presence.connect('a')
+        factory.fail = True
+        flush = asyncio.ensure_future(presence.flush())
+        await asyncio.sleep(0)
+        presence.connect('b')
+        assert not await flush
+        return presence
+
+    assert asyncio.run(scenario()).changes == {'a': True, 'b': True}
@@ -0,0 +1,59 @@
+from players import Entry, Matcher, MatchQueues, Player
+from settings import RATING_WINDOW_BASE, RATING_WINDOW_RATE, RATING_WINDOW_MAX
+
+
+def queued(queues, user_id, rating, waited=0.0, opponent='random'):
+    entry = Entry.from_parameters(Player(user_id, rating), {'type': 'xo_3d', 'opponent': opponent})
+    queues.add(entry)
+    entry.created_at -= waited
+    return entry
+
+
+def test_window_widens_with_waiting_time_up_to_max():
+    queues = MatchQueues()
+    entry = queued(queues, 'a', 1500)
+    now = entry.created_at
+    assert Matcher.window(entry, now) == RATING_WINDOW_BASE
+    assert Matcher.window(entry, now + 2) == RATING_WINDOW_BASE + 2 * RATING_WINDOW_RATE
+    assert Matcher.window(entry, now + 10 ** 6) == RATING_WINDOW_MAX
+
+
+def test_rating_matcher_picks_closest_rating_within_window():
+    queues = MatchQueues()
+    matcher = Matcher('rating')
+    queued(queues, 'old', 1530)
+    queued(queues, 'close', 1510)
+    entry = queued(queues, 'new', 1500)
+    match = matcher.match(entry, queues)
+    assert (match.first_player.player_id, match.second_player.player_id) == ('close', 'new')
+
+
+def test_rating_gap_must_fit_window_of_one_entry():
+    queues = MatchQueues()
+    matcher = Matcher('rating')
+    queued(queues, 'far', 1500 + RATING_WINDOW_BASE + 30)
+    entry = queued(queues, 'new', 1500)
+    assert matcher.match(entry, queues) is None
+    queues.remove(entry)
+    entry = queued(queues, 'new', 1500, waited=10)
+    assert matcher.match(entry, queues) is not None
+
+
+def test_rating_matcher_prefers_direct_challenge():
+    queues = MatchQueues()
+    matcher = Matcher('rating')
+    queued(queues, 'close', 1500)
+    queued(queues, 'challenger', 2000, opponent='new')
+    entry = queued(queues, 'new', 1500)
+    match = matcher.match(entry, queues)
+    assert {match.first_player.player_id, match.second_player.player_id} == {'challenger', 'new'}
+
+
+def test_match_waiting_gives_oldest_entry_its_closest_opponent():
+    queues = MatchQueues()
+    queued(queues, 'a', 1500, waited=60)
+    queued(queues, 'b', 1700, waited=30)
+    queued(queues, 'c', 1650)
+    assert Matcher('fifo').match_waiting(queues) == []
+    [match] = Matcher('rating').match_waiting(queues)
+    assert (match.first_player.player_id, match.second_player.player_id) == ('a', 'c')
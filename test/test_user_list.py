@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+import pytest
+from aiohttp.test_utils import make_mocked_request
+from user_list import UserListCache, UserListPage
+from views import users_page_response
+
+
+class FakeUserList(UserListCache):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.builds = 0
+        self.fail = False
+
+    async def build(self, online, after, limit):
+        self.builds += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ConnectionError('database is down')
+        data = [] if limit is None else {'users': [], 'next': None}
+        return UserListPage(json.dumps(data).encode('utf-8'), time.monotonic())
+
+
+@pytest.fixture
+def page():
+    return UserListPage(b'[]', 0)
+
+
+@pytest.mark.parametrize('header', ['{}', 'W/{}', '"other", {}', '"other",{} , "more"', '*'])
+def test_matching_etag(page, header):
+    assert page.matches(header.format(page.etag))
+
+
+@pytest.mark.parametrize('header', ['', '"other"', '{}x', 'x{}, "other"'])
+def test_not_matching_etag(page, header):
+    assert not page.matches(header.format(page.etag.strip('"')))
+
+
+def test_if_none_match_returns_not_modified(page):
+    request = make_mocked_request('GET', '/users', headers={'If-None-Match': 'W/' + page.etag})
+    response = users_page_response(request, page)
+    assert response.status == 304
+    assert response.headers['ETag'] == page.etag
+
+
+def test_other_etag_returns_page(page):
+    request = make_mocked_request('GET', '/users', headers={'If-None-Match': '"stale"'})
+    response = users_page_response(request, page)
+    assert response.status == 200
+    assert response.body == b'[]'
+
+
+def test_concurrent_requests_share_one_build():
+    async def scenario():
+        users = FakeUserList(interval=60)
+        pages = await asyncio.gather(*[users.page(None, '', 10) for _ in range(5)])
+        assert all(p is pages[0] for p in pages)
+        assert await users.page(None, '', 10) is pages[0]
+        return users
+
+    assert asyncio.run(scenario()).builds == 1
+
+
+def test_cancelled_request_does_not_stop_build():
+    async def scenario():
+        users = FakeUserList(interval=60)
+        request = asyncio.ensure_future(users.page(None, '', 10))
+        await asyncio.sleep(0)
+        request.cancel()
+        page = await users.page(None, '', 10)
+        assert await users.page(None, '', 10) is page
+        return users
+
+    assert asyncio.run(scenario()).builds == 1
+
+
+def test_failed_build_is_retried_by_next_request():
+    async def scenario():
+        users = FakeUserList(interval=60)
+        users.fail = True
+        with pytest.raises(ConnectionError):
+            await users.page(None, '', 10)
+        users.fail = False
+        await users.page(None, '', 10)
+        return users
+
+    assert asyncio.run(scenario()).builds == 2
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import select
+from models import User
+from db import unit_of_work
+from settings import USERS_SNAPSHOT_INTERVAL, USERS_SNAPSHOT_MAX_PAGES
+
+
+class UserListPage:
+    """
+    Encoded page of users list shared by all requests during snapshot interval.
+    """
+    def __init__(self, body: bytes, built_at: float) -> None:
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        self.built_at = built_at
+
+    def matches(self, if_none_match: str) -> bool:
+        """
+        Check If-None-Match header against ETag of the page, by weak comparison.
+        """
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag == self.etag:
+                return True
+        return False
+
+
+class UserListCache:
+    """
+    Pages of users list, each rebuilt from database at most once per interval.
+
+    Pages use keyset pagination by login, concurrent requests of the same
+    expired page wait for one query. Page without limit is the whole list,
+    encoded as a bare list of users, as served before pagination. ETag depends only on content, so
+    unchanged pages keep it across rebuilds.
+    """
+    def __init__(self, interval: float = USERS_SNAPSHOT_INTERVAL, max_pages: int = USERS_SNAPSHOT_MAX_PAGES) -> None:
+        self.interval = interval
+        self.max_pages = max_pages
+        # (online, after, limit) -> UserListPage or future of its rebuild
+        self.pages = {}
+        # statistics
+        self.hits = 0
+        self.rebuilds = 0
+        self.not_modified = 0
+
+    async def page(self, online: Optional[bool], after: str, limit: Optional[int]) -> UserListPage:
+        key = (online, after, limit)
+        cached = self.pages.get(key)
+        if isinstance(cached, asyncio.Future):
+            self.hits += 1
+        elif cached is not None and time.monotonic() - cached.built_at < self.interval:
+            self.hits += 1
+            return cached
+        else:
+            # rebuild runs as its own task, so request cancelled by disconnected client doesn't stop it
+            cached = self.pages[key] = asyncio.ensure_future(self._rebuild(key, online, after, limit))
+            # failure is raised to waiting requests, don't report it as never retrieved if there are none
+            cached.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(cached)
+
+    async def _rebuild(self, key: tuple, online: Optional[bool], after: str, limit: Optional[int]) -> UserListPage:
+        try:
+            result = await self.build(online, after, limit)
+        except BaseException:
+            self.pages.pop(key, None)
+            raise
+        self._evict()
+        self.pages[key] = result
+        return result
+
+    def _evict(self) -> None:
+        if len(self.pages) < self.max_pages:
+            return
+        now = time.monotonic()
+        # expired pages are dropped first, then the oldest ones, pages being rebuilt are kept
+        for key, page in list(self.pages.items()):
+            if isinstance(page, UserListPage) and now - page.built_at >= self.interval:
+                del self.pages[key]
+        for key, page in list(self.pages.items()):
+            if len(self.pages) < self.max_pages:
+                break
+            if isinstance(page, UserListPage):
+                del self.pages[key]
+
+    async def build(self, online: Optional[bool], after: str, limit: Optional[int]) -> UserListPage:
+        stmt = select(User.login, User.online, User.last_seen_at).where(User.login > after)
+        if online is not None:
+            stmt = stmt.where(User.online == online)
+        stmt = stmt.order_by(User.login)
+        if limit is not None:
+            # one more row tells if there is next page
+            stmt = stmt.limit(limit + 1)
+        async with unit_of_work() as session:
+            result = await session.execute(stmt)
+            rows = result.all()
+        self.rebuilds += 1
+        users = [{"login": row.login, "online": row.online,
+                  "last_seen_at": datetime.fromtimestamp(row.last_seen_at).strftime('%Y-%m-%d %H:%M:%S')}
+                 for row in rows[:limit]]
+        if limit is None:
+            data = users
+        else:
+            data = {"users": users, "next": users[-1]["login"] if len(rows) > limit else None}
+        return UserListPage(json.dumps(data).encode('utf-8'), time.monotonic())
+
+    def stats(self) -> Dict:
+        return {
+            'pages': len(self.pages),
+            'hits': self.hits,
+            'rebuilds': self.rebuilds,
+            'not_modified': self.not_modified
+        }
+
+
+user_list = UserListCache()
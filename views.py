@@ -1,12 +1,21 @@
 from aiohttp import web
 import aiohttp_jinja2
 from aiohttp_security import is_anonymous, remember, authorized_userid
-from auth import get_new_anonymous_user_id
+from auth import get_new_anonymous_user_id, identity_cache, login_identity
 from functools import wraps
-from models import User, UserException
+from models import User, UserException, Game, UserStats
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import select
-from datetime import datetime
+from global_defs import registry, global_playground
+from passwords import hasher, PasswordHasherBusy
+from db import archive, last_seen, presence, pool_monitor, unit_of_work
+from journal import journal
+from cluster import cluster
+from user_list import user_list
+from leaderboard import leaderboard
+from ratings import DEFAULT_RATING
+from settings import USERS_PAGE_LIMIT, USERS_PAGE_MAX_LIMIT, GAMES_PAGE_LIMIT, GAMES_PAGE_MAX_LIMIT, \
+    LEADERBOARD_LIMIT, LEADERBOARD_MAX_LIMIT
 
 
 # decorator to autocreate temporary user ids for not autheticated usera
@@ -50,16 +59,23 @@ async def add_new_user(request):
     password = data['password']
 
     # create new user in database
-    user = User.create_new(login, password)
-    session = request.app['session']
     try:
-        async with session.begin():
+        user = User.create_new(login, await hasher.hash(password))
+    except PasswordHasherBusy:
+        raise web.HTTPServiceUnavailable(text='Too many requests, try again later')
+    try:
+        async with unit_of_work() as session:
             session.add(user)
     except IntegrityError:
         raise web.HTTPBadRequest(text='User already exists!')
+    # unknown identity of new user may be cached, by other workers too
+    identity_cache.invalidate_login(login)
+    if cluster.enabled:
+        cluster.broker.invalidate(login)
+    leaderboard.update(login, DEFAULT_RATING)
     # create new identity for current user
     redirect_response = web.HTTPFound('/')
-    identity = 'auth_' + login
+    identity = login_identity(login)
     await remember(request, redirect_response, identity)
 
     # redirect to main page
@@ -76,17 +92,21 @@ async def login_user(request):
     password = data['password']
 
     # here we have an old identity, we will change it to new if login successful
-    session = request.app['session']
     stmt = select(User).where(User.login == login)
-    users = []
-    async with session.begin():
+    async with unit_of_work() as session:
         result = await session.execute(stmt)
         users = result.scalars().all()
-        if users and users[0].check_password(password):
-            users[0].ping()
-    if users and users[0].check_password(password):
+    password_hash = users[0].password_hash if users else None
+    try:
+        verified = await hasher.verify(password, password_hash)
+    except PasswordHasherBusy:
+        raise web.HTTPServiceUnavailable(text='Too many requests, try again later')
+    if verified:
+        last_seen.touch(login)
+        presence.heartbeat(login)
         # create new identity
-        identity = 'auth_' + login
+        identity = login_identity(login)
+        identity_cache.put(identity, login)
         redirect_response = web.HTTPFound('/')
         await remember(request, redirect_response, identity)
     else:
@@ -96,6 +116,9 @@ async def login_user(request):
 
 
 async def logout_user(request):
+    login = await authorized_userid(request)
+    if login is not None:
+        identity_cache.invalidate_login(login)
     identity = "Anon_" + str(get_new_anonymous_user_id())
     redirect_response = web.HTTPFound('/')
     await remember(request, redirect_response, identity)
@@ -104,16 +127,122 @@ async def logout_user(request):
 
 async def get_active_users(request):
     """
-    Get list of active users
+    Get page of users ordered by login
+
+    Query parameters: 'online' ('true' or 'false') filter, 'after' - login from 'next' of
+    the previous page, 'limit' - size of page.
+    Without any of them the whole list is returned as a bare list, as before pagination.
+    Pages are served from shared snapshot, with ETag for conditional requests.
     """
     user_id = await authorized_userid(request)
-    session = request.app['session']
-    # stmt = select(User).where(User.online == True)
-    stmt = select(User)
-    async with session.begin():
-        result = await session.execute(stmt)
-    users = result.scalars().all()
-    data = [{"login": user.login, "online": user.online,
-             "last_seen_at": datetime.fromtimestamp(user.last_seen_at).strftime('%Y-%m-%d %H:%M:%S')}
-            for user in users]
+    query = request.query
+    if not any(name in query for name in ('online', 'after', 'limit')):
+        return users_page_response(request, await user_list.page(None, '', None))
+    online = query.get('online')
+    if online not in (None, 'true', 'false'):
+        raise web.HTTPBadRequest(text='Wrong online filter!')
+    try:
+        limit = int(query.get('limit', USERS_PAGE_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(text='Wrong limit!')
+    limit = min(max(limit, 1), USERS_PAGE_MAX_LIMIT)
+    page = await user_list.page(None if online is None else online == 'true', query.get('after', ''), limit)
+    return users_page_response(request, page)
+
+
+def users_page_response(request, page):
+    headers = {'ETag': page.etag, 'Cache-Control': 'no-cache'}
+    if page.matches(request.headers.get('If-None-Match', '')):
+        user_list.not_modified += 1
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=page.body, content_type='application/json', headers=headers)
+
+
+async def get_user_games(request):
+    """
+    Get page of finished games of user, the latest first
+
+    Query parameters: 'before' - cursor from 'next' of the previous page, 'limit' - size of page.
+    """
+    login = request.match_info['login']
+    query = request.query
+    before = None
+    try:
+        limit = min(max(int(query.get('limit', GAMES_PAGE_LIMIT)), 1), GAMES_PAGE_MAX_LIMIT)
+        if 'before' in query:
+            finished_at, game_id = query['before'].split(':')
+            before = (int(finished_at), int(game_id))
+    except ValueError:
+        raise web.HTTPBadRequest(text='Wrong page parameters!')
+    async with unit_of_work() as session:
+        user_id, _ = await User.find_profile(session, login)
+        if user_id is None:
+            raise web.HTTPNotFound(text='No such user!')
+        rows = await Game.history(session, user_id, before, limit)
+        logins = await User.find_logins(session, ({row.first_user_id for row in rows} |
+                                                  {row.second_user_id for row in rows}) - {None})
+    games = [{"id": row.id, "first": logins.get(row.first_user_id), "second": logins.get(row.second_user_id),
+              "type": row.game_type, "result": row.result, "cause": row.cause,
+              "started_at": row.started_at, "finished_at": row.finished_at}
+             for row in rows]
+    next_page = "{}:{}".format(rows[-1].finished_at, rows[-1].id) if len(rows) == limit else None
+    return web.json_response({"games": games, "next": next_page})
+
+
+async def get_user_stats(request):
+    """
+    Get rating and results of finished games of user
+    """
+    login = request.match_info['login']
+    async with unit_of_work() as session:
+        user_id, rating = await User.find_profile(session, login)
+        if user_id is None:
+            raise web.HTTPNotFound(text='No such user!')
+        data = await UserStats.find(session, user_id)
+    data.update({"login": login, "rating": rating})
+    return web.json_response(data)
+
+
+async def get_leaderboard(request):
+    """
+    Get users with the highest ratings
+
+    Query parameters: 'offset' - number of skipped top users, 'limit' - size of page.
+    """
+    query = request.query
+    try:
+        limit = min(max(int(query.get('limit', LEADERBOARD_LIMIT)), 1), LEADERBOARD_MAX_LIMIT)
+        offset = max(int(query.get('offset', 0)), 0)
+    except ValueError:
+        raise web.HTTPBadRequest(text='Wrong page parameters!')
+    return web.json_response({"users": leaderboard.top(limit, offset), "total": len(leaderboard)})
+
+
+async def get_user_rank(request):
+    """
+    Get rank and rating of user in leaderboard
+    """
+    login = request.match_info['login']
+    rank = leaderboard.rank(login)
+    if rank is None:
+        raise web.HTTPNotFound(text='No such user!')
+    return web.json_response({"login": login, "rank": rank, "rating": leaderboard.ratings[login],
+                              "total": len(leaderboard)})
+
+
+async def get_stats(request):
+    """
+    Get server statistics for monitoring
+    """
+    data = {'connections': registry.stats(),
+            'matchmaking': global_playground.stats(),
+            'archive': archive.stats(),
+            'last_seen': last_seen.stats(),
+            'presence': presence.stats(),
+            'identity_cache': identity_cache.stats(),
+            'db_pool': pool_monitor.stats(),
+            'passwords': hasher.stats(),
+            'users': user_list.stats(),
+            'journal': journal.stats(),
+            'cluster': cluster.stats()}
     return web.json_response(data)
@@ -1,15 +1,22 @@
 from aiohttp import web, WSMsgType
 from aiohttp_security import authorized_userid
 from players import AlreadyRegistered
-from protocol import handle_command, handle_error, send_command
+from protocol import handle_command, handle_binary_command, handle_error, send_command, resync_frames, \
+    resume_commands
+from binary_protocol import JSON_SUBPROTOCOL, BINARY_SUBPROTOCOL
 from commands import ErrorCommand
+from models import User
+from ratings import DEFAULT_RATING
 import json
 import logging
 from global_defs import global_playground, registry
+from db import presence, last_seen, unit_of_work
+from cluster import cluster
+from broker import BrokerProtocolException
 
 
 async def websocket_handler(request):
-    ws = web.WebSocketResponse()
+    ws = web.WebSocketResponse(protocols=(JSON_SUBPROTOCOL, BINARY_SUBPROTOCOL))
     try:
         await ws.prepare(request)
     except web.HTTPException:
@@ -22,13 +29,25 @@ async def websocket_handler(request):
 async def process_connection(ws, request):
     user_id = await authorize_new_user(request)
     logging.info("websocket connection opened with user_id {}".format(user_id))
+    account_id, rating = await load_profile(request, user_id)
     try:
-        register_new_user(user_id)
+        await claim_user(user_id)
+        register_new_user(user_id, rating, account_id)
     except NotPermittedUserException as e:
         await exit_connection(ws, user_id, e)
     else:
         register_socket(ws, user_id)
-        await process_messages(ws, user_id)
+        presence.connect(user_id)
+        try:
+            for command in resume_commands(user_id):
+                await send_command(command)
+            await process_messages(ws, user_id)
+        finally:
+            presence.disconnect(user_id)
+            if user_id is not None:
+                last_seen.touch(user_id)
+                if cluster.enabled:
+                    cluster.broker.release(user_id)
 
 
 async def authorize_new_user(request):
@@ -36,12 +55,32 @@ async def authorize_new_user(request):
 
 
 def register_socket(ws, user_id):
-    registry.add_socket(user_id, ws)
+    fmt = 'binary' if ws.ws_protocol == BINARY_SUBPROTOCOL else 'json'
+    registry.add_socket(user_id, ws, resync=resync_frames, fmt=fmt)
 
 
-def register_new_user(user_id):
+async def load_profile(request, user_id):
+    if user_id is None:
+        return None, DEFAULT_RATING
+    async with unit_of_work() as session:
+        return await User.find_profile(session, user_id)
+
+
+async def claim_user(user_id):
+    # in multi-process mode user is registered on one worker only
+    if not cluster.enabled or user_id is None:
+        return
+    try:
+        granted = await cluster.broker.claim(user_id)
+    except BrokerProtocolException:
+        raise NotPermittedUserException("User id is too long")
+    if not granted:
+        raise NotPermittedUserException("User already registered on other worker")
+
+
+def register_new_user(user_id, rating, account_id):
     try:
-        global_playground.register(user_id)
+        global_playground.register(user_id, rating, account_id)
     except AlreadyRegistered:
         raise NotPermittedUserException("User already registered")
 
@@ -61,7 +100,7 @@ async def process_messages(ws, user_id):
             logging.info('connection closed with exception {} with user_id {}'.format(ws.exception(), user_id))
             await handle_error(user_id)
         elif msg.type == WSMsgType.BINARY:
-            logging.info('Received BINARY type message')
+            await handle_binary_command(msg.data, user_id)
         elif msg.type == WSMsgType.CLOSE:
             logging.info('Received CLOSE type message')
         elif msg.type == WSMsgType.CLOSED: